@@ -15,11 +15,12 @@ class Ui_Dialog_manage_files(object):
         Dialog_manage_files.resize(794, 560)
         self.gridLayout = QtWidgets.QGridLayout(Dialog_manage_files)
         self.gridLayout.setObjectName("gridLayout")
-        self.tableWidget = QtWidgets.QTableWidget(Dialog_manage_files)
-        self.tableWidget.setObjectName("tableWidget")
-        self.tableWidget.setColumnCount(0)
-        self.tableWidget.setRowCount(0)
-        self.gridLayout.addWidget(self.tableWidget, 2, 0, 1, 1)
+        self.tableView = QtWidgets.QTableView(Dialog_manage_files)
+        self.tableView.setObjectName("tableView")
+        self.gridLayout.addWidget(self.tableView, 3, 0, 1, 1)
+        self.lineEdit_filter = QtWidgets.QLineEdit(Dialog_manage_files)
+        self.lineEdit_filter.setObjectName("lineEdit_filter")
+        self.gridLayout.addWidget(self.lineEdit_filter, 2, 0, 1, 1)
         self.groupBox = QtWidgets.QGroupBox(Dialog_manage_files)
         self.groupBox.setMinimumSize(QtCore.QSize(0, 60))
         self.groupBox.setTitle("")
@@ -51,6 +52,7 @@ class Ui_Dialog_manage_files(object):
         _translate = QtCore.QCoreApplication.translate
         Dialog_manage_files.setWindowTitle(_translate("Dialog_manage_files", "Files"))
         self.pushButton_view.setText(_translate("Dialog_manage_files", "View"))
+        self.lineEdit_filter.setPlaceholderText(_translate("Dialog_manage_files", "Filter file names"))
         self.pushButton_create.setText(_translate("Dialog_manage_files", "Create"))
         self.pushButton_export.setToolTip(_translate("Dialog_manage_files", "<html><head/><body><p>Make sure the file name does not contain unusual characters such as \': ; &quot; \' otherwise it will raise an error when trying to save this file. Rename the file if needed.</p></body></html>"))
         self.pushButton_export.setText(_translate("Dialog_manage_files", "Export"))
@@ -35,6 +35,9 @@ class Ui_Dialog_reportComparisons(object):
         self.pushButton_clear = QtWidgets.QPushButton(self.groupBox)
         self.pushButton_clear.setGeometry(QtCore.QRect(90, 70, 221, 41))
         self.pushButton_clear.setObjectName("pushButton_clear")
+        self.pushButton_all_coders = QtWidgets.QPushButton(self.groupBox)
+        self.pushButton_all_coders.setGeometry(QtCore.QRect(370, 70, 231, 41))
+        self.pushButton_all_coders.setObjectName("pushButton_all_coders")
         self.verticalLayout.addWidget(self.groupBox)
         self.label_selections = QtWidgets.QLabel(Dialog_reportComparisons)
         self.label_selections.setMinimumSize(QtCore.QSize(0, 50))
@@ -65,6 +68,7 @@ class Ui_Dialog_reportComparisons(object):
         self.pushButton_run.setText(_translate("Dialog_reportComparisons", "Run Comparisons"))
         self.label_2.setText(_translate("Dialog_reportComparisons", "Coders:"))
         self.pushButton_clear.setText(_translate("Dialog_reportComparisons", "Clear selection"))
+        self.pushButton_all_coders.setText(_translate("Dialog_reportComparisons", "Compare all coders"))
         self.label_selections.setText(_translate("Dialog_reportComparisons", "Coders selected:"))
 
 
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def load_codings(conn, coders=None):
+    """ Get all text codings in one query, grouped by code, file and coder.
+    param: conn - sqlite3 connection
+    param: coders - list of owner names to load, or None for all coders
+    return: dictionary of cid: {fid: {owner: [(pos0, pos1), ...]}}
+    """
+
+    sql = "select cid, fid, owner, pos0, pos1 from code_text"
+    values = []
+    if coders is not None:
+        sql += " where owner in (" + ",".join("?" * len(coders)) + ")"
+        values = list(coders)
+    sql += " order by cid, fid, owner, pos0"
+    cur = conn.cursor()
+    cur.execute(sql, values)
+    codings = {}
+    for cid, fid, owner, pos0, pos1 in cur.fetchall():
+        codings.setdefault(cid, {}).setdefault(fid, {}).setdefault(owner, []).append((pos0, pos1))
+    return codings
+
+
+def merge_intervals(intervals, length):
+    """ Merge overlapping (pos0, pos1) intervals, end exclusive, clipped to 0 to length.
+    Text coded more than once by the same coder is only counted once.
+    return: sorted list of non-overlapping intervals """
+
+    merged = []
+    for pos0, pos1 in sorted(intervals):
+        pos0 = max(pos0, 0)
+        pos1 = min(pos1, length)
+        if pos0 >= pos1:
+            continue
+        if merged and pos0 <= merged[-1][1]:
+            if pos1 > merged[-1][1]:
+                merged[-1] = (merged[-1][0], pos1)
+        else:
+            merged.append((pos0, pos1))
+    return merged
+
+
+def covered_length(merged):
+    """ Number of characters in a list of merged intervals. """
+
+    return sum(pos1 - pos0 for pos0, pos1 in merged)
+
+
+def intersection_length(merged0, merged1):
+    """ Number of characters in both lists of merged intervals. Two pointer sweep. """
+
+    total = 0
+    i = 0
+    j = 0
+    while i < len(merged0) and j < len(merged1):
+        pos0 = max(merged0[i][0], merged1[j][0])
+        pos1 = min(merged0[i][1], merged1[j][1])
+        if pos1 > pos0:
+            total += pos1 - pos0
+        if merged0[i][1] < merged1[j][1]:
+            i += 1
+        else:
+            j += 1
+    return total
+
+
+def two_coder_totals(file_codings, file_summaries, coder0, coder1):
+    """ Count the characters coded by both, one or neither coder, for one code.
+    param: file_codings - dictionary of fid: {owner: [(pos0, pos1), ...]} for the code
+    param: file_summaries - list of (fid, text length) for all text files
+    return: dictionary of dual_coded, single_coded, uncoded, characters, coded0, coded1
+    """
+
+    # coded0 and coded1 are the total characters coded by coder 0 and coder 1
+    total = {'dual_coded': 0, 'single_coded': 0, 'uncoded': 0, 'characters': 0, 'coded0': 0, 'coded1': 0}
+    for fid, length in file_summaries:
+        length = length or 0
+        total['characters'] += length
+        owners = file_codings.get(fid, {})
+        merged0 = merge_intervals(owners.get(coder0, []), length)
+        merged1 = merge_intervals(owners.get(coder1, []), length)
+        coded0 = covered_length(merged0)
+        coded1 = covered_length(merged1)
+        dual = intersection_length(merged0, merged1)
+        total['coded0'] += coded0
+        total['coded1'] += coded1
+        total['dual_coded'] += dual
+        total['single_coded'] += coded0 + coded1 - 2 * dual
+        total['uncoded'] += length - (coded0 + coded1 - dual)
+    return total
+
+
+def agreement_statistics(total):
+    """ Add percentage agreement, dual coded, uncoded, disagreement and kappa to the
+    character totals from two_coder_totals.
+
+    Cohen's Kappa, https://en.wikipedia.org/wiki/Cohen%27s_kappa
+
+    k = Po - Pe     Po is proportionate agreement (both coders coded this text / all coded text))
+        -------     Pe is probability of random agreement
+        1  - Pe
+
+        Pe = Pyes + Pno
+        Pyes = proportion Yes by A multiplied by proportion Yes by B
+             = total['coded0']/total_coded * total['coded1]/total_coded
+
+        Pno = proportion No by A multiplied by proportion No by B
+            = (total_coded - total['coded0']) / total_coded * (total_coded - total['coded1]) / total_coded
+
+    Only the proportions of coded characters are used, using all characters results in
+    the total agreement score.
+    NEED TO CONFIRM THIS IS THE CORRECT APPROACH
+    """
+
+    if total['characters'] == 0:
+        total['agreement'] = total['dual_percent'] = total['uncoded_percent'] = total['disagreement'] = 0
+        total['kappa'] = "zerodiv"
+        return total
+    total['agreement'] = round(100 * (total['dual_coded'] + total['uncoded']) / total['characters'], 2)
+    total['dual_percent'] = round(100 * total['dual_coded'] / total['characters'], 2)
+    total['uncoded_percent'] = round(100 * total['uncoded'] / total['characters'], 2)
+    total['disagreement'] = round(100 - total['agreement'], 2)
+    total['kappa'] = "zerodiv"
+    unique_codings = total['coded0'] + total['coded1'] - total['dual_coded']
+    try:
+        Po = total['dual_coded'] / unique_codings
+        Pyes = total['coded0'] / unique_codings * total['coded1'] / unique_codings
+        Pno = (unique_codings - total['coded0']) / unique_codings * (unique_codings - total['coded1']) / unique_codings
+        Pe = Pyes * Pno
+        total['kappa'] = round((Po - Pe) / (1 - Pe), 4)
+    except ZeroDivisionError:
+        msg = _("ZeroDivisionError. unique_codings:") + str(unique_codings)
+        logger.debug(msg)
+    return total
+
+
+def multi_coder_agreement(file_codings, file_summaries, coders):
+    """ Compare all coders for one code in one sweep of each file.
+    The merged intervals of every coder are swept together, each stretch of text has
+    the set of coders who coded it. From these the two-coder totals for every pair of
+    coders and Fleiss' kappa (coded or not coded, per character) are calculated.
+    param: file_codings - dictionary of fid: {owner: [(pos0, pos1), ...]} for the code
+    param: file_summaries - list of (fid, text length) for all text files
+    param: coders - list of owner names, at least two
+    return: dictionary of 'pairs': {(coder0, coder1): statistics}, 'fleiss_kappa': kappa
+    """
+
+    n = len(coders)
+    characters = 0
+    coded = [0] * n
+    dual = {}
+    for i in range(n):
+        for j in range(i + 1, n):
+            dual[(i, j)] = 0
+    agreeing_pairs = 0  # sum over coded characters of agreeing rater pairs
+    coded_ratings = 0
+    any_coded = 0
+    for fid, length in file_summaries:
+        length = length or 0
+        characters += length
+        owners = file_codings.get(fid, {})
+        events = []
+        for i, coder in enumerate(coders):
+            merged = merge_intervals(owners.get(coder, []), length)
+            coded[i] += covered_length(merged)
+            for pos0, pos1 in merged:
+                events.append((pos0, 1, i))
+                events.append((pos1, -1, i))
+        events.sort()
+        active = set()
+        previous = 0
+        for pos, change, i in events:
+            if pos > previous and active:
+                span = pos - previous
+                k = len(active)
+                any_coded += span
+                coded_ratings += k * span
+                agreeing_pairs += span * (k * (k - 1) + (n - k) * (n - k - 1))
+                for a in active:
+                    for b in active:
+                        if a < b:
+                            dual[(a, b)] += span
+            previous = pos
+            if change == 1:
+                active.add(i)
+            else:
+                active.discard(i)
+
+    pairs = {}
+    for (i, j), dual_coded in dual.items():
+        total = {'dual_coded': dual_coded, 'single_coded': coded[i] + coded[j] - 2 * dual_coded,
+            'uncoded': characters - (coded[i] + coded[j] - dual_coded), 'characters': characters,
+            'coded0': coded[i], 'coded1': coded[j]}
+        pairs[(coders[i], coders[j])] = agreement_statistics(total)
+
+    # Fleiss' kappa, https://en.wikipedia.org/wiki/Fleiss%27_kappa
+    # Uncoded characters are agreed on by all pairs of coders
+    fleiss_kappa = "zerodiv"
+    if characters > 0 and n > 1:
+        agreeing_pairs += (characters - any_coded) * n * (n - 1)
+        P_bar = agreeing_pairs / (characters * n * (n - 1))
+        p_coded = coded_ratings / (characters * n)
+        Pe = p_coded ** 2 + (1 - p_coded) ** 2
+        if Pe < 1:
+            fleiss_kappa = round((P_bar - Pe) / (1 - Pe), 4)
+    return {'pairs': pairs, 'fleiss_kappa': fleiss_kappa}
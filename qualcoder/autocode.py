@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+import logging
+import pathlib
+import re
+import sqlite3
+
+from PyQt5 import QtCore
+
+logger = logging.getLogger(__name__)
+
+
+def find_texts(text, texts):
+    """ Find every occurrence of each search text, in one pass over the text.
+    The search texts are combined into one alternation to find the positions where any
+    of them starts, then each search text is checked at that position. So matches of
+    different search texts may overlap, e.g. cat and category, as when each search text
+    is searched for separately. Matches of the same search text do not overlap.
+    param: text - the file text
+    param: texts - list of search texts, not empty strings
+    return: list of (pos0, pos1, search text), sorted by pos0
+    """
+
+    if not texts or not text:
+        return []
+    ordered = sorted(set(texts), key=len, reverse=True)
+    pattern = re.compile("(?=" + "|".join(re.escape(t) for t in ordered) + ")")
+    next_start = dict.fromkeys(ordered, 0)
+    matches = []
+    for match in pattern.finditer(text):
+        pos = match.start()
+        for txt in ordered:
+            if pos >= next_start[txt] and text.startswith(txt, pos):
+                matches.append((pos, pos + len(txt), txt))
+                next_start[txt] = pos + len(txt)
+    return matches
+
+
+class AutocodeSignals(QtCore.QObject):
+    """ Signals from AutocodeWorker. QRunnable is not a QObject, so cannot have signals.
+    progress - number of files done
+    finished - list of code_text rows ready to insert, and the names of the files searched
+    error - message """
+
+    progress = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal(list, list)
+    error = QtCore.pyqtSignal(str)
+
+
+class AutocodeWorker(QtCore.QRunnable):
+    """ Find the search texts in the selected files, in a QThreadPool thread.
+    The worker uses its own read only database connection, as an sqlite3 connection
+    cannot be used from another thread. The rows are inserted by the coding dialog
+    when finished is emitted. Not emitted if cancelled.
+    param: db_path - absolute path of data.qda """
+
+    def __init__(self, db_path, files, texts, cid, owner, date):
+
+        super(AutocodeWorker, self).__init__()
+        self.db_path = db_path
+        self.files = files
+        self.texts = texts
+        self.cid = cid
+        self.owner = owner
+        self.date = date
+        self.cancelled = False
+        self.signals = AutocodeSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        rows = []
+        filenames = []
+        try:
+            conn = sqlite3.connect(pathlib.Path(self.db_path).as_uri() + "?mode=ro", uri=True)
+            try:
+                cur = conn.cursor()
+                for i, f in enumerate(self.files):
+                    if self.cancelled:
+                        return
+                    cur.execute("select fulltext from source where id=? and mediapath is Null", [f['id']])
+                    result = cur.fetchone()
+                    if result is not None and result[0] is not None:
+                        filenames.append(f['name'])
+                        for pos0, pos1, txt in find_texts(result[0], self.texts):
+                            rows.append((self.cid, int(f['id']), txt, pos0, pos1, self.owner, "", self.date))
+                    self.signals.progress.emit(i + 1)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("Autocode: " + str(e))
+            self.signals.error.emit(str(e))
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(rows, filenames)
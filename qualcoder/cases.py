@@ -622,23 +622,13 @@ class DialogCases(QtWidgets.QDialog):
                 path = self.app.project_path + c['mediapath']
                 url = QtCore.QUrl(path)
                 document = self.ui.textBrowser.document()
-                image = QtGui.QImageReader(path).read()
+                # thumbnail at most 400 wide or high
+                image = self.app.get_image_cache().get(path, max_size=400)
                 document.addResource(QtGui.QTextDocument.ImageResource, url, QtCore.QVariant(image))
                 cursor = self.ui.textBrowser.textCursor()
                 image_format = QtGui.QTextImageFormat()
-                scaler = 1.0
-                scaler_w = 1.0
-                scaler_h = 1.0
-                if image.width() > 400:
-                    scaler_w = 400 / image.width()
-                if image.height() > 400:
-                    scaler_h = 400 / image.height()
-                if scaler_w < scaler_h:
-                    scaler = scaler_w
-                else:
-                    scaler = scaler_h
-                image_format.setWidth(image.width() * scaler)
-                image_format.setHeight(image.height() * scaler)
+                image_format.setWidth(image.width())
+                image_format.setHeight(image.height())
                 image_format.setName(url.toString())
                 cursor.insertImage(image_format)
                 self.ui.textBrowser.append("<br />")
@@ -25,7 +25,6 @@ Author: Colin Curtain (ccbogel)
 https://github.com/ccbogel/QualCoder
 '''
 
-from copy import deepcopy
 import datetime
 import logging
 import os
@@ -40,12 +39,18 @@ from PyQt5.QtCore import Qt  # for context menu
 from PyQt5.QtGui import QBrush
 
 from add_item_name import DialogAddItemName
+from autocode import AutocodeWorker
+from coding_highlight import add_span, apply_format_runs, format_runs, missing_spans
 from color_selector import DialogColorSelect
 from color_selector import colors
+from code_tree import fill_code_tree, update_code_tree
 from confirm_delete import DialogConfirmDelete
 from GUI.ui_dialog_codes import Ui_Dialog_codes
 from helpers import CodedMediaMixin
+from interval_index import IntervalIndex
 from memo import DialogMemo
+from project_model import CODE_DELETED, CODE_MERGED, CODE_RECOLOURED, CODE_RENAMED, FILE_ADDED, \
+    FILE_DELETED, FILE_RENAMED, RELOADED
 from qtmodels import DictListModel, ListObjectModel
 from select_file import DialogSelectFile
 
@@ -72,6 +77,9 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
     NAME_COLUMN = 0
     ID_COLUMN = 1
     MEMO_COLUMN = 2
+    LAZY_HIGHLIGHT_LENGTH = 200000  # files longer than this are highlighted as they scroll into view
+    HIGHLIGHT_MARGIN = 5000  # characters highlighted before and after the visible text
+    SEARCH_DELAY = 300  # milliseconds after the last key press before searching
     app = None
     dialog_list = None
     parent_textEdit = None
@@ -79,12 +87,21 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
     categories = []
     filenames = []
     filename = None  # contains filename and file id returned from SelectFile
+    file_record = None  # name, id, fulltext, memo, owner, date of the current file
     sourceText = None
     code_text = []
+    code_text_index = None  # IntervalIndex of code_text for the current file
     annotations = []
+    annotation_index = None  # IntervalIndex of annotations for the current file
+    lazy_highlight = False
+    highlighted_spans = []  # (pos0, pos1) spans already highlighted, when lazy_highlight
     search_indices = []
     search_index = 0
     eventFilter = None
+    search_timer = None
+    autocode_worker = None
+    autocode_progress = None
+    autocode_texts = []
 
     def __init__(self, app, parent_textEdit, dialog_list):
 
@@ -97,11 +114,16 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         self.categories = []
         self.filenames = self.app.get_text_filenames()
         self.annotations = self.app.get_annotations()
+        self.code_text_index = IntervalIndex()
+        self.annotation_index = IntervalIndex()
+        self.lazy_highlight = False
+        self.highlighted_spans = []
         self.search_indices = []
         self.search_index = 0
         self.get_codes_and_categories()
         self.ui = Ui_Dialog_codes()
         self.ui.setupUi(self)
+        self.app.get_project_model().changed.connect(self.project_changed)
         font = 'font: ' + str(self.app.settings['fontsize']) + 'pt '
         font += '"' + self.app.settings['font'] + '";'
         self.setStyleSheet(font)
@@ -120,11 +142,18 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         self.ui.textEdit.setContextMenuPolicy(Qt.CustomContextMenu)
         self.ui.textEdit.customContextMenuRequested.connect(self.textEdit_menu)
         self.ui.textEdit.cursorPositionChanged.connect(self.coded_in_text)
+        self.ui.textEdit.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        self.ui.textEdit.verticalScrollBar().rangeChanged.connect(self.highlight_visible)
         self.ui.pushButton_view_file.clicked.connect(self.view_file_dialog)
         self.ui.pushButton_auto_code.clicked.connect(self.auto_code)
         self.ui.checkBox_show_coders.setEnabled(False)  # to allow viewing other codes, todo maybe?
         #self.ui.checkBox_show_coders.stateChanged.connect(self.view_file)   # todo maybe?
-        self.ui.lineEdit_search.textEdited.connect(self.search_for_text)
+        # Wait for a pause in typing before searching
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_for_text)
+        self.ui.lineEdit_search.textEdited.connect(self.search_timer.start)
         self.ui.checkBox_search_escaped.stateChanged.connect(self.search_for_text)
         self.ui.checkBox_search_all_files.stateChanged.connect(self.search_for_text)
         self.ui.checkBox_search_case.stateChanged.connect(self.search_for_text)
@@ -154,88 +183,13 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
     def fill_tree(self):
         """ Fill tree widget, top level items are main categories and unlinked codes. """
 
-        cats = deepcopy(self.categories)
-        codes = deepcopy(self.codes)
         self.ui.treeWidget.clear()
         self.ui.treeWidget.setColumnCount(3)
         self.ui.treeWidget.setHeaderLabels([_("Name"), _("Id"), _("Memo")])
         self.ui.treeWidget.setColumnHidden(1, True)
         self.ui.treeWidget.header().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
         self.ui.treeWidget.header().setStretchLastSection(False)
-        # add top level categories
-        remove_list = []
-        for c in cats:
-            if c['supercatid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = _("Memo")
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                top_item.setToolTip(0, c['owner'] + "\n" + c['date'])
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_list.append(c)
-        for item in remove_list:
-            #try:
-            cats.remove(item)
-            #except Exception as e:
-            #    logger.debug(e, item)
-
-        ''' Add child categories. look at each unmatched category, iterate through tree
-         to add as child, then remove matched categories from the list '''
-        count = 0
-        while len(cats) > 0 or count < 10000:
-            remove_list = []
-            #logger.debug("Cats: " + str(cats))
-            for c in cats:
-                it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-                item = it.value()
-                while item:  # while there is an item in the list
-                    if item.text(1) == 'catid:' + str(c['supercatid']):
-                        memo = ""
-                        if c['memo'] != "":
-                            memo = _("Memo")
-                        child = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                        child.setToolTip(0, c['owner'] + "\n" + c['date'])
-                        item.addChild(child)
-                        remove_list.append(c)
-                    it += 1
-                    item = it.value()
-            for item in remove_list:
-                cats.remove(item)
-            count += 1
-
-        # add unlinked codes as top level items
-        remove_items = []
-        for c in codes:
-            if c['catid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = _("Memo")
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
-                top_item.setToolTip(0, c['owner'] + "\n" + c['date'])
-                top_item.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                top_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_items.append(c)
-        for item in remove_items:
-            codes.remove(item)
-
-        # add codes as children
-        for c in codes:
-            it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-            item = it.value()
-            while item:
-                if item.text(1) == 'catid:' + str(c['catid']):
-                    memo = ""
-                    if c['memo'] != "":
-                        memo = _("Memo")
-                    child = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
-                    child.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                    child.setToolTip(0, c['owner'] + "\n" + c['date'])
-                    child.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-                    item.addChild(child)
-                    c['catid'] = -1  # Make unmatchable
-                it += 1
-                item = it.value()
+        fill_code_tree(self.ui.treeWidget, self.categories, self.codes)
         self.ui.treeWidget.expandAll()
 
     def get_codes_and_categories(self):
@@ -276,8 +230,14 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
                 self.search_indices = []
                 if self.ui.checkBox_search_all_files.isChecked():
                     """ Search for this text across all files. Show each file in textEdit
+                    For literal text the full text index gives the files that may contain it.
                     """
-                    for filedata in self.app.get_file_texts():
+                    files = None
+                    if self.ui.checkBox_search_escaped.isChecked() or re.search(r"[.^$*+?{}\[\]\\|()]", search_term) is None:
+                        files = self.app.get_file_texts_containing(search_term)
+                    if files is None:
+                        files = self.app.get_file_texts()
+                    for filedata in files:
                         try:
                             text = filedata['fulltext']
                             for match in pattern.finditer(text):
@@ -287,10 +247,9 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
                 else:
                     try:
                         if self.sourceText:
+                            filedata = self.file_record
                             for match in pattern.finditer(self.sourceText):
-                                # Get result as first dictionary item
-                                filedata = self.app.get_file_texts([self.filename['id'], ])[0]
-                                self.search_indices.append((filedata,match.start(), len(match.group(0))))
+                                self.search_indices.append((filedata, match.start(), len(match.group(0))))
                     except:
                         logger.exception('Failed searching current file for %s',search_term)
                 if len(self.search_indices) > 0:
@@ -320,10 +279,8 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         selectedText = self.ui.textEdit.textCursor().selectedText()
         menu = QtWidgets.QMenu()
         action_unmark = None
-        for item in self.code_text:
-            if cursor.position() >= item['pos0'] and cursor.position() <= item['pos1']:
-                action_unmark = menu.addAction(_("Unmark"))
-                break
+        if self.code_text_index.at(cursor.position()):
+            action_unmark = menu.addAction(_("Unmark"))
         if selectedText != "":
             action_mark = menu.addAction(_("Mark"))
             action_annotate = menu.addAction(_("Annotate"))
@@ -434,7 +391,8 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             cur.execute("update code_cat set supercatid=? where catid=?",
             [self.categories[found]['supercatid'], self.categories[found]['catid']])
             self.app.conn.commit()
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().move_category(self.categories[found]['catid'],
+                self.categories[found]['supercatid'])
 
         # find the code in the list
         if item.text(1)[0:3] == 'cid':
@@ -458,7 +416,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             cur.execute("update code_name set catid=? where cid=?",
             [self.codes[found]['catid'], self.codes[found]['cid']])
             self.app.conn.commit()
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().move_code(self.codes[found]['cid'], self.codes[found]['catid'])
 
     def merge_codes(self, item, parent):
         """ Merge code or category with another code or category.
@@ -486,10 +444,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         self.app.conn.commit()
         msg = msg.replace("\n", " ")
         self.parent_textEdit.append(msg)
-        self.update_dialog_codes_and_categories()
-        #TODO
-        # update filter for tooltip
-        self.eventFilterTT.setCodes(self.code_text, self.codes)
+        self.app.get_project_model().merge_codes(old_cid, new_cid)
 
     def add_code(self):
         """ Use add_item dialog to get new code text. Add_code_name dialog checks for
@@ -519,50 +474,27 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         self.ui.treeWidget.addTopLevelItem(top_item)
         self.ui.treeWidget.setCurrentItem(top_item)'''
         self.parent_textEdit.append(_("New code: ") + item['name'])
-        self.update_dialog_codes_and_categories()
-        self.get_coded_text_update_eventfilter_tooltips()
+        self.app.get_project_model().add_code(item)
 
-    def update_dialog_codes_and_categories(self):
-        """ Update code and category tree in DialogCodeImage, DialogCodeAV,
-        DialogCodeText, DialogReportCodes.
-        Not using isinstance for other classes as could not import the classes to test
-        against. There was an import error.
-        Using try except blocks for each instance, as instance may have been deleted. """
+    def project_changed(self, change):
+        """ Apply a code, category or file change from the project model.
+        Codes and categories are copied from the model, the tree is updated in place
+        where possible. Codings are only reloaded if codes were merged or deleted. """
 
-        for d in self.dialog_list:
-            if isinstance(d, DialogCodeText):
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.unlight()
-                    d.highlight()
-                    d.get_coded_text_update_eventfilter_tooltips()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'view_av.DialogCodeAV'>":
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.load_segments()
-                    d.unlight()
-                    d.highlight()
-                    d.get_coded_text_update_eventfilter_tooltips()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'view_image.DialogCodeImage'>":
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.get_coded_areas()
-                    d.draw_coded_areas()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'reports.DialogReportCodes'>":
-                try:
-                    d.get_data()
-                    d.fill_tree()
-                except RuntimeError as e:
-                    pass
+        try:
+            self.codes, self.categories = self.app.get_project_model().get_data()
+            if change.kind in (FILE_ADDED, FILE_RENAMED, FILE_DELETED, RELOADED):
+                self.filenames = self.app.get_text_filenames()
+            if not update_code_tree(self.ui.treeWidget, change):
+                self.fill_tree()
+            if change.kind in (CODE_MERGED, CODE_DELETED, RELOADED):
+                self.get_coded_text_update_eventfilter_tooltips()
+            elif change.kind == CODE_RECOLOURED:
+                self.highlight()
+            elif change.kind == CODE_RENAMED:
+                self.eventFilterTT.setCodes(self.code_text, self.codes, self.code_text_index)
+        except RuntimeError as e:
+            pass
 
     def add_category(self):
         """ When button pressed, add a new category.
@@ -581,14 +513,10 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         cur.execute("insert into code_cat (name, memo, owner, date, supercatid) values(?,?,?,?,?)"
             , (item['name'], item['memo'], item['owner'], item['date'], None))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
-        '''cur.execute("select last_insert_rowid()")
-        catid = cur.fetchone()[0]
-        item['catid'] = catid
-        self.categories.append(item)
-        # update widget
-        top_item = QtWidgets.QTreeWidgetItem([item['name'], 'catid:' + str(item['catid']), ""])
-        self.ui.treeWidget.addTopLevelItem(top_item)'''
+        cur.execute("select last_insert_rowid()")
+        item['catid'] = cur.fetchone()[0]
+        item['supercatid'] = None
+        self.app.get_project_model().add_category(item)
         self.parent_textEdit.append(_("New category: ") + item['name'])
 
     def delete_category_or_code(self, selected):
@@ -623,9 +551,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         cur.execute("delete from code_image where cid=?", [code_['cid'], ])
         self.app.conn.commit()
         selected = None
-        #self.get_codes_and_categories()
-        #self.fill_tree()
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().delete_code(code_['cid'])
         self.parent_textEdit.append(_("Code deleted: ") + code_['name'] + "\n")
         # update filter for tooltip
         #self.eventFilterTT.setCodes(self.code_text, self.codes)
@@ -647,13 +573,11 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             return
         cur = self.app.conn.cursor()
         cur.execute("update code_name set catid=null where catid=?", [category['catid'], ])
-        cur.execute("update code_cat set supercatid=null where catid = ?", [category['catid'], ])
+        cur.execute("update code_cat set supercatid=null where supercatid = ?", [category['catid'], ])
         cur.execute("delete from code_cat where catid = ?", [category['catid'], ])
         self.app.conn.commit()
         selected = None
-        #self.get_codes_and_categories()
-        #self.fill_tree()
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().delete_category(category['catid'])
         self.parent_textEdit.append(_("Category deleted: ") + category['name'])
 
     def add_edit_memo(self, selected):
@@ -675,6 +599,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
                 cur = self.app.conn.cursor()
                 cur.execute("update code_name set memo=? where cid=?", (memo, self.codes[found]['cid']))
                 self.app.conn.commit()
+                self.app.get_project_model().set_code_memo(self.codes[found]['cid'], memo)
             if memo == "":
                 selected.setData(2, QtCore.Qt.DisplayRole, "")
             else:
@@ -697,12 +622,12 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
                 cur = self.app.conn.cursor()
                 cur.execute("update code_cat set memo=? where catid=?", (memo, self.categories[found]['catid']))
                 self.app.conn.commit()
+                self.app.get_project_model().set_category_memo(self.categories[found]['catid'], memo)
             if memo == "":
                 selected.setData(2, QtCore.Qt.DisplayRole, "")
             else:
                 selected.setData(2, QtCore.Qt.DisplayRole, _("Memo"))
                 self.parent_textEdit.append(_("Memo for category: ") + self.categories[found]['name'])
-        self.update_dialog_codes_and_categories()
 
     def rename_category_or_code(self, selected):
         """ Rename a code or category.
@@ -734,9 +659,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             #self.codes[found]['name'] = new_name
             #selected.setData(0, QtCore.Qt.DisplayRole, new_name)
             self.parent_textEdit.append(_("Code renamed from: ") + old_name + _(" to: ") + new_name)
-            self.update_dialog_codes_and_categories()
-            # Update filter for tooltip
-            #self.eventFilterTT.setCodes(self.code_text, self.codes)
+            self.app.get_project_model().rename_code(self.codes[found]['cid'], new_name)
             return
 
         if selected.text(1)[0:3] == 'cat':
@@ -765,7 +688,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             old_name = self.categories[found]['name']
             #self.categories[found]['name'] = new_name
             #selected.setData(0, QtCore.Qt.DisplayRole, new_name)
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().rename_category(self.categories[found]['catid'], new_name)
             self.parent_textEdit.append(_("Category renamed from: ") + old_name + _(" to: ") + new_name)
 
     def change_code_color(self, selected):
@@ -792,8 +715,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         cur.execute("update code_name set color=? where cid=?",
         (self.codes[found]['color'], self.codes[found]['cid']))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
-        #self.highlight()
+        self.app.get_project_model().recolour_code(self.codes[found]['cid'], new_color)
 
     def view_file_dialog(self):
         """ When view file button is pressed a dialog of filenames is presented to the user.
@@ -815,9 +737,14 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         self.filename = filedata
         sql_values = []
         file_result = self.app.get_file_texts([filedata['id']])[0]
+        self.file_record = file_result
         sql_values.append(int(file_result['id']))
         self.sourceText = file_result['fulltext']
+        # Codings for this file are not loaded yet, so do not highlight while the text is set
+        self.lazy_highlight = False
         self.ui.textEdit.setPlainText(self.sourceText)
+        self.lazy_highlight = len(self.sourceText) > self.LAZY_HIGHLIGHT_LENGTH
+        self.highlighted_spans = []
         self.ui.label_file.setText("File " + str(file_result['id']) + " : " + file_result['name'])
         self.get_coded_text_update_eventfilter_tooltips()
 
@@ -841,9 +768,14 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         for row in code_results:
             self.code_text.append({'cid': row[0], 'fid': row[1], 'seltext': row[2],
             'pos0': row[3], 'pos1': row[4], 'owner': row[5], 'date': row[6], 'memo': row[7]})
+        text_length = 0
+        if self.sourceText is not None:
+            text_length = len(self.sourceText) + 1
+        self.code_text_index = IntervalIndex(self.code_text, text_length)
+        file_annotations = [a for a in self.annotations if a['fid'] == self.filename['id']]
+        self.annotation_index = IntervalIndex(file_annotations, text_length)
         # Update filter for tooltip and redo formatting
-        self.eventFilterTT.setCodes(self.code_text, self.codes)
-        self.unlight()
+        self.eventFilterTT.setCodes(self.code_text, self.codes, self.code_text_index)
         self.highlight()
 
     def unlight(self):
@@ -851,45 +783,65 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
 
         if self.sourceText is None:
             return
-        cursor = self.ui.textEdit.textCursor()
-        cursor.setPosition(0, QtGui.QTextCursor.MoveAnchor)
-        cursor.setPosition(len(self.sourceText) - 1, QtGui.QTextCursor.KeepAnchor)
-        cursor.setCharFormat(QtGui.QTextCharFormat())
+        if not self.lazy_highlight:
+            apply_format_runs(self.ui.textEdit, [], 0, len(self.sourceText))
+            return
+        for pos0, pos1 in self.highlighted_spans:
+            apply_format_runs(self.ui.textEdit, [], pos0, pos1)
+        self.highlighted_spans = []
 
     def highlight(self):
         """ Apply text highlighting to current file.
-        If no colour has been assigned to a code, those coded text fragments are coloured gray.
-        Each code text item contains: fid, date, pos0, pos1, seltext, cid, status, memo,
-        name, owner. """
+        If no colour has been assigned to a code, those coded text fragments are coloured light red.
+        Codings with memos are italicised, annotations are in bold.
+        Overlapping codings are merged into non-overlapping format runs, one format per run.
+        Large files are highlighted lazily, only the visible text is done here. """
 
-        if self.sourceText is not None:
-            fmt = QtGui.QTextCharFormat()
-            cursor = self.ui.textEdit.textCursor()
-
-            # Add coding highlights
-            codes = {x['cid']:x for x in self.codes}
-            for item in self.code_text:
-                cursor.setPosition(int(item['pos0']), QtGui.QTextCursor.MoveAnchor)
-                cursor.setPosition(int(item['pos1']), QtGui.QTextCursor.KeepAnchor)
-                color = codes.get(item['cid'],{}).get('color',"#F8E0E0")  # default light red
-                fmt.setBackground(QtGui.QBrush(QtGui.QColor(color)))
-                # Highlight codes with memos - these are italicised
-                if item['memo'] is not None and item['memo'] != "":
-                    fmt.setFontItalic(True)
-                else:
-                    fmt.setFontItalic(False)
-                    fmt.setFontWeight(QtGui.QFont.Normal)
-                cursor.setCharFormat(fmt)
-
-            # Add annotation marks - these are in bold
-            for note in self.annotations:
-                if len(self.filename.keys()) > 0:  # will be zero if using autocode and no file is loaded
-                    if note['fid'] == self.filename['id']:
-                        cursor.setPosition(int(note['pos0']), QtGui.QTextCursor.MoveAnchor)
-                        cursor.setPosition(int(note['pos1']), QtGui.QTextCursor.KeepAnchor)
-                        formatB = QtGui.QTextCharFormat()
-                        formatB.setFontWeight(QtGui.QFont.Bold)
-                        cursor.mergeCharFormat(formatB)
+        if self.sourceText is None:
+            return
+        if not self.lazy_highlight:
+            self.highlight_span(0, len(self.sourceText))
+            return
+        self.unlight()
+        self.highlight_visible()
+
+    def highlight_visible(self):
+        """ For large files, highlight the visible blocks of text plus a margin.
+        Text already highlighted is skipped. Called when the text is scrolled or resized. """
+
+        if self.sourceText is None or not self.lazy_highlight:
+            return
+        pos0, pos1 = self.visible_span()
+        for start, end in missing_spans(self.highlighted_spans, pos0, pos1):
+            self.highlight_span(start, end)
+
+    def visible_span(self):
+        """ Get the character positions of the visible text blocks, extended by the margin.
+        return: pos0, pos1 """
+
+        text_edit = self.ui.textEdit
+        viewport = text_edit.viewport()
+        document = text_edit.document()
+        pos0 = text_edit.cursorForPosition(QtCore.QPoint(0, 0)).position()
+        pos1 = text_edit.cursorForPosition(QtCore.QPoint(viewport.width() - 1, viewport.height() - 1)).position()
+        pos0 = document.findBlock(max(pos0 - self.HIGHLIGHT_MARGIN, 0)).position()
+        block = document.findBlock(min(pos1 + self.HIGHLIGHT_MARGIN, len(self.sourceText)))
+        pos1 = block.position() + block.length()
+        return pos0, min(pos1, len(self.sourceText))
+
+    def highlight_span(self, pos0, pos1):
+        """ Re-render the coding and annotation formats from pos0 to pos1 only.
+        Used after mark, unmark and annotate so only the changed text is repainted. """
+
+        if self.sourceText is None:
+            return
+        codings = self.code_text_index.overlapping(pos0, pos1)
+        notes = self.annotation_index.overlapping(pos0, pos1)
+        colors = {c['cid']: c['color'] for c in self.codes}
+        runs = format_runs(codings, notes, colors, pos0, pos1)
+        apply_format_runs(self.ui.textEdit, runs, pos0, pos1)
+        if self.lazy_highlight:
+            self.highlighted_spans = add_span(self.highlighted_spans, pos0, pos1)
 
     def mark(self):
         """ Mark selected text in file with currently selected code.
@@ -914,7 +866,8 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         'pos0': pos0, 'pos1': pos1, 'owner': self.app.settings['codername'], 'memo': "",
         'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
         self.code_text.append(coded)
-        self.highlight()
+        self.code_text_index.add(coded)
+        self.highlight_span(pos0, pos1)
         cur = self.app.conn.cursor()
 
         # Check for an existing duplicated marking first
@@ -935,7 +888,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         except Exception as e:
             logger.debug(str(e))
         # Update filter for tooltip
-        self.eventFilterTT.setCodes(self.code_text, self.codes)
+        self.eventFilterTT.setCodes(self.code_text, self.codes, self.code_text_index)
 
     def coded_in_text(self):
         """ When coded text is clicked on, the code name is displayed in the label above
@@ -944,12 +897,10 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         labelText = _("Coded: ")
         self.ui.label_coded.setText(labelText)
         pos = self.ui.textEdit.textCursor().position()
-        for item in self.code_text:
-            if item['pos0'] <= pos and item['pos1'] >= pos:
-                # logger.debug("Code name for selected pos0:" + str(item['pos0'])+" pos1:"+str(item['pos1'])
-                for code in self.codes:
-                    if code['cid'] == item['cid']:
-                        labelText = _("Coded: ") + code['name']
+        codes = {c['cid']: c for c in self.codes}
+        for item in self.code_text_index.at(pos):
+            if item['cid'] in codes:
+                labelText = _("Coded: ") + codes[item['cid']]['name']
         self.ui.label_coded.setText(labelText)
 
     def unmark(self, location):
@@ -958,8 +909,8 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         if self.filename == {}:
             return
         unmarked = None
-        for item in self.code_text:
-            if location >= item['pos0'] and location <= item['pos1'] and item['owner'] == self.app.settings['codername']:
+        for item in self.code_text_index.at(location):
+            if item['owner'] == self.app.settings['codername']:
                 unmarked = item
         if unmarked is None:
             return
@@ -971,11 +922,11 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         self.app.conn.commit()
         if unmarked in self.code_text:
             self.code_text.remove(unmarked)
+        self.code_text_index.remove(unmarked)
 
         # Update filter for tooltip and update code colours
-        self.eventFilterTT.setCodes(self.code_text, self.codes)
-        self.unlight()
-        self.highlight()
+        self.eventFilterTT.setCodes(self.code_text, self.codes, self.code_text_index)
+        self.highlight_span(unmarked['pos0'], unmarked['pos1'])
 
     def annotate(self, location):
         """ Add view, or remove an annotation for selected text.
@@ -994,10 +945,9 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         details = ""
         annotation = ""
         # Find annotation at this position for this file
-        for note in self.annotations:
-            if location >= note['pos0'] and location <= note['pos1'] and note['fid'] == self.filename['id']:
-                item = note  # use existing annotation
-                details = item['owner'] + " " + item['date']
+        for note in self.annotation_index.at(location):
+            item = note  # use existing annotation
+            details = item['owner'] + " " + item['date']
         # Exit this method if no text selected and there is no annotation at this position
         if pos0 == pos1 and item is None:
             return
@@ -1019,7 +969,7 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             anid = cur.fetchone()[0]
             item['anid'] = anid
             self.annotations.append(item)
-            self.highlight()
+            self.annotation_index.add(item)
             self.parent_textEdit.append(_("Annotation added at position: ") \
                 + str(item['pos0']) + "-" + str(item['pos1']) + _(" for: ") + self.filename['name'])
         # If blank delete the annotation
@@ -1027,13 +977,13 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
             cur = self.app.conn.cursor()
             cur.execute("delete from annotation where pos0 = ?", (item['pos0'], ))
             self.app.conn.commit()
-            for note in self.annotations:
-                if note['pos0'] == item['pos0'] and note['fid'] == item['fid']:
+            for note in self.annotation_index.at(item['pos0']):
+                if note['pos0'] == item['pos0']:
                     self.annotations.remove(note)
+                    self.annotation_index.remove(note)
             self.parent_textEdit.append(_("Annotation removed from position ") \
                 + str(item['pos0']) + _(" for: ") + self.filename['name'])
-        self.unlight()
-        self.highlight()
+        self.highlight_span(item['pos0'], item['pos1'])
 
     def auto_code(self):
         """ Autocode text in one file or all files with currently selected code.
@@ -1075,38 +1025,63 @@ class DialogCodeText(CodedMediaMixin, QtWidgets.QWidget):
         if len(files) == 0:
             return
 
-        for txt in texts:
-            filenames = ""
-            for f in files:
-                filenames += f['name'] + " "
-                cur = self.app.conn.cursor()
-                cur.execute("select name, id, fulltext, memo, owner, date from source where id=? and mediapath is Null",
-                    [f['id']])
-                currentfile = cur.fetchone()
-                text = currentfile[2]
-                textStarts = [match.start() for match in re.finditer(re.escape(txt), text)]
-                # Add new items to database
-                for startPos in textStarts:
-                    item = {'cid': cid, 'fid': int(f['id']), 'seltext': str(txt),
-                    'pos0': startPos, 'pos1': startPos + len(txt),
-                    'owner': self.app.settings['codername'], 'memo': "",
-                    'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-                    cur = self.app.conn.cursor()
-                    cur.execute("insert into code_text (cid,fid,seltext,pos0,pos1,\
-                        owner,memo,date) values(?,?,?,?,?,?,?,?)"
-                        , (item['cid'], item['fid'], item['seltext'], item['pos0'],
-                        item['pos1'], item['owner'], item['memo'], item['date']))
-                    self.app.conn.commit()
-
-                    # If this is the currently open file update the code text list and GUI
-                    if f['id'] == self.filename['id']:
-                        self.code_text.append(item)
-                self.highlight()
-                self.parent_textEdit.append(_("Automatic coding in files: ") + filenames \
-                    + _(". with text: ") + txt)
+        # Search in a worker thread, then insert the rows in one transaction when finished
+        self.ui.pushButton_auto_code.setEnabled(False)
+        self.autocode_texts = texts
+        self.autocode_progress = QtWidgets.QProgressDialog(_("Automatic coding"), _("Cancel"), 0, len(files), self)
+        self.autocode_progress.setWindowModality(Qt.WindowModal)
+        self.autocode_progress.setValue(0)
+        self.autocode_worker = AutocodeWorker(os.path.join(self.app.project_path, 'data.qda'), files, texts,
+            cid, self.app.settings['codername'], datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self.autocode_worker.signals.progress.connect(self.autocode_progress.setValue)
+        self.autocode_worker.signals.finished.connect(self.auto_code_finished)
+        self.autocode_worker.signals.error.connect(self.auto_code_error)
+        self.autocode_progress.canceled.connect(self.auto_code_cancel)
+        QtCore.QThreadPool.globalInstance().start(self.autocode_worker)
+
+    def auto_code_cancel(self):
+        """ Stop the autocode worker, nothing is written to the database. """
+
+        if self.autocode_worker is not None:
+            self.autocode_worker.cancel()
+            self.autocode_worker = None
+        self.ui.pushButton_auto_code.setEnabled(True)
+
+    def autocode_sender(self):
+        """ True if the signal is from the current autocode worker, not from a cancelled
+        worker whose signal was already queued. """
+
+        return self.autocode_worker is not None and self.sender() is self.autocode_worker.signals
+
+    def auto_code_error(self, msg):
+        """ The autocode worker could not read the files. """
+
+        if not self.autocode_sender():
+            return
+        self.autocode_worker = None
+        self.autocode_progress.close()
+        self.ui.pushButton_auto_code.setEnabled(True)
+        QtWidgets.QMessageBox.warning(None, _('Warning'), _("Automatic coding failed: ") + msg)
 
-        # Update filter for tooltip
-        self.eventFilterTT.setCodes(self.code_text, self.codes)
+    def auto_code_finished(self, rows, filenames):
+        """ Insert the autocoded rows from the worker in one transaction.
+        Text already coded with this code is skipped by the unique constraint. """
+
+        if not self.autocode_sender():
+            return
+        self.autocode_worker = None
+        self.autocode_progress.close()
+        self.ui.pushButton_auto_code.setEnabled(True)
+        cur = self.app.conn.cursor()
+        cur.executemany("insert or ignore into code_text (cid,fid,seltext,pos0,pos1,\
+            owner,memo,date) values(?,?,?,?,?,?,?,?)", rows)
+        inserted = cur.rowcount
+        self.app.conn.commit()
+        self.parent_textEdit.append(_("Automatic coding in files: ") + " ".join(filenames) \
+            + _(". with text: ") + "|".join(self.autocode_texts) + ". " + str(inserted) + _(" codings added"))
+
+        # Update code text, tooltips and highlights for the current file
+        self.get_coded_text_update_eventfilter_tooltips()
 
 
 class ToolTip_EventFilter(QtCore.QObject):
@@ -1117,14 +1092,20 @@ class ToolTip_EventFilter(QtCore.QObject):
 
     codes = None
     code_text = None
+    code_text_index = None
+
+    def setCodes(self, code_text, codes, code_text_index=None):
+        """ param: code_text_index - IntervalIndex of code_text, created if not provided """
 
-    def setCodes(self, code_text, codes):
         self.code_text = code_text
         self.codes = codes
+        if code_text_index is None:
+            code_text_index = IntervalIndex(code_text)
+        self.code_text_index = code_text_index
+        names = {c['cid']: c['name'] for c in self.codes}
         for item in self.code_text:
-            for c in self.codes:
-                if item['cid'] == c['cid']:
-                    item['name'] = c['name']
+            if item['cid'] in names:
+                item['name'] = names[item['cid']]
 
     def eventFilter(self, receiver, event):
         #QtGui.QToolTip.showText(QtGui.QCursor.pos(), tip)
@@ -1139,17 +1120,16 @@ class ToolTip_EventFilter(QtCore.QObject):
             if self.code_text is None:
                 #Call Base Class Method to Continue Normal Event Processing
                 return super(ToolTip_EventFilter, self).eventFilter(receiver, event)
-            for item in self.code_text:
-                if item['pos0'] <= pos and item['pos1'] >= pos:
-                    if displayText == "":
-                        displayText = item['name']
-                    else:  # Can have multiple codes on same selected area
-                        try:
-                            displayText += "\n" + item['name']
-                        except Exception as e:
-                            msg = "Codes ToolTipEventFilter " + str(e) + ". Possible key error: "
-                            msg += str(item) + "\n" + self.code_text
-                            logger.error(msg)
+            for item in self.code_text_index.at(pos):
+                if displayText == "":
+                    displayText = item['name']
+                else:  # Can have multiple codes on same selected area
+                    try:
+                        displayText += "\n" + item['name']
+                    except Exception as e:
+                        msg = "Codes ToolTipEventFilter " + str(e) + ". Possible key error: "
+                        msg += str(item) + "\n" + self.code_text
+                        logger.error(msg)
             if displayText != "":
                 receiver.setToolTip(displayText)
 
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+from collections import deque
+
+from PyQt5 import QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QBrush
+
+from project_model import CATEGORY_ADDED, CATEGORY_MEMO, CATEGORY_MOVED, CATEGORY_RENAMED, \
+    CODE_ADDED, CODE_DELETED, CODE_MEMO, CODE_MERGED, CODE_MOVED, CODE_RECOLOURED, CODE_RENAMED, \
+    FILE_ADDED, FILE_DELETED, FILE_RENAMED
+
+CODE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled
+
+
+def index_by_parent(categories, codes):
+    """ Index categories and codes by the catid of their parent category.
+    Top level categories and unlinked codes are stored under the None key.
+    Built once in O(n), as returned by App.get_data().
+    param: categories - list of dictionaries with catid and supercatid
+    param: codes - list of dictionaries with cid and catid
+    return: child_cats, child_codes - dictionaries of parent catid: list of dictionaries
+    """
+
+    child_cats = {}
+    child_codes = {}
+    for c in categories:
+        child_cats.setdefault(c['supercatid'], []).append(c)
+    for c in codes:
+        child_codes.setdefault(c['catid'], []).append(c)
+    return child_cats, child_codes
+
+
+def walk_tree(categories, codes):
+    """ Walk the category tree breadth first from the top level.
+    Categories whose parent does not exist (or which are in a cycle) are not reached,
+    which is the same as the original tree fill.
+    Yields tuples of (parent catid, 'cat' or 'code', dictionary). Within each parent,
+    child categories are yielded before codes.
+    """
+
+    child_cats, child_codes = index_by_parent(categories, codes)
+    queue = deque([None])
+    while queue:
+        catid = queue.popleft()
+        for c in child_cats.get(catid, []):
+            yield catid, 'cat', c
+            queue.append(c['catid'])
+        for c in child_codes.get(catid, []):
+            yield catid, 'code', c
+
+
+def fill_code_tree(tree, categories, codes, make_category_item=None, make_code_item=None):
+    """ Fill a QTreeWidget with categories and codes in one pass.
+    Top level items are main categories and unlinked codes.
+    The item factories take a category or code dictionary and return a QTreeWidgetItem.
+    The tree is not cleared here, so headers can be set up by the calling dialog.
+    param: tree - QTreeWidget
+    return: dictionary of catid: QTreeWidgetItem for the category items
+    """
+
+    if make_category_item is None:
+        make_category_item = category_item
+    if make_code_item is None:
+        make_code_item = code_item
+    cat_items = {None: tree.invisibleRootItem()}
+    for parent_catid, item_type, c in walk_tree(categories, codes):
+        parent = cat_items[parent_catid]
+        if item_type == 'cat':
+            item = make_category_item(c)
+            cat_items[c['catid']] = item
+        else:
+            item = make_code_item(c)
+        parent.addChild(item)
+    return cat_items
+
+
+def category_item(c):
+    """ Standard category item: name, catid and memo columns, owner and date tooltip. """
+
+    memo = ""
+    if c['memo'] != "" and c['memo'] is not None:
+        memo = _("Memo")
+    item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
+    item.setToolTip(0, c['owner'] + "\n" + c['date'])
+    return item
+
+
+def code_item(c):
+    """ Standard code item: name, cid and memo columns, owner and date tooltip,
+    code color background. """
+
+    memo = ""
+    if c['memo'] != "" and c['memo'] is not None:
+        memo = _("Memo")
+    item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
+    item.setToolTip(0, c['owner'] + "\n" + c['date'])
+    item.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
+    item.setFlags(CODE_FLAGS)
+    return item
+
+
+def find_tree_item(tree, id_text):
+    """ Find the tree item with id_text, e.g. 'cid:3' or 'catid:2', in the id column.
+    return: QTreeWidgetItem or None """
+
+    it = QtWidgets.QTreeWidgetItemIterator(tree)
+    item = it.value()
+    while item:
+        if item.text(1) == id_text:
+            return item
+        it += 1
+        item = it.value()
+    return None
+
+
+def update_code_tree(tree, change, make_category_item=None, make_code_item=None):
+    """ Apply a ProjectChange to a tree filled by fill_code_tree, without refilling it.
+    Changes that cannot be applied to single items, such as a deleted category, return
+    False and the calling dialog refills the tree.
+    The item factories must be the same as used to fill the tree.
+    return: True if the tree was updated """
+
+    if make_category_item is None:
+        make_category_item = category_item
+    if make_code_item is None:
+        make_code_item = code_item
+    kind, data = change
+    if kind in (CODE_ADDED, CATEGORY_ADDED):
+        if kind == CODE_ADDED:
+            item = make_code_item(data)
+            parent_id = data['catid']
+        else:
+            item = make_category_item(data)
+            parent_id = data['supercatid']
+        parent = _parent_item(tree, parent_id)
+        if parent is None:
+            return False
+        parent.addChild(item)
+        return True
+    if kind in (CODE_RENAMED, CODE_RECOLOURED, CODE_MEMO, CODE_MOVED, CODE_MERGED, CODE_DELETED):
+        item = find_tree_item(tree, 'cid:' + str(data['cid']))
+    elif kind in (CATEGORY_RENAMED, CATEGORY_MEMO, CATEGORY_MOVED):
+        item = find_tree_item(tree, 'catid:' + str(data['catid']))
+    else:
+        return kind in (FILE_ADDED, FILE_RENAMED, FILE_DELETED)
+    if item is None:
+        return False
+    if kind in (CODE_RENAMED, CATEGORY_RENAMED):
+        item.setText(0, data['name'])
+    elif kind == CODE_RECOLOURED:
+        item.setBackground(0, QBrush(QtGui.QColor(data['color']), Qt.SolidPattern))
+    elif kind in (CODE_MEMO, CATEGORY_MEMO):
+        memo = ""
+        if data['memo'] != "" and data['memo'] is not None:
+            memo = _("Memo")
+        item.setText(2, memo)
+    elif kind in (CODE_MERGED, CODE_DELETED):
+        (item.parent() or tree.invisibleRootItem()).removeChild(item)
+    else:
+        # moved, the item keeps its children
+        if kind == CODE_MOVED:
+            parent = _parent_item(tree, data['catid'])
+        else:
+            parent = _parent_item(tree, data['supercatid'])
+        ancestor = parent
+        while ancestor is not None and ancestor is not item:
+            ancestor = ancestor.parent()
+        if parent is None or ancestor is item:
+            return False
+        (item.parent() or tree.invisibleRootItem()).removeChild(item)
+        parent.addChild(item)
+        item.setExpanded(True)
+    return True
+
+
+def _parent_item(tree, catid):
+    if catid is None:
+        return tree.invisibleRootItem()
+    return find_tree_item(tree, 'catid:' + str(catid))
@@ -25,13 +25,14 @@ Author: Colin Curtain (ccbogel)
 https://github.com/ccbogel/QualCoder
 '''
 
-from copy import copy
 import logging
 import os
 import sys
 import traceback
 
-from PyQt5 import QtGui, QtWidgets
+from PyQt5 import QtWidgets
+
+from code_tree import fill_code_tree
 
 path = os.path.abspath(os.path.dirname(__file__))
 logger = logging.getLogger(__name__)
@@ -71,84 +72,30 @@ class Codebook():
         """ Fill tree widget, top level items are main categories and unlinked codes
         """
 
-        cats = copy(self.categories)
-        codes = copy(self.code_names)
         self.tree.clear()
         self.tree.setColumnCount(4)
-        # add top level categories
-        remove_list = []
-        for c in cats:
-            if c['supercatid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = "Memo"
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                self.tree.addTopLevelItem(top_item)
-                remove_list.append(c)
-        for item in remove_list:
-            #try:
-            cats.remove(item)
-            #except Exception as e:
-            #    logger.debug(e, item)
-
-        ''' add child categories. look at each unmatched category, iterate through tree
-         to add as child then remove matched categories from the list. '''
-
-        count = 0
-        while len(cats) > 0 or count < 10000:
-            remove_list = []
-            #logger.debug(cats)
-            for c in cats:
-                it = QtWidgets.QTreeWidgetItemIterator(self.tree)
-                item = it.value()
-                while item:  # while there is an item in the list
-                    #logger.debug("While: ", item.text(0), item.text(1), c['catid'], c['supercatid'])
-                    if item.text(1) == 'catid:' + str(c['supercatid']):
-                        memo = ""
-                        if c['memo'] != "":
-                            memo = "Memo"
-                        child = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                        child.setIcon(0, QtGui.QIcon("GUI/icon_cat.png"))
-                        item.addChild(child)
-                        #logger.debug("Adding child: " + c['name'])
-                        remove_list.append(c)
-                    it += 1
-                    item = it.value()
-            for item in remove_list:
-                cats.remove(item)
-            count += 1
-
-        # add unlinked codes as top level items
-        remove_items = []
-        for c in codes:
-            if c['catid'] is None:
-                #logger.debug("Unlinked code as top level item:" + c['name'])
-                memo = ""
-                if c['memo'] != "":
-                    memo = "Memo"
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo, str(c['freq'])])
-                self.tree.addTopLevelItem(top_item)
-                remove_items.append(c)
-        for item in remove_items:
-            codes.remove(item)
-
-        # add codes as children
-        for c in codes:
-            it = QtWidgets.QTreeWidgetItemIterator(self.tree)
-            item = it.value()
-            while item:
-                #logger.debug("add codes as children:" + item.text(0), item.text(1), c['cid'], c['catid'])
-                if item.text(1) == 'catid:' + str(c['catid']):
-                    memo = ""
-                    if c['memo'] != "":
-                        memo = "Memo"
-                    child = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo, str(c['freq'])])
-                    item.addChild(child)
-                    c['catid'] = -1  # make unmatchable
-                it += 1
-                item = it.value()
+        fill_code_tree(self.tree, self.categories, self.code_names,
+            self.category_item, self.code_item)
         #self.ui.treeWidget.expandAll()
 
+    @staticmethod
+    def category_item(c):
+        """ Tree item for a category: name, catid and memo. """
+
+        memo = ""
+        if c['memo'] != "":
+            memo = "Memo"
+        return QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
+
+    @staticmethod
+    def code_item(c):
+        """ Tree item for a code: name, cid, memo and frequency. """
+
+        memo = ""
+        if c['memo'] != "":
+            memo = "Memo"
+        return QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo, str(c['freq'])])
+
     def export(self):
         """ Export codes to a plain text file, filename will have .txt ending. """
 
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+import heapq
+
+from PyQt5 import QtGui
+
+DEFAULT_COLOR = "#F8E0E0"  # light red, for codes with no colour
+
+
+def format_runs(codings, annotations, colors, start=0, end=None):
+    """ Merge overlapping codings and annotations into non-overlapping format runs.
+    Where codings overlap, the coding added last sets the colour and italics, as
+    happens when each coding is applied in turn. Codings with a memo are italic.
+    Annotated text is bold.
+    Only the span start to end (end exclusive) is calculated, so that a change can be
+    re-rendered without redoing the whole document.
+    param: codings - list of code_text dictionaries in the order they were added
+    param: annotations - list of annotation dictionaries
+    param: colors - dictionary of cid: colour
+    return: list of tuples (pos0, pos1, colour or None, italic, bold), sorted by pos0
+    """
+
+    starts = []
+    boundaries = set()
+    for order, item in enumerate(codings):
+        pos0, pos1 = _clip(item, start, end)
+        if pos0 >= pos1:
+            continue
+        italic = item['memo'] is not None and item['memo'] != ""
+        color = colors.get(item['cid'], DEFAULT_COLOR)
+        starts.append((pos0, order, pos1, color, italic))
+        boundaries.update((pos0, pos1))
+    bold_changes = {}
+    for note in annotations:
+        pos0, pos1 = _clip(note, start, end)
+        if pos0 >= pos1:
+            continue
+        bold_changes[pos0] = bold_changes.get(pos0, 0) + 1
+        bold_changes[pos1] = bold_changes.get(pos1, 0) - 1
+        boundaries.update((pos0, pos1))
+    starts.sort()
+    boundaries = sorted(boundaries)
+
+    runs = []
+    active = []  # heap of the codings covering the current position, latest first
+    bold = 0
+    i = 0
+    for k in range(len(boundaries) - 1):
+        pos = boundaries[k]
+        while i < len(starts) and starts[i][0] <= pos:
+            pos0, order, pos1, color, italic = starts[i]
+            heapq.heappush(active, (-order, pos1, color, italic))
+            i += 1
+        while active and active[0][1] <= pos:
+            heapq.heappop(active)
+        bold += bold_changes.get(pos, 0)
+        if not active and bold == 0:
+            continue
+        color = None
+        italic = False
+        if active:
+            color, italic = active[0][2], active[0][3]
+        run = (pos, boundaries[k + 1], color, italic, bold > 0)
+        if runs and runs[-1][1] == pos and runs[-1][2:] == run[2:]:
+            runs[-1] = (runs[-1][0], run[1]) + run[2:]
+        else:
+            runs.append(run)
+    return runs
+
+
+def _clip(item, start, end):
+    pos0 = max(int(item['pos0']), start)
+    pos1 = int(item['pos1'])
+    if end is not None:
+        pos1 = min(pos1, end)
+    return pos0, pos1
+
+
+def apply_format_runs(text_edit, runs, start, end):
+    """ Reset the character format from start to end, then apply the format runs.
+    Changes are made in one edit block so the document lays out once.
+    param: text_edit - QTextEdit showing the file text
+    param: runs - from format_runs, within start and end
+    """
+
+    document = text_edit.document()
+    end = min(end, document.characterCount() - 1)
+    if end <= start:
+        return
+    cursor = QtGui.QTextCursor(document)
+    cursor.beginEditBlock()
+    cursor.setPosition(start, QtGui.QTextCursor.MoveAnchor)
+    cursor.setPosition(end, QtGui.QTextCursor.KeepAnchor)
+    cursor.setCharFormat(QtGui.QTextCharFormat())
+    for pos0, pos1, color, italic, bold in runs:
+        pos1 = min(pos1, end)
+        if pos0 >= pos1:
+            continue
+        fmt = QtGui.QTextCharFormat()
+        if color is not None:
+            fmt.setBackground(QtGui.QBrush(QtGui.QColor(color)))
+        fmt.setFontItalic(italic)
+        if bold:
+            fmt.setFontWeight(QtGui.QFont.Bold)
+        cursor.setPosition(pos0, QtGui.QTextCursor.MoveAnchor)
+        cursor.setPosition(pos1, QtGui.QTextCursor.KeepAnchor)
+        cursor.setCharFormat(fmt)
+    cursor.endEditBlock()
+
+
+def add_span(spans, start, end):
+    """ Add start to end into a sorted list of non-overlapping (pos0, pos1) spans.
+    Touching or overlapping spans are merged. Returns a new list. """
+
+    if end <= start:
+        return list(spans)
+    result = []
+    for pos0, pos1 in spans:
+        if pos1 < start or pos0 > end:
+            result.append((pos0, pos1))
+        else:
+            start = min(start, pos0)
+            end = max(end, pos1)
+    result.append((start, end))
+    result.sort()
+    return result
+
+
+def missing_spans(spans, start, end):
+    """ Get the parts of start to end that are not in the sorted, non-overlapping spans. """
+
+    result = []
+    pos = start
+    for pos0, pos1 in spans:
+        if pos1 <= pos:
+            continue
+        if pos0 >= end:
+            break
+        if pos0 > pos:
+            result.append((pos, pos0))
+        pos = max(pos, pos1)
+    if pos < end:
+        result.append((pos, end))
+    return result
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sqlite3
+import time
+
+from PyQt5 import QtCore
+
+logger = logging.getLogger(__name__)
+
+# Operators offered by report_attributes.DialogSelectAttributeParameters
+ATTRIBUTE_OPERATORS = ('<', '>', '<=', '>=', '==', '!=', 'in', 'not in', 'between', 'like')
+MAX_INLINE_IDS = 100  # larger id sets are put in a temporary table
+BATCH_SIZE = 200  # results sent to the report at a time
+BATCH_SECONDS = 0.1  # or sooner, so the first results are shown quickly
+
+IMAGE_THREADS = max(2, os.cpu_count() or 2)  # threads decoding coded image areas
+
+
+class CodingQuery(object):
+    """ Get the codings of text, images and audio/video for a coding report selection.
+    The selection is compiled into one parameterized query for each kind of coding.
+
+    Codings are found through files, or through cases when case ids are given or the
+    attribute filters include case attributes. Through cases, text codings must lie
+    within the case text, image and audio/video codings are of the files of the case.
+    Large id sets are put in temporary tables, call close() to drop them.
+
+    param: conn - sqlite3 connection
+    param: cids - code ids
+    param: file_ids - file ids, or None for all files
+    param: case_ids - case ids, or None
+    param: attributes - list of [name, 'file' or 'case', 'numeric' or 'character',
+        operator, list of values], from DialogSelectAttributeParameters
+    param: coder - owner name, or "" for all coders
+    param: search_text - text in the coded text, or in the image and a/v coding memos
+    """
+
+    def __init__(self, conn, cids, file_ids=None, case_ids=None, attributes=None, coder="", search_text=""):
+
+        self.conn = conn
+        self.coder = coder
+        self.search_text = search_text
+        self.temp_tables = []
+        self.attributes = attributes or []
+        self.file_or_case = ""  # for attribute selections
+        if file_ids is not None:
+            self.file_or_case = "File"
+        if case_ids is not None:
+            self.file_or_case = "Case"
+        self.through_cases = case_ids is not None or any(a[1] != 'file' for a in self.attributes)
+        self.cid_condition = self._id_condition("cid", cids)
+        self.file_condition = None
+        if file_ids is not None:
+            self.file_condition = self._id_condition("fid", file_ids)
+        self.case_condition = None
+        if case_ids is not None:
+            self.case_condition = self._id_condition("caseid", case_ids)
+
+    def _id_condition(self, name, ids):
+        """ Make an 'in' condition for a set of ids, as sql with a {} for the column, and
+        its parameters. A large set is inserted into a temporary table, to stay within
+        the SQLite parameter limit. """
+
+        ids = [int(i) for i in ids]
+        if len(ids) <= MAX_INLINE_IDS:
+            return "{} in (" + ",".join("?" * len(ids)) + ")", ids
+        table = "coding_query_" + name
+        cur = self.conn.cursor()
+        cur.execute("create temp table if not exists " + table + " (id integer primary key)")
+        cur.execute("delete from " + table)
+        cur.executemany("insert or ignore into " + table + " (id) values (?)", [(i,) for i in ids])
+        self.temp_tables.append(table)
+        return "{} in (select id from temp." + table + ")", []
+
+    def close(self):
+        """ Drop the temporary tables. """
+
+        cur = self.conn.cursor()
+        for table in self.temp_tables:
+            cur.execute("drop table if exists temp." + table)
+        self.temp_tables = []
+
+    @staticmethod
+    def _attribute_condition(attribute):
+        """ Make a condition on the id column of attribute, with parameters. """
+
+        name, attr_type, value_type, operator, values = attribute
+        if operator not in ATTRIBUTE_OPERATORS:
+            raise ValueError("Unknown attribute operator: " + str(operator))
+        value = "value"
+        if value_type == 'numeric':
+            value = "cast(value as real)"
+            values = [float(v) for v in values]
+        sql = "select id from attribute where attr_type=? and name=? and " + value + " " + operator + " "
+        if operator in ('in', 'not in'):
+            sql += "(" + ",".join("?" * len(values)) + ")"
+        elif operator == 'between':
+            sql += "? and ?"
+            values = values[:2]
+        else:
+            sql += "?"
+            values = values[:1]
+        return "{} in (" + sql + ")", [attr_type, name] + list(values)
+
+    def _where(self, table, fid_column, search_column):
+        """ Joins and where clause of the selection for a coding table.
+        param: table - code_text, code_image or code_av
+        param: fid_column - the file id column of the table
+        param: search_column - column compared with the search text
+        return: name column, joins, where clause, parameters """
+
+        joins = " join code_name on code_name.cid = " + table + ".cid join source on source.id = " + fid_column
+        conditions = []
+        parameters = []
+
+        def add(condition, column):
+            conditions.append(condition[0].format(column))
+            parameters.extend(condition[1])
+
+        add(self.cid_condition, table + ".cid")
+        if self.file_condition is not None:
+            add(self.file_condition, fid_column)
+        name_column = "source.name"
+        if self.through_cases:
+            name_column = "cases.name"
+            joins += " join case_text on case_text.fid = " + fid_column
+            joins += " join cases on cases.caseid = case_text.caseid"
+            if table == "code_text":
+                # case_text_fid_pos0 index
+                conditions.append("case_text.pos0 <= code_text.pos0 and case_text.pos1 >= code_text.pos1")
+            if self.case_condition is not None:
+                add(self.case_condition, "case_text.caseid")
+        for attribute in self.attributes:
+            column = fid_column
+            if attribute[1] != 'file':
+                column = "case_text.caseid"
+            add(self._attribute_condition(attribute), column)
+        if self.coder != "":
+            conditions.append(table + ".owner=?")
+            parameters.append(self.coder)
+        if self.search_text != "":
+            conditions.append(search_column + " like ?")
+            parameters.append("%" + self.search_text + "%")
+        return name_column, joins, " where " + " and ".join(conditions), parameters
+
+    def _case_column(self):
+        if self.through_cases:
+            return "case_text.caseid"
+        return "null"
+
+    def text_codings(self):
+        """ Generate the text codings, in file and position order.
+        yield: dictionary of codename, color, file_or_casename, pos0, pos1, text, coder,
+            fid, cid, caseid, file_or_case """
+
+        name_column, joins, where, parameters = self._where("code_text", "code_text.fid", "code_text.seltext")
+        sql = "select code_name.name, color, " + name_column + ", code_text.pos0, code_text.pos1, "
+        sql += "code_text.seltext, code_text.owner, code_text.fid, code_text.cid, " + self._case_column()
+        sql += " from code_text" + joins + where + " order by code_text.fid, code_text.pos0"
+        cur = self.conn.cursor()
+        cur.execute(sql, parameters)
+        for row in cur:
+            yield {'codename': row[0], 'color': row[1], 'file_or_casename': row[2], 'pos0': row[3],
+                'pos1': row[4], 'text': row[5], 'coder': row[6], 'fid': row[7], 'cid': row[8],
+                'caseid': row[9], 'file_or_case': self.file_or_case}
+
+    def image_codings(self):
+        """ Generate the image codings, in file order.
+        yield: dictionary of codename, color, file_or_casename, x1, y1, width, height, coder,
+            mediapath, fid, memo, cid, caseid, file_or_case """
+
+        name_column, joins, where, parameters = self._where("code_image", "code_image.id", "code_image.memo")
+        sql = "select code_name.name, color, " + name_column + ", x1, y1, width, height, code_image.owner, "
+        sql += "source.mediapath, source.id, code_image.memo, code_image.cid, " + self._case_column()
+        sql += " from code_image" + joins + where + " order by source.id, code_image.imid"
+        cur = self.conn.cursor()
+        cur.execute(sql, parameters)
+        for row in cur:
+            yield {'codename': row[0], 'color': row[1], 'file_or_casename': row[2], 'x1': row[3],
+                'y1': row[4], 'width': row[5], 'height': row[6], 'coder': row[7], 'mediapath': row[8],
+                'fid': row[9], 'memo': row[10], 'cid': row[11], 'caseid': row[12],
+                'file_or_case': self.file_or_case}
+
+    def av_codings(self):
+        """ Generate the audio and video codings, in file and time order. pos0 and pos1 are
+        in milliseconds.
+        yield: dictionary of codename, color, file_or_casename, pos0, pos1, memo, coder,
+            mediapath, fid, cid, caseid, file_or_case """
+
+        name_column, joins, where, parameters = self._where("code_av", "code_av.id", "code_av.memo")
+        sql = "select code_name.name, color, " + name_column + ", code_av.pos0, code_av.pos1, code_av.memo, "
+        sql += "code_av.owner, source.mediapath, source.id, code_av.cid, " + self._case_column()
+        sql += " from code_av" + joins + where + " order by source.id, code_av.pos0"
+        cur = self.conn.cursor()
+        cur.execute(sql, parameters)
+        for row in cur:
+            yield {'codename': row[0], 'color': row[1], 'file_or_casename': row[2], 'pos0': row[3],
+                'pos1': row[4], 'memo': row[5], 'coder': row[6], 'mediapath': row[7], 'fid': row[8],
+                'cid': row[9], 'caseid': row[10], 'file_or_case': self.file_or_case}
+
+    def cases(self):
+        """ The selected cases, when codings are found through cases.
+        return: list of (caseid, name) in caseid order """
+
+        if not self.through_cases:
+            return []
+        conditions = []
+        parameters = []
+        if self.case_condition is not None:
+            conditions.append(self.case_condition[0].format("caseid"))
+            parameters.extend(self.case_condition[1])
+        for attribute in self.attributes:
+            if attribute[1] != 'file':
+                sql, values = self._attribute_condition(attribute)
+                conditions.append(sql.format("caseid"))
+                parameters.extend(values)
+        sql = "select caseid, name from cases"
+        if conditions:
+            sql += " where " + " and ".join(conditions)
+        cur = self.conn.cursor()
+        cur.execute(sql + " order by caseid", parameters)
+        return cur.fetchall()
+
+
+class ReportSignals(QtCore.QObject):
+    """ Signals from ReportWorker. QRunnable is not a QObject, so cannot have signals.
+    batch - kind ('text', 'image' or 'av') and a list of result dictionaries
+    progress - number of results found
+    finished - list of (caseid, name) from CodingQuery.cases
+    error - message """
+
+    batch = QtCore.pyqtSignal(str, list)
+    progress = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal(list)
+    error = QtCore.pyqtSignal(str)
+
+
+class ReportWorker(QtCore.QRunnable):
+    """ Run a CodingQuery in a QThreadPool thread and send the results in batches, so
+    the report can show them as they are found. The coded area of each image is got
+    from the image cache here, in an 'image' QImage of the result dictionary.
+    The worker uses its own database connection, as an sqlite3 connection cannot be
+    used from another thread. finished is not emitted if cancelled.
+    param: db_path - project database
+    param: project_path - for image media paths
+    param: image_cache - image_cache.ImageCache
+    param: args, kwargs - CodingQuery arguments after conn """
+
+    def __init__(self, db_path, project_path, image_cache, *args, **kwargs):
+
+        super(ReportWorker, self).__init__()
+        self.db_path = db_path
+        self.project_path = project_path
+        self.image_cache = image_cache
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = ReportSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def read_images(self, results):
+        """ Add the coded area to each image result. All the areas are decoded in a thread
+        pool through the image cache, while the results are sent in order. """
+
+        results = list(results)
+        requests = [(self.project_path + r['mediapath'], (r['x1'], r['y1'], r['width'], r['height']), None)
+            for r in results]
+        with ThreadPoolExecutor(IMAGE_THREADS) as executor:
+            futures = self.image_cache.prefetch(executor, requests)
+            for result, future in zip(results, futures):
+                if self.cancelled:
+                    for f in futures:
+                        f.cancel()
+                    return
+                result['image'] = future.result()
+                yield result
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        count = 0
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                query = CodingQuery(conn, *self.args, **self.kwargs)
+                try:
+                    for kind, results in (('text', query.text_codings()),
+                            ('image', self.read_images(query.image_codings())), ('av', query.av_codings())):
+                        batch = []
+                        sent = time.time()
+                        for result in results:
+                            if self.cancelled:
+                                return
+                            batch.append(result)
+                            count += 1
+                            if len(batch) >= BATCH_SIZE or time.time() - sent > BATCH_SECONDS:
+                                self.signals.batch.emit(kind, batch)
+                                self.signals.progress.emit(count)
+                                batch = []
+                                sent = time.time()
+                        if batch != []:
+                            self.signals.batch.emit(kind, batch)
+                            self.signals.progress.emit(count)
+                    cases = query.cases()
+                finally:
+                    query.close()
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning("Report: " + str(e))
+            self.signals.error.emit(str(e))
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(cases)
@@ -221,6 +221,10 @@ class DialogSQL(QtWidgets.QDialog):
             self.ui.tableWidget_results.resizeColumnsToContents()
             self.ui.tableWidget_results.resizeRowsToContents()
             sqlString = str(self.sql).upper()
+            if sqlString.lstrip().find("SELECT") != 0:
+                # codes, categories or files may have changed, dialogs use the project model
+                self.app.conn.commit()
+                self.app.get_project_model().reload()
             if sqlString.find("CREATE ") == 0 or sqlString.find("DROP ") == 0 or sqlString.find("ALTER ") == 0:
                 self.getSchemaUpdateTreeWidget()
         except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+
+from PyQt5 import QtCore, QtGui
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMORY_BYTES = 256 * 1024 * 1024  # decoded images kept in memory
+MAX_DISK_BYTES = 512 * 1024 * 1024  # crops and thumbnails kept in the cache directory
+
+
+def read_image(path, rect=None, max_size=None):
+    """ Decode an image, or an area of it, optionally scaled down. Only the area, and
+    at a reduced size, is decoded where the image format supports it, e.g. jpeg.
+    Can be called outside the GUI thread.
+    param: path - image file
+    param: rect - (x, y, width, height) of the area, or None for the whole image
+    param: max_size - largest width or height in pixels, or None for full size
+    return: QImage, null if the image cannot be read """
+
+    reader = QtGui.QImageReader(path)
+    size = reader.size()
+    if not size.isValid():
+        # the format cannot give the size before decoding
+        image = reader.read()
+        if rect is not None:
+            image = image.copy(QtCore.QRect(*[int(v) for v in rect]))
+        if max_size is not None and (image.width() > max_size or image.height() > max_size):
+            image = image.scaled(max_size, max_size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        return image
+    area = QtCore.QRect(QtCore.QPoint(0, 0), size)
+    if rect is not None:
+        area = QtCore.QRect(*[int(v) for v in rect]).intersected(area)
+        reader.setClipRect(area)
+    if max_size is not None and (area.width() > max_size or area.height() > max_size):
+        reader.setScaledSize(area.size().scaled(max_size, max_size, QtCore.Qt.KeepAspectRatio))
+    return reader.read()
+
+
+class ImageCache(object):
+    """ Cache of decoded images, image areas and thumbnails, keyed by the image path,
+    its modification time, the area and the maximum size. So a changed image file is
+    decoded again.
+    Recently used images are kept in memory, up to MAX_MEMORY_BYTES. Areas and
+    thumbnails are also saved as png files in the cache directory, up to MAX_DISK_BYTES,
+    so they do not need decoding from the full image in later sessions. Whole full size
+    images are only kept in memory.
+    get is thread safe, so images can be decoded in a thread pool, see prefetch. """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        self.images = OrderedDict()  # key: QImage, least recently used first
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.prune_directory()
+        except OSError as e:
+            logger.warning("Image cache directory: " + str(e))
+            self.directory = None
+
+    @staticmethod
+    def key(path, rect, max_size):
+        if rect is not None:
+            rect = tuple(int(v) for v in rect)
+        return (path, os.path.getmtime(path), rect, max_size)
+
+    def get(self, path, rect=None, max_size=None):
+        """ Get an image, an area of it, or a thumbnail, as read_image.
+        return: QImage, null if the image cannot be read """
+
+        try:
+            key = self.key(path, rect, max_size)
+        except OSError:
+            return QtGui.QImage()
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+                return image
+        image = None
+        filename = None
+        if self.directory is not None and (rect is not None or max_size is not None):
+            filename = os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + ".png")
+            if os.path.isfile(filename):
+                image = QtGui.QImage(filename)
+                if image.isNull():
+                    image = None
+                else:
+                    try:
+                        os.utime(filename)
+                    except OSError:
+                        pass
+        if image is None:
+            image = read_image(path, rect, max_size)
+            if filename is not None and not image.isNull():
+                image.save(filename, "PNG")
+        if not image.isNull():
+            self.add(key, image)
+        return image
+
+    def add(self, key, image):
+        size = image.byteCount()
+        if size > MAX_MEMORY_BYTES:
+            return
+        with self.lock:
+            if key in self.images:
+                return
+            self.images[key] = image
+            self.memory_bytes += size
+            while self.memory_bytes > MAX_MEMORY_BYTES:
+                old_key, old_image = self.images.popitem(last=False)
+                self.memory_bytes -= old_image.byteCount()
+
+    def prefetch(self, executor, requests):
+        """ Decode images in a thread pool, ready for get.
+        param: executor - concurrent.futures.Executor
+        param: requests - list of (path, rect, max_size)
+        return: list of futures of the QImages, in request order """
+
+        return [executor.submit(self.get, path, rect, max_size) for path, rect, max_size in requests]
+
+    def prune_directory(self):
+        """ Remove the least recently used files of the cache directory, to keep it under
+        MAX_DISK_BYTES. """
+
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+            total += stat.st_size
+        files.sort()
+        for mtime, size, filename in files:
+            if total <= MAX_DISK_BYTES:
+                break
+            try:
+                os.remove(filename)
+                total -= size
+            except OSError as e:
+                logger.debug(str(e))
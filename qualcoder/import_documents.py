@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import codecs
+import hashlib
+import locale
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import time
+import zipfile
+
+from PyQt5 import QtCore
+
+pdfminer_installed = True
+try:
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.layout import LAParams, LTTextBox, LTTextLine
+except ImportError:
+    pdfminer_installed = False
+
+import ebooklib
+from ebooklib import epub
+
+from docx import opendocx, getdocumenttext
+from html_parser import html_to_text
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = ('docx', 'epub', 'htm', 'html', 'odt', 'pdf', 'txt')
+CHUNK_SIZE = 4 * 1024 * 1024  # characters read at a time from text files
+SAMPLE_SIZE = 64 * 1024  # bytes used to detect the encoding
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes read at a time when hashing and copying files
+
+# The functions below run in worker processes, so they do not use Qt widgets or the
+# gettext _ function. Messages are translated by the calling dialog.
+
+
+def import_document(path, destination, decrypt_pdf=False, page_queue=None):
+    """ Copy a document into the project documents directory and extract its text.
+    PDFs are decrypted with qpdf into the destination if decrypt_pdf, otherwise copied.
+    param: path - the file to import
+    param: destination - path in the project documents directory
+    param: decrypt_pdf - True to try qpdf --decrypt
+    param: page_queue - queue to put (name, page number) on as each PDF page is read, or None
+    return: dictionary of path, destination, name, hash, text, pages, encoding, log, warning, error.
+        hash is of the bytes of the copy in the project, after any PDF decryption, as
+        App.update_source_hashes.
+        pages is a list of (page number, pos0, pos1) for PDFs, otherwise empty.
+        encoding is the detected encoding of text and html files, otherwise "".
+        log is the size, time and throughput of the text extraction.
+    """
+
+    name = path.split("/")[-1]
+    result = {'path': path, 'destination': destination, 'name': name, 'hash': "", 'text': "", 'pages': [], 'encoding': "", 'log': "",
+        'warning': "", 'error': ""}
+    page_done = None
+    if page_queue is not None:
+        page_done = lambda number: page_queue.put((name, number))
+    try:
+        decrypted = False
+        if decrypt_pdf:
+            try:
+                # qpdf exit status 3 is success with warnings
+                decrypted = subprocess.call(["qpdf", "--decrypt", path, destination],
+                    stdout=subprocess.PIPE) in (0, 3)
+            except OSError as e:
+                logger.debug("qpdf: " + str(e))
+        if decrypted:
+            result['hash'] = file_hash(destination)
+        else:
+            result['hash'] = copy_and_hash(path, destination)
+        text_path = path
+        if path.split('.')[-1].lower() == 'pdf':
+            text_path = destination
+        start = time.time()
+        result.update(extract_text(text_path, page_done))
+        result['log'] = throughput(os.path.getsize(text_path), time.time() - start)
+        if result['encoding'] != "":
+            result['log'] += ", " + result['encoding']
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+    if result['text'] == "":
+        result['error'] = "No text found"
+    return result
+
+
+def extract_text(import_file, page_done=None):
+    """ Get the plain text from file types of odt, docx, pdf, epub, txt, html, htm.
+    Other file types are read as plain text. The text is empty if a structured file has
+    none, e.g. a scanned PDF, rather than its bytes being read as text.
+    param: page_done - function called with the page number as each PDF page is read
+    return: dictionary of text, warning message or "", PDF page offsets as pdf_text or [],
+        encoding of text and html files or "" """
+
+    text = ""
+    result = {'warning': "", 'pages': [], 'encoding': ""}
+    suffix = import_file.split('.')[-1].lower()
+    if suffix == "odt":
+        text = convert_odt_to_text(import_file)
+    if suffix == "docx":
+        document = opendocx(import_file)
+        list_ = getdocumenttext(document)
+        text = "\n".join(list_)
+    if suffix == "epub":
+        book = epub.read_epub(import_file)
+        for d in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+            try:
+                bytes_ = d.get_body_content()
+                string = bytes_.decode('utf-8')
+                text += html_to_text(string) + "\n"
+            except TypeError as e:
+                logger.debug("ebooklib get_body_content error " + str(e))
+    if suffix == "pdf":
+        text, result['pages'] = pdf_text(import_file, page_done)
+    if suffix in ("html", "htm"):
+        html, result['encoding'] = read_text(import_file)
+        text = html_to_text(html)
+    # Import txt and other file types as a plain text file.
+    if suffix not in ('docx', 'epub', 'htm', 'html', 'odt', 'pdf'):
+        text, result['encoding'] = read_text(import_file)
+        replaced = text.count("\ufffd")
+        if replaced > 0:
+            result['warning'] = str(replaced) + " characters could not be decoded as " + result['encoding']
+            logger.warning(import_file + ": " + result['warning'])
+    result['text'] = text
+    return result
+
+
+def detect_encoding(import_file):
+    """ Detect the encoding of a text file from a byte order mark, otherwise from
+    whether the start of the file is valid UTF-8, otherwise use the platform encoding,
+    or latin-1 if the platform encoding is UTF-8. """
+
+    with open(import_file, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # final=False allows a character cut off at the end of the sample
+        codecs.getincrementaldecoder('utf-8')().decode(sample, False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        encoding = locale.getpreferredencoding(False)
+        if codecs.lookup(encoding).name == 'utf-8':
+            return 'latin-1'
+        return encoding
+
+
+def read_text(import_file):
+    """ Read a whole text file in large chunks, in the detected encoding.
+    Newlines are normalised to \\n as the file is decoded (universal newlines). A byte
+    order mark is removed by the utf-8-sig, utf-16 and utf-32 decoders. Bytes that cannot
+    be decoded become U+FFFD.
+    return: text, encoding """
+
+    encoding = detect_encoding(import_file)
+    chunks = []
+    with open(import_file, 'r', encoding=encoding, errors='replace', newline=None) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return "".join(chunks), encoding
+
+
+def throughput(size, seconds):
+    """ Describe the size and speed of a file import, for the import log. """
+
+    megabytes = size / (1024 * 1024)
+    text = "{:.1f} MB in {:.1f} s".format(megabytes, seconds)
+    if seconds > 0:
+        text += " ({:.1f} MB/s)".format(megabytes / seconds)
+    return text
+
+
+def new_hash():
+    """ BLAKE2b, or SHA-256 on Python 3.5 which does not have BLAKE2. """
+
+    try:
+        return hashlib.blake2b(digest_size=32)
+    except AttributeError:
+        return hashlib.sha256()
+
+
+def file_hash(path):
+    """ Hash the bytes of a file, read in chunks.
+    return: hex digest """
+
+    h = new_hash()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_and_hash(path, destination):
+    """ Copy a file and hash its bytes in one read of the file.
+    return: hex digest """
+
+    h = new_hash()
+    with open(path, 'rb') as f, open(destination, 'wb') as out:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+
+def pdf_pages(import_file):
+    """ Generate the text of each page of a PDF, from its text boxes and lines.
+    Only one page layout is held at a time. """
+
+    with open(import_file, 'rb') as fp:
+        parser = PDFParser(fp)
+        doc = PDFDocument(parser=parser)
+        parser.set_document(doc)
+        # potential error with encrypted PDF
+        rsrcmgr = PDFResourceManager()
+        laparams = LAParams()
+        laparams.char_margin = 1.0
+        laparams.word_margin = 1.0
+        device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        for page in PDFPage.create_pages(doc):
+            interpreter.process_page(page)
+            layout = device.get_result()
+            yield "".join(lt_obj.get_text() for lt_obj in layout
+                if isinstance(lt_obj, LTTextBox) or isinstance(lt_obj, LTTextLine))
+
+
+def pdf_text(import_file, page_done=None):
+    """ Get the text of a PDF and the character offsets of each page in the text.
+    param: page_done - function called with the page number as each page is read
+    return: text, list of (page number, pos0, pos1), page numbers start at 1 """
+
+    parts = []
+    pages = []
+    pos = 0
+    for number, page_text in enumerate(pdf_pages(import_file), 1):
+        parts.append(page_text)
+        pages.append((number, pos, pos + len(page_text)))
+        pos += len(page_text)
+        if page_done is not None:
+            page_done(number)
+    return "".join(parts), pages
+
+
+def convert_odt_to_text(import_file):
+    """ Convert odt to very rough equivalent with headings, list items and tables for
+    html display in qTextEdits. """
+
+    odt_file = zipfile.ZipFile(import_file)
+    data = str(odt_file.read('content.xml'))  # bytes class to string
+    #https://stackoverflow.com/questions/18488734/python3-unescaping-non-ascii-characters
+    data = str(bytes([ord(char) for char in data.encode("utf_8").decode("unicode_escape")]), "utf_8")
+    data_start = data.find("</text:sequence-decls>")
+    data_end = data.find("</office:text>")
+    if data_start == -1 or data_end == -1:
+        logger.warning("ODT IMPORT ERROR")
+        return ""
+    data = data[data_start + 22: data_end]
+    data = data.replace('<text:h', '\n<text:h')
+    data = data.replace('</text:h>', '\n\n')
+    data = data.replace('</text:list-item>', '\n')
+    data = data.replace('</text:span>', '')
+    data = data.replace('</text:p>', '\n')
+    data = data.replace('</text:a>', ' ')
+    data = data.replace('</text:list>', '')
+    data = data.replace('<text:list-item>', '')
+    data = data.replace('<table:table table:name=', '\n=== TABLE ===\n<table:table table:name=')
+    data = data.replace('</table:table>', '=== END TABLE ===\n')
+    data = data.replace('</table:table-cell>', '\n')
+    data = data.replace('</table:table-row>', '')
+    data = data.replace('<draw:image', '\n=== IMG ===<draw:image')
+    data = data.replace('</draw:frame>', '\n')
+
+    text = ""
+    tagged = False
+    for i in range(0, len(data)):
+        if data[i: i + 6] == "<text:" or data[i: i + 7] == "<table:" or data[i: i + 6] == "<draw:":
+            tagged = True
+        if not tagged:
+            text += data[i]
+        if data[i] == ">":
+            tagged = False
+    return text
+
+
+class ImportSignals(QtCore.QObject):
+    """ Signals from ImportWorker.
+    progress - number of files done
+    page - file name and page number, as each PDF page is read
+    imported - result dictionary from import_document, for each file
+    finished - all files done, not emitted if cancelled """
+
+    progress = QtCore.pyqtSignal(int)
+    page = QtCore.pyqtSignal(str, int)
+    imported = QtCore.pyqtSignal(dict)
+    finished = QtCore.pyqtSignal()
+
+
+class _PageSignal(object):
+    """ Queue-like object that emits the page signal, for imports in the worker thread. """
+
+    def __init__(self, signal):
+        self.signal = signal
+
+    def put(self, item):
+        self.signal.emit(*item)
+
+
+class ImportWorker(QtCore.QRunnable):
+    """ Import documents in a process pool, from a QThreadPool thread.
+    Each file is copied and parsed in a worker process. The results are sent back to
+    the dialog in the order they finish, the dialog inserts them into the database when
+    all have finished. If cancelled, the copied files are removed.
+    PDF page progress comes back from the processes through a manager queue.
+    If a process pool cannot be started the files are imported in this thread. """
+
+    def __init__(self, jobs):
+        """ param: jobs - list of (path, destination, decrypt_pdf) """
+
+        super(ImportWorker, self).__init__()
+        self.jobs = jobs
+        self.cancelled = False
+        self.signals = ImportSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        try:
+            executor = ProcessPoolExecutor()
+        except (OSError, NotImplementedError) as e:
+            logger.warning("Import process pool: " + str(e))
+            executor = None
+        if executor is None:
+            page_signal = _PageSignal(self.signals.page)
+            for done, job in enumerate(self.jobs, 1):
+                if self.cancelled:
+                    break
+                self.signals.imported.emit(import_document(*job, page_queue=page_signal))
+                self.signals.progress.emit(done)
+        else:
+            self.run_processes(executor)
+        if self.cancelled:
+            self.remove_copies()
+        else:
+            self.signals.finished.emit()
+
+    def remove_copies(self):
+        """ Remove the files copied into the project by a cancelled import. Called once the
+        processes have stopped, so no file is written afterwards. """
+
+        for job in self.jobs:
+            try:
+                os.remove(job[1])
+            except OSError:
+                pass
+
+    def run_processes(self, executor):
+        manager = None
+        page_queue = None
+        if any(job[0].split('.')[-1].lower() == 'pdf' for job in self.jobs):
+            try:
+                manager = multiprocessing.Manager()
+                page_queue = manager.Queue()
+            except (OSError, EOFError) as e:
+                logger.warning("Import page progress: " + str(e))
+        futures = {}
+        done = 0
+        try:
+            for job in self.jobs:
+                futures[executor.submit(import_document, *job, page_queue=page_queue)] = job
+            pending = set(futures)
+            while pending and not self.cancelled:
+                finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                self.emit_pages(page_queue)
+                for future in finished:
+                    if self.cancelled:
+                        return
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # the worker process failed, e.g. BrokenProcessPool
+                        path, destination = futures[future][:2]
+                        result = {'path': path, 'destination': destination, 'name': path.split("/")[-1],
+                            'hash': "", 'text': "", 'pages': [], 'encoding': "", 'log': "", 'warning': "",
+                            'error': str(e)}
+                    done += 1
+                    self.signals.imported.emit(result)
+                    self.signals.progress.emit(done)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+            if manager is not None:
+                manager.shutdown()
+
+    def emit_pages(self, page_queue):
+        """ Emit the page progress sent by the worker processes. """
+
+        if page_queue is None:
+            return
+        try:
+            while True:
+                self.signals.page.emit(*page_queue.get_nowait())
+        except (queue.Empty, OSError, EOFError):
+            pass
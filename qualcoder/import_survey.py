@@ -319,6 +319,8 @@ class DialogImportSurvey(QtWidgets.QDialog):
                 self.app.conn.commit()
                 cur.execute("select last_insert_rowid()")
                 fid = cur.fetchone()[0]
+                self.app.get_project_model().add_file({'id': fid, 'name': self.fields[field] + "_" + now,
+                    'mediapath': None, 'memo': "", 'owner': self.app.settings['codername'], 'date': now_date})
                 case_text_sql = "insert into case_text (owner, date, memo, pos0, pos1, caseid, fid) values(?,?,?,?,?,?,?)"
                 for case_text in case_text_list:
                     case_text.append(fid)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+from bisect import bisect_left, bisect_right, insort
+
+
+class IntervalIndex(object):
+    """ Index of coded text, annotations or case text by character position, for
+    one open file.
+    Items are dictionaries with integer pos0 and pos1 keys, e.g. rows from code_text,
+    annotation or case_text. An item covers position p if pos0 <= p <= pos1, which is
+    the test used throughout the coding dialogs.
+
+    Items are stored in a segment tree over character positions, each item is held in
+    O(log n) tree nodes. Finding the items covering a position walks from leaf to root.
+    A sorted list of start positions is kept for overlap queries.
+    The index is updated incrementally with add and remove.
+    """
+
+    def __init__(self, items=None, size=1024):
+        self.size = 1
+        while self.size < size:
+            self.size *= 2
+        self.nodes = {}
+        self.items = {}
+        self.starts = []
+        self.counter = 0
+        if items is not None:
+            for item in items:
+                self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        """ Iterate items in the order they were added. """
+
+        for key in sorted(self.items, key=lambda k: self.items[k][0]):
+            yield self.items[key][1]
+
+    def clear(self):
+        self.nodes = {}
+        self.items = {}
+        self.starts = []
+
+    def add(self, item):
+        """ Add a dictionary item with pos0 and pos1 keys. """
+
+        key = id(item)
+        if key in self.items:
+            return
+        pos0 = max(int(item['pos0']), 0)
+        pos1 = max(int(item['pos1']), pos0)
+        if pos1 >= self.size:
+            self._grow(pos1 + 1)
+        self.counter += 1
+        self.items[key] = (self.counter, item, pos0, pos1)
+        insort(self.starts, (pos0, self.counter, key))
+        for node in self._nodes_for(pos0, pos1):
+            self.nodes.setdefault(node, set()).add(key)
+
+    def remove(self, item):
+        """ Remove an item. Items not in the index are ignored. """
+
+        key = id(item)
+        entry = self.items.pop(key, None)
+        if entry is None:
+            return
+        order, item, pos0, pos1 = entry
+        i = bisect_left(self.starts, (pos0, order, key))
+        if i < len(self.starts) and self.starts[i][2] == key:
+            del self.starts[i]
+        for node in self._nodes_for(pos0, pos1):
+            keys = self.nodes.get(node)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.nodes[node]
+
+    def at(self, pos):
+        """ Get items where pos0 <= pos <= pos1, in the order they were added. """
+
+        if pos < 0 or pos >= self.size:
+            return []
+        keys = set()
+        node = pos + self.size
+        while node >= 1:
+            keys.update(self.nodes.get(node, ()))
+            node //= 2
+        return self._ordered(keys)
+
+    def overlapping(self, pos0, pos1):
+        """ Get items that overlap the selection pos0 to pos1 (end exclusive).
+        These are items covering pos0 plus items starting inside the selection. """
+
+        keys = set()
+        if pos0 >= 0:
+            for item in self.at(pos0):
+                if item['pos1'] > pos0:
+                    keys.add(id(item))
+        lo = bisect_right(self.starts, (pos0, float('inf'), 0))
+        hi = bisect_left(self.starts, (pos1, 0, 0))
+        for start in self.starts[lo:hi]:
+            keys.add(start[2])
+        return self._ordered(keys)
+
+    def _ordered(self, keys):
+        entries = sorted(self.items[k] for k in keys if k in self.items)
+        return [e[1] for e in entries]
+
+    def _nodes_for(self, pos0, pos1):
+        """ Segment tree nodes that together cover pos0 to pos1 inclusive. """
+
+        nodes = []
+        lo = pos0 + self.size
+        hi = pos1 + self.size + 1
+        while lo < hi:
+            if lo & 1:
+                nodes.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                nodes.append(hi)
+            lo //= 2
+            hi //= 2
+        return nodes
+
+    def _grow(self, size):
+        """ Increase the position range and re-index the current items. """
+
+        entries = sorted(self.items.values())
+        while self.size < size:
+            self.size *= 2
+        self.nodes = {}
+        for order, item, pos0, pos1 in entries:
+            for node in self._nodes_for(pos0, pos1):
+                self.nodes.setdefault(node, set()).add(id(item))
@@ -32,38 +32,18 @@ import logging
 import datetime
 import os
 import platform
+import sqlite3
 import sys
-from shutil import copyfile
-import subprocess
 import traceback
-import zipfile
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
-pdfminer_installed = True
-try:
-    from pdfminer.pdfpage import PDFPage
-    from pdfminer.pdfparser import PDFParser
-    from pdfminer.pdfdocument import PDFDocument
-    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-    from pdfminer.converter import PDFPageAggregator
-    from pdfminer.layout import LAParams, LTTextBox, LTTextLine
-except:  # ModuleNotFoundError
-    pdfminer_installed = False
-    text = "For Linux run the following on the terminal: sudo pip install pdfminer.six\n"
-    text += "For Windows run the following in the command prmpt: pip install pdfminer.six"
-    QtWidgets.QMessageBox.critical(None, _('pdfminer is not installed.'), _(text))
-
-import ebooklib
-from ebooklib import epub
-
 from add_item_name import DialogAddItemName
 from confirm_delete import DialogConfirmDelete
-from docx import opendocx, getdocumenttext
 from GUI.ui_dialog_attribute_type import Ui_Dialog_attribute_type
 from GUI.ui_dialog_manage_files import Ui_Dialog_manage_files
 from GUI.ui_dialog_memo import Ui_Dialog_memo  # for manually creating a new file
-from html_parser import *
+from import_documents import DOCUMENT_TYPES, ImportWorker, copy_and_hash, pdfminer_installed
 from memo import DialogMemo
 from view_image import DialogViewImage
 from view_av import DialogViewAV
@@ -72,6 +52,11 @@ from view_av import DialogViewAV
 path = os.path.abspath(os.path.dirname(__file__))
 logger = logging.getLogger(__name__)
 
+if not pdfminer_installed:
+    text = "For Linux run the following on the terminal: sudo pip install pdfminer.six\n"
+    text += "For Windows run the following in the command prmpt: pip install pdfminer.six"
+    QtWidgets.QMessageBox.critical(None, _('pdfminer is not installed.'), _(text))
+
 
 def exception_handler(exception_type, value, tb_obj):
     """ Global exception handler useful in GUIs.
@@ -83,6 +68,103 @@ def exception_handler(exception_type, value, tb_obj):
     QtWidgets.QMessageBox.critical(None, _('Uncaught Exception'), text)
 
 
+class FileTableModel(QtCore.QAbstractTableModel):
+    """ Table model of the source files and their attribute values.
+    Columns are name, memo, date, id, then one column per file attribute.
+    Attribute values are held in a dictionary of (fid, attribute name): value, so each
+    cell is looked up directly. Name and attribute cells can be edited, the edit is
+    passed to edit_handler(row, column, value), which returns True to accept it. """
+
+    def __init__(self, edit_handler, parent=None):
+
+        super(FileTableModel, self).__init__(parent)
+        self.edit_handler = edit_handler
+        self.source = []
+        self.attributes = {}
+        self.header_labels = []
+
+    def set_data(self, source, attributes, header_labels):
+        """ Replace all the table data. """
+
+        self.beginResetModel()
+        self.source = source
+        self.attributes = attributes
+        self.header_labels = header_labels
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.source)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.header_labels)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.header_labels[section]
+        return None
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+        if index.column() == DialogManageFiles.NAME_COLUMN or index.column() > DialogManageFiles.ID_COLUMN:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        file_ = self.source[index.row()]
+        column = index.column()
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self.cell_text(file_, column)
+        if role == QtCore.Qt.UserRole:
+            # sort key, ids sort as numbers
+            if column == DialogManageFiles.ID_COLUMN:
+                return file_['id']
+            return self.cell_text(file_, column).lower()
+        if role == QtCore.Qt.ToolTipRole and column == DialogManageFiles.NAME_COLUMN:
+            if file_['characters'] is not None:
+                return _("Characters: ") + str(file_['characters'])
+        return None
+
+    def cell_text(self, file_, column):
+        if column == DialogManageFiles.NAME_COLUMN:
+            return file_['name']
+        if column == DialogManageFiles.MEMO_COLUMN:
+            if file_['memo'] is not None and file_['memo'] != "":
+                return "Yes"
+            return ""
+        if column == DialogManageFiles.DATE_COLUMN:
+            if file_['date'] is None:
+                return ""
+            return file_['date']
+        if column == DialogManageFiles.ID_COLUMN:
+            return str(file_['id'])
+        value = self.attributes.get((file_['id'], self.header_labels[column]))
+        if value is None:
+            return ""
+        return str(value)
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+        value = str(value).strip()
+        if not self.edit_handler(index.row(), index.column(), value):
+            return False
+        if index.column() > DialogManageFiles.ID_COLUMN:
+            self.attributes[(self.source[index.row()]['id'], self.header_labels[index.column()])] = value
+        self.dataChanged.emit(index, index)
+        return True
+
+    def row_changed(self, row):
+        """ Call after changing a file dictionary, e.g. the memo, to redraw the row. """
+
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.header_labels) - 1))
+
+
 class DialogManageFiles(QtWidgets.QDialog):
     """ View, import, export, rename and delete text files. """
 
@@ -98,6 +180,10 @@ class DialogManageFiles(QtWidgets.QDialog):
     attribute_names = []  # list of dictionary name:value for additem dialog
     parent_textEdit = None
     dialogList = []
+    import_worker = None
+    import_progress = None
+    import_results = []
+    import_messages = []
 
     def __init__(self, app, parent_textEdit):
 
@@ -105,22 +191,33 @@ class DialogManageFiles(QtWidgets.QDialog):
         self.app = app
         self.parent_textEdit = parent_textEdit
         self.dialogList = []
-        self.attributes = []
-        self.load_file_data()
+        self.attributes = {}
         QtWidgets.QDialog.__init__(self)
         self.ui = Ui_Dialog_manage_files()
         self.ui.setupUi(self)
         font = 'font: ' + str(self.app.settings['fontsize']) + 'pt '
         font += '"' + self.app.settings['font'] + '";'
         self.setStyleSheet(font)
-        self.ui.tableWidget.itemChanged.connect(self.cell_modified)
+        self.table_model = FileTableModel(self.cell_modified, self)
+        self.proxy_model = QtCore.QSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.table_model)
+        self.proxy_model.setSortRole(QtCore.Qt.UserRole)
+        self.proxy_model.setFilterKeyColumn(self.NAME_COLUMN)
+        self.proxy_model.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.ui.tableView.setModel(self.proxy_model)
+        self.ui.tableView.setSortingEnabled(True)
+        self.ui.tableView.sortByColumn(self.NAME_COLUMN, QtCore.Qt.AscendingOrder)
+        self.ui.tableView.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.ui.tableView.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectItems)
+        self.ui.tableView.verticalHeader().setVisible(False)
+        self.ui.lineEdit_filter.textChanged.connect(self.proxy_model.setFilterFixedString)
         self.ui.pushButton_create.clicked.connect(self.create)
         self.ui.pushButton_view.clicked.connect(self.view)
         self.ui.pushButton_delete.clicked.connect(self.delete)
         self.ui.pushButton_import.clicked.connect(self.import_files)
         self.ui.pushButton_export.clicked.connect(self.export)
         self.ui.pushButton_add_attribute.clicked.connect(self.add_attribute)
-        self.ui.tableWidget.cellClicked.connect(self.cell_selected)
+        self.ui.tableView.clicked.connect(self.cell_selected)
         self.fill_table()
 
     def load_file_data(self):
@@ -133,11 +230,12 @@ class DialogManageFiles(QtWidgets.QDialog):
 
         self.source = []
         cur = self.app.conn.cursor()
-        cur.execute("select name, id, fulltext, mediapath, memo, owner, date from source order by upper(name)")
+        # fulltext is not loaded here, see get_fulltext
+        cur.execute("select name, id, mediapath, memo, owner, date, length(fulltext) from source order by upper(name)")
         result = cur.fetchall()
         for row in result:
-            self.source.append({'name': row[0], 'id': row[1], 'fulltext': row[2],
-            'mediapath': row[3], 'memo': row[4], 'owner': row[5], 'date': row[6]})
+            self.source.append({'name': row[0], 'id': row[1], 'mediapath': row[2],
+            'memo': row[3], 'owner': row[4], 'date': row[5], 'characters': row[6]})
         # attributes
         self.headerLabels = [_("Name"), _("Memo"), _("Date"), _("Id")]
         sql = "select name from attribute_type where caseOrFile='file'"
@@ -151,9 +249,29 @@ class DialogManageFiles(QtWidgets.QDialog):
         attribute_type.name=attribute.name where attribute_type.caseOrFile='file'"
         cur.execute(sql)
         result = cur.fetchall()
-        self.attributes = []
+        self.attributes = {}
         for row in result:
-            self.attributes.append(row)
+            self.attributes[(row[2], row[0])] = row[1]
+
+    def current_row(self):
+        """ Get the source row of the current table cell, through the sort and filter proxy.
+        return: row in self.source, or None if no cell is selected """
+
+        index = self.proxy_model.mapToSource(self.ui.tableView.currentIndex())
+        if not index.isValid():
+            return None
+        return index.row()
+
+    def get_fulltext(self, fid):
+        """ Get the text of one file, when it is viewed or exported.
+        return: text, or an empty string for media files """
+
+        cur = self.app.conn.cursor()
+        cur.execute("select fulltext from source where id=?", [fid])
+        result = cur.fetchone()
+        if result is None or result[0] is None:
+            return ""
+        return result[0]
 
     def add_attribute(self):
         """ When add button pressed, opens the addItem dialog to get new attribute text.
@@ -188,17 +306,16 @@ class DialogManageFiles(QtWidgets.QDialog):
             sql = "insert into attribute (name, value, id, attr_type, date, owner) values (?,?,?,?,?,?)"
             cur.execute(sql, (name, "", id_[0], 'file', now_date, self.app.settings['codername']))
         self.app.conn.commit()
-        self.load_file_data()
         self.fill_table()
         self.parent_textEdit.append(_("Attribute added to files: ") + name + ", " + _("type") + ": " + valuetype)
 
-    def cell_selected(self):
-        """ When the table widget memo cell is selected display the memo.
+    def cell_selected(self, index):
+        """ When the table memo cell is selected display the memo.
         Update memo text, or delete memo by clearing text.
-        If a new memo also show in table widget by displaying YES in the memo column. """
+        If a new memo also show in table by displaying YES in the memo column. """
 
-        x = self.ui.tableWidget.currentRow()
-        y = self.ui.tableWidget.currentColumn()
+        x = self.proxy_model.mapToSource(index).row()
+        y = index.column()
 
         if y == self.MEMO_COLUMN:
             name =self.source[x]['name'].lower()
@@ -218,20 +335,20 @@ class DialogManageFiles(QtWidgets.QDialog):
                 cur = self.app.conn.cursor()
                 cur.execute('update source set memo=? where id=?', (ui.memo, self.source[x]['id']))
                 self.app.conn.commit()
-            if self.source[x]['memo'] == "":
-                self.ui.tableWidget.setItem(x, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem())
-            else:
-                self.ui.tableWidget.setItem(x, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem("Yes"))
+            self.table_model.row_changed(x)
 
-    def cell_modified(self):
-        """ If the filename has been changed in the table widget update the database.
+    def cell_modified(self, x, y, value):
+        """ Called by the table model when a cell is edited.
+        If the filename has been changed update the database.
         Need to preserve the relationship between an audio/video file and its related
-        transcribed file. Attribute values can be changed. """
+        transcribed file. Attribute values can be changed.
+        param: x - row in self.source
+        param: y - table column
+        param: value - the new cell text
+        return: True if the change is accepted """
 
-        x = self.ui.tableWidget.currentRow()
-        y = self.ui.tableWidget.currentColumn()
         if y == self.NAME_COLUMN:
-            new_text = str(self.ui.tableWidget.item(x, y).text()).strip()
+            new_text = value
 
             # check that no other source file has this text and this is is not empty
             update = True
@@ -259,18 +376,19 @@ class DialogManageFiles(QtWidgets.QDialog):
                 cur = self.app.conn.cursor()
                 cur.execute("update source set name=? where id=?", (new_text, self.source[x]['id']))
                 self.app.conn.commit()
-            else:  # put the original text in the cell
-                self.ui.tableWidget.item(x, y).setText(self.source[x]['name'])
+                self.app.get_project_model().rename_file(self.source[x]['id'], new_text)
+            # otherwise the cell keeps the original text
+            return update
         # update attribute value
         if y > self.ID_COLUMN:
-            value = str(self.ui.tableWidget.item(x, y).text()).strip()
             attribute_name = self.headerLabels[y]
             cur = self.app.conn.cursor()
             cur.execute("update attribute set value=? where id=? and name=? and attr_type='file'",
             (value, self.source[x]['id'], attribute_name))
             self.app.conn.commit()
             #logger.debug("updating: " + attribute_name + " , " + value)
-            self.ui.tableWidget.resizeColumnsToContents()
+            return True
+        return False
 
     def is_caselinked_or_coded_or_annotated(self, fid):
         """ Check for text linked to case, coded or annotated text.
@@ -319,11 +437,9 @@ class DialogManageFiles(QtWidgets.QDialog):
         """ View and edit text file contents.
         Alternatively view an image or other media. """
 
-        # need to reload this, as transcribed files can be changed via view_av, and are otherwise not
-        # updated
-        self.load_file_data()
-
-        x = self.ui.tableWidget.currentRow()
+        x = self.current_row()
+        if x is None:
+            return
         if self.source[x]['mediapath'] is not None:
             if self.source[x]['mediapath'][:8] == "/images/":
                 self.view_image(x)
@@ -345,6 +461,7 @@ class DialogManageFiles(QtWidgets.QDialog):
             self.text_ui.textEdit.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
             self.text_ui.textEdit.customContextMenuRequested.connect(self.textEdit_menu)
         self.text_ui.textEdit.setFontPointSize(self.app.settings['fontsize'])
+        self.source[x]['fulltext'] = self.get_fulltext(self.source[x]['id'])
         self.text_ui.textEdit.setPlainText(self.source[x]['fulltext'])
         self.highlight(self.source[x]['id'], self.text_ui.textEdit)
 
@@ -354,12 +471,15 @@ class DialogManageFiles(QtWidgets.QDialog):
         self.text_dialog.setWindowTitle(title)
         self.text_dialog.exec_()
         text = self.text_ui.textEdit.toPlainText()
-        if text == self.source[x]['fulltext']:
+        fulltext = self.source[x].pop('fulltext')
+        self.source[x]['characters'] = len(text)
+        if text == fulltext:
             return
 
-        self.source[x]['fulltext'] = text
         cur = self.app.conn.cursor()
         cur.execute("update source set fulltext=? where id=?", (text, self.source[x]['id']))
+        # the PDF page offsets are no longer known
+        cur.execute("delete from source_page where fid=?", [self.source[x]['id']])
         self.app.conn.commit()
 
     def textEdit_menu(self, position):
@@ -367,7 +487,9 @@ class DialogManageFiles(QtWidgets.QDialog):
         The section of text must be only non-annotated and non-coded or
         only annotated or coded. """
 
-        x = self.ui.tableWidget.currentRow()
+        x = self.current_row()
+        if x is None:
+            return
         menu = QtWidgets.QMenu()
         ActionItemEdit = menu.addAction(_("Edit text maximum 20 characters"))
         action = menu.exec_(self.text_ui.textEdit.mapToGlobal(position))
@@ -516,6 +638,11 @@ class DialogManageFiles(QtWidgets.QDialog):
         for i in post_code_linked:
             sql = "update code_text set pos0=?,pos1=? where fid=? and pos0=? and pos1=?"
             cur.execute(sql, [i[0] + length_diff, i[1] + length_diff, self.source[x]['id'], i[0], i[1]])
+        # PDF pages after the edit move, the page with the edit changes length
+        cur.execute("update source_page set pos0=pos0+? where fid=? and pos0>=?",
+            [length_diff, self.source[x]['id'], selend])
+        cur.execute("update source_page set pos1=pos1+? where fid=? and pos1>=?",
+            [length_diff, self.source[x]['id'], selend])
         self.app.conn.commit()
 
         # UPDATE THE CODED AND/OR ANNOTATED SECTION
@@ -552,11 +679,7 @@ class DialogManageFiles(QtWidgets.QDialog):
             self.dialogList.append(ui)
             ui.show()
             # try and update file data here
-            self.load_file_data()
-            if self.source[x]['memo'] == "":
-                self.ui.tableWidget.setItem(x, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem())
-            else:
-                self.ui.tableWidget.setItem(x, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem("Yes"))
+            self.fill_table()
         except Exception as e:
             logger.debug(e)
             print(e)
@@ -575,10 +698,7 @@ class DialogManageFiles(QtWidgets.QDialog):
             cur.execute('update source set memo=? where id=?', (self.source[x]['memo'],
                 self.source[x]['id']))
             self.app.conn.commit()
-        if self.source[x]['memo'] == "":
-            self.ui.tableWidget.setItem(x, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem())
-        else:
-            self.ui.tableWidget.setItem(x, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem("Yes"))
+        self.table_model.row_changed(x)
 
     def create(self):
         """ Create a new text file by entering text into the dialog.
@@ -610,8 +730,10 @@ class DialogManageFiles(QtWidgets.QDialog):
         cur.execute("select last_insert_rowid()")
         id_ = cur.fetchone()[0]
         entry['id'] = id_
+        entry['characters'] = len(entry.pop('fulltext'))
         self.parent_textEdit.append(_("File created: ") + entry['name'])
         self.source.append(entry)
+        self.app.get_project_model().add_file(entry)
         self.fill_table()
 
     def import_files(self):
@@ -622,87 +744,230 @@ class DialogManageFiles(QtWidgets.QDialog):
         Imports images as jpg, jpeg, png which are stored in an images directory.
         Imports audio as mp3, wav which are stored in an audio directory
         Imports video as mp4, mov, ogg, wmv which are stored in a video directory
+        Documents are copied and parsed by ImportWorker in a process pool, see import_documents.
+        Files with the same content as a project file, by the hash of their bytes, are not imported.
         """
 
         imports, ok = QtWidgets.QFileDialog.getOpenFileNames(None, _('Open file'),
             self.default_import_directory)
         if not ok or imports == []:
             return
-        known_file_type = False
         nameSplit = imports[0].split("/")
         temp_filename = nameSplit[-1]
         self.default_import_directory = imports[0][0:-len(temp_filename)]
+        names = set(d['name'] for d in self.source)
+        jobs = []
+        self.import_messages = []
+        pdf_warning = False
         for f in imports:
-            # Added process events, in case many large files are imported, which leaves the FileDialog open and covering the screen.
-            QtWidgets.QApplication.processEvents()
             filename = f.split("/")[-1]
+            suffix = f.split('.')[-1].lower()
             destination = self.app.project_path
-            if f.split('.')[-1].lower() in ('docx', 'odt', 'txt', 'htm', 'html', 'epub'):
-                destination += "/documents/" + filename
-                copyfile(f, destination)
-                self.load_file_text(f)
-                known_file_type = True
-            if f.split('.')[-1].lower() in ('pdf'):
-                if pdfminer_installed is False:
-                    text = "For Linux run the following on the terminal: sudo pip install pdfminer.six\n"
-                    text += "For Windows run the following in the command prmpt: pip install pdfminer.six"
-                    QtWidgets.QMessageBox.critical(None, _('pdfminer is not installed.'), _(text))
-                    return
-                destination += "/documents/" + filename
-                # remove encryption from pdf if possible, for Linux
-                if platform.system() == "Linux":
-                    process = subprocess.Popen(["qpdf", "--decrypt", f, destination],
-                        stdout=subprocess.PIPE)
-                    process.wait()
-                    self.load_file_text(destination)
-                else:
+            if filename in names:
+                self.import_messages.append(filename + ": " + _("Duplicate filename.\nFile not imported"))
+                continue
+            if suffix in DOCUMENT_TYPES:
+                if suffix == 'pdf' and pdfminer_installed is False:
+                    self.import_messages.append(filename + ": " + _('pdfminer is not installed.'))
+                    continue
+                if suffix == 'pdf' and platform.system() != "Linux":
                     #TODO qpdf decrypt not implemented for windows, OSX
-                    QtWidgets.QMessageBox.warning(None, _('If import error occurs'),
-                    _("Sometimes pdfs are encrypted, download and decrypt using qpdf before trying to load the pdf") + ":\n" + f)
-                    copyfile(f, destination)
-                    self.load_file_text(destination)
-                known_file_type = True
-            if f.split('.')[-1].lower() in ('jpg', 'jpeg', 'png'):
-                destination += "/images/" + filename
-                copyfile(f, destination)
-                self.load_media_reference("/images/" + filename)
-                known_file_type = True
-            if f.split('.')[-1].lower() in ('wav', 'mp3'):
-                destination += "/audio/" + filename
-                copyfile(f, destination)
-                self.load_media_reference("/audio/" + filename)
-                known_file_type = True
-            if f.split('.')[-1].lower() in ('mkv', 'mov', 'mp4', 'ogg', 'wmv'):
-                destination += "/video/" + filename
-                copyfile(f, destination)
-                self.load_media_reference("/video/" + filename)
-                known_file_type = True
-            if not known_file_type:
-                QtWidgets.QMessageBox.warning(None, _('Unknown file type'),
-                    _("Unknown file type for import") + ":\n" + f)
-        self.load_file_data()
+                    pdf_warning = True
+                names.add(filename)
+                # remove encryption from pdf if possible, for Linux
+                jobs.append((f, destination + "/documents/" + filename,
+                    suffix == 'pdf' and platform.system() == "Linux"))
+            elif suffix in ('jpg', 'jpeg', 'png'):
+                names.add(filename)
+                self.import_media(f, "/images/" + filename)
+            elif suffix in ('wav', 'mp3'):
+                names.add(filename)
+                self.import_media(f, "/audio/" + filename)
+            elif suffix in ('mkv', 'mov', 'mp4', 'ogg', 'wmv'):
+                names.add(filename)
+                self.import_media(f, "/video/" + filename)
+            else:
+                self.import_messages.append(f + ": " + _("Unknown file type for import"))
+        if pdf_warning:
+            QtWidgets.QMessageBox.warning(None, _('If import error occurs'),
+                _("Sometimes pdfs are encrypted, download and decrypt using qpdf before trying to load the pdf"))
+        self.import_results = []
+        if jobs == []:
+            self.import_finished()
+            return
+
+        # Parse in worker processes, insert all the files in one transaction when finished
+        self.ui.pushButton_import.setEnabled(False)
+        self.import_progress = QtWidgets.QProgressDialog(_("Importing files"), _("Cancel"), 0, len(jobs), self)
+        self.import_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.import_progress.setValue(0)
+        self.import_worker = ImportWorker(jobs)
+        self.import_worker.signals.progress.connect(self.import_progress.setValue)
+        self.import_worker.signals.page.connect(self.import_page)
+        self.import_worker.signals.imported.connect(self.import_result)
+        self.import_worker.signals.finished.connect(self.import_finished)
+        self.import_progress.canceled.connect(self.import_cancel)
+        QtCore.QThreadPool.globalInstance().start(self.import_worker)
+
+    def same_content(self, hash_):
+        """ Find a project file with the same content, using the indexed source hash.
+        return: file name, or None """
+
+        cur = self.app.conn.cursor()
+        cur.execute("select name from source where hash=? limit 1", [hash_])
+        result = cur.fetchone()
+        if result is None:
+            return None
+        return result[0]
+
+    def import_media(self, path, mediapath):
+        """ Copy an image, audio or video file into the project and load its reference.
+        The file is hashed as it is copied. If the project has a file with the same content
+        the copy is removed and the file is not imported.
+        param: path - the file to import
+        param: mediapath - project path of the copy, e.g. /images/filename """
+
+        destination = self.app.project_path + mediapath
+        hash_ = copy_and_hash(path, destination)
+        same = self.same_content(hash_)
+        if same is not None:
+            os.remove(destination)
+            self.import_messages.append(mediapath.split("/")[-1] + ": " + _("Same content as") + " " + same
+                + ".\n" + _("File not imported"))
+            return
+        self.load_media_reference(mediapath, hash_)
+
+    def import_page(self, name, page):
+        """ Show the PDF page being read by the import worker. """
+
+        if self.import_worker is None:
+            return
+        self.import_progress.setLabelText(_("Importing files") + "\n" + name + " " + _("page") + " " + str(page))
+
+    def import_result(self, result):
+        """ Keep one parsed document from the import worker, to insert when all are finished.
+        param: result - dictionary from import_documents.import_document """
+
+        if self.import_worker is None:
+            return
+        self.import_progress.setLabelText(_("Importing files") + "\n" + result['name'])
+        self.import_results.append(result)
+
+    @staticmethod
+    def remove_import_copy(result):
+        """ Remove the copy of a document that is not imported. """
+
+        try:
+            os.remove(result['destination'])
+        except OSError as e:
+            logger.debug(str(e))
+
+    def insert_imported_text(self, cur, result):
+        """ Insert one parsed document. Files that could not be parsed, or have the same
+        content as a project file, are removed and listed when finished.
+        param: cur - cursor, in the import transaction
+        param: result - dictionary from import_documents.import_document
+        return: the source entry, or None """
+
+        if result['error'] != "":
+            self.remove_import_copy(result)
+            self.import_messages.append(result['name'] + ": " + _("Cannot import") + " " + result['error'])
+            return None
+        # also finds files inserted earlier in this transaction
+        same = self.same_content(result['hash'])
+        if same is not None:
+            self.remove_import_copy(result)
+            self.import_messages.append(result['name'] + ": " + _("Same content as") + " " + same
+                + ".\n" + _("File not imported"))
+            return None
+        if result['warning'] != "":
+            self.import_messages.append(result['name'] + ": " + result['warning'])
+        entry = {'name': result['name'], 'id': -1, 'mediapath': None, 'memo': "",
+        'owner': self.app.settings['codername'], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'characters': len(result['text'])}
+        cur.execute("insert into source(name,fulltext,mediapath,memo,owner,date,hash) values(?,?,?,?,?,?,?)",
+            (entry['name'], result['text'], entry['mediapath'], entry['memo'], entry['owner'], entry['date'],
+            result['hash']))
+        cur.execute("select last_insert_rowid()")
+        entry['id'] = cur.fetchone()[0]
+        if result['pages'] != []:
+            cur.executemany("insert into source_page (fid, page, pos0, pos1) values(?,?,?,?)",
+                [(entry['id'], page, pos0, pos1) for page, pos0, pos1 in result['pages']])
+        return entry
+
+    def import_cancel(self):
+        """ Stop the import worker. Nothing has been inserted, the worker removes the copied
+        files once it has stopped. """
+
+        if self.import_worker is not None:
+            self.import_worker.cancel()
+            self.import_worker = None
+        self.import_progress = None
+        self.import_results = []
+        self.ui.pushButton_import.setEnabled(True)
+        self.parent_textEdit.append(_("Import cancelled"))
+
+    def import_finished(self):
+        """ Insert the imported documents in one transaction, then show any import errors
+        and warnings. """
+
+        # clear the worker first, closing the progress dialog emits canceled
+        self.import_worker = None
+        if self.import_progress is not None:
+            self.import_progress.canceled.disconnect(self.import_cancel)
+            self.import_progress.close()
+            self.import_progress = None
+        results = self.import_results
+        self.import_results = []
+        imported = []
+        cur = self.app.conn.cursor()
+        try:
+            for result in results:
+                entry = self.insert_imported_text(cur, result)
+                if entry is not None:
+                    imported.append((entry, result['log']))
+            self.app.conn.commit()
+        except sqlite3.Error as e:
+            self.app.conn.rollback()
+            logger.warning("Import: " + str(e))
+            for result in results:
+                self.remove_import_copy(result)
+            self.import_messages.append(_("Cannot import") + " " + str(e))
+            imported = []
+        for entry, log in imported:
+            self.parent_textEdit.append(entry['name'] + _(" imported.") + " " + log)
+            self.source.append(entry)
+            self.app.get_project_model().add_file(entry)
+        self.ui.pushButton_import.setEnabled(True)
+        if self.import_messages != []:
+            msg = "\n".join(self.import_messages)
+            self.parent_textEdit.append(msg)
+            QtWidgets.QMessageBox.warning(None, _('Warning'), msg)
+            self.import_messages = []
         self.fill_table()
 
-    def load_media_reference(self, mediapath):
-        """ Load media reference information for audio video images. """
+    def load_media_reference(self, mediapath, hash_):
+        """ Load media reference information for audio video images.
+        Duplicate names and content are checked by import_files.
+        param: mediapath - project path of the media file
+        param: hash_ - hash of the media file bytes """
 
-        # check for duplicated filename and update model, widget and database
         name_split = mediapath.split("/")
         filename = name_split[-1]
-        if any(d['name'] == filename for d in self.source):
-            QtWidgets.QMessageBox.warning(None, _('Duplicate file'), _("Duplicate filename.\nFile not imported"))
-            return
         entry = {'name': filename, 'id': -1, 'fulltext': None, 'memo': "", 'mediapath': mediapath,
         'owner': self.app.settings['codername'], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
         cur = self.app.conn.cursor()
-        cur.execute("insert into source(name,memo,owner,date, mediapath, fulltext) values(?,?,?,?,?,?)",
-            (entry['name'], entry['memo'], entry['owner'], entry['date'], entry['mediapath'], entry['fulltext']))
+        cur.execute("insert into source(name,memo,owner,date, mediapath, fulltext, hash) values(?,?,?,?,?,?,?)",
+            (entry['name'], entry['memo'], entry['owner'], entry['date'], entry['mediapath'], entry['fulltext'], hash_))
         self.app.conn.commit()
         cur.execute("select last_insert_rowid()")
         id_ = cur.fetchone()[0]
         entry['id'] = id_
+        fulltext = entry.pop('fulltext')
+        entry['characters'] = None if fulltext is None else len(fulltext)
         self.parent_textEdit.append(entry['name'] + _(" imported."))
         self.source.append(entry)
+        self.app.get_project_model().add_file(entry)
 
         # Create an empty transcription file for audio and video
         if mediapath[:6] in("/audio", "/video"):
@@ -715,155 +980,10 @@ class DialogManageFiles(QtWidgets.QDialog):
             cur.execute("select last_insert_rowid()")
             id_ = cur.fetchone()[0]
             entry['id'] = id_
+            entry['characters'] = len(entry.pop('fulltext'))
             self.parent_textEdit.append(entry['name'] + _(" imported."))
             self.source.append(entry)
-
-    def load_file_text(self, import_file):
-        """ Import from file types of odt, docx pdf, epub, txt, html, htm.
-        """
-
-        text = ""
-
-        # Import from odt
-        if import_file[-4:].lower() == ".odt":
-            text = self.convert_odt_to_text(import_file)
-        # Import from docx
-        if import_file[-5:].lower() == ".docx":
-            #text = convert(importFile)  # uses docx_to_html
-            document = opendocx(import_file)
-            list_ = getdocumenttext(document)
-            text = "\n".join(list_)
-        # Import from epub
-        if import_file[-5:].lower() == ".epub":
-            book = epub.read_epub(import_file)
-            for d in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-                try:
-                    #print(d.get_content())
-                    bytes_ = d.get_body_content()
-                    string = bytes_.decode('utf-8')
-                    text += html_to_text(string) + "\n"
-                except TypeError as e:
-                    logger.debug("ebooklib get_body_content error " + str(e))
-        # import PDF
-        if import_file[-4:].lower() == '.pdf':
-            fp = open(import_file, 'rb')  # read binary mode
-            parser = PDFParser(fp)
-            doc = PDFDocument(parser=parser)
-            parser.set_document(doc)
-            # potential error with encrypted PDF
-            rsrcmgr = PDFResourceManager()
-            laparams = LAParams()
-            laparams.char_margin = 1.0
-            laparams.word_margin = 1.0
-            device = PDFPageAggregator(rsrcmgr, laparams=laparams)
-            interpreter = PDFPageInterpreter(rsrcmgr, device)
-            for page in PDFPage.create_pages(doc):
-                interpreter.process_page(page)
-                layout = device.get_result()
-                for lt_obj in layout:
-                    if isinstance(lt_obj, LTTextBox) or isinstance(lt_obj, LTTextLine):
-                        text += lt_obj.get_text()
-        # import from html
-        if import_file[-5:].lower() == ".html" or import_file[-4:].lower() == ".htm":
-            importErrors = 0
-            with open(import_file, "r") as sourcefile:
-                fileText = ""
-                while 1:
-                    line = sourcefile.readline()
-                    if not line:
-                        break
-                    fileText += line
-                text = html_to_text(fileText)
-                QtWidgets.QMessageBox.warning(None, _('Warning'), str(importErrors) + _(" lines not imported"))
-        # Try importing as a plain text file.
-        if text == "":
-            import_errors = 0
-            try:
-                with open(import_file, "r") as sourcefile:
-                    while 1:
-                        line = sourcefile.readline()
-                        if not line:
-                            break
-                        try:
-                            text += line
-                        except Exception as e:
-                            #logger.debug("Importing plain text file, line ignored: " + str(e))
-                            import_errors += 1
-                    if text[0:6] == "\ufeff":  # associated with notepad files
-                        text = text[6:]
-            except Exception as e:
-                QtWidgets.QMessageBox.warning(None, _('Warning'),
-                    _("Cannot import ") + str(import_file) + "\n" + str(e))
-                return
-            if import_errors > 0:
-                QtWidgets.QMessageBox.warning(None, _('Warning'),
-                    str(import_errors) + _(" lines not imported"))
-                logger.warning(import_file + ": " + str(import_errors) + _(" lines not imported"))
-        # import of text file did not work
-        if text == "":
-            QtWidgets.QMessageBox.warning(None, _('Warning'),
-                _("Cannot import ") + str(import_file) + "\n" + str(e))
-            return
-        # Final checks: check for duplicated filename and update model, widget and database
-        nameSplit = import_file.split("/")
-        filename = nameSplit[-1]
-        if any(d['name'] == filename for d in self.source):
-            QtWidgets.QMessageBox.warning(None, _('Duplicate file'),
-                _("Duplicate filename.\nFile not imported"))
-            return
-        entry = {'name': filename, 'id': -1, 'fulltext': text, 'mediapath': None, 'memo': "",
-        'owner': self.app.settings['codername'], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-        cur = self.app.conn.cursor()
-        #logger.debug("type fulltext: " + str(type(entry['fulltext'])))
-        cur.execute("insert into source(name,fulltext,mediapath,memo,owner,date) values(?,?,?,?,?,?)",
-            (entry['name'],  entry['fulltext'], entry['mediapath'], entry['memo'], entry['owner'], entry['date']))
-        self.app.conn.commit()
-        cur.execute("select last_insert_rowid()")
-        id_ = cur.fetchone()[0]
-        entry['id'] = id_
-        self.parent_textEdit.append(entry['name'] + _(" imported."))
-        self.source.append(entry)
-
-    def convert_odt_to_text(self, import_file):
-        """ Convert odt to very rough equivalent with headings, list items and tables for
-        html display in qTextEdits. """
-
-        odt_file = zipfile.ZipFile(import_file)
-        data = str(odt_file.read('content.xml'))  # bytes class to string
-        #https://stackoverflow.com/questions/18488734/python3-unescaping-non-ascii-characters
-        data = str(bytes([ord(char) for char in data.encode("utf_8").decode("unicode_escape")]), "utf_8")
-        data_start = data.find("</text:sequence-decls>")
-        data_end = data.find("</office:text>")
-        if data_start == -1 or data_end == -1:
-            logger.warning("ODT IMPORT ERROR")
-            return ""
-        data = data[data_start + 22: data_end]
-        #print(data)
-        data = data.replace('<text:h', '\n<text:h')
-        data = data.replace('</text:h>', '\n\n')
-        data = data.replace('</text:list-item>', '\n')
-        data = data.replace('</text:span>', '')
-        data = data.replace('</text:p>', '\n')
-        data = data.replace('</text:a>', ' ')
-        data = data.replace('</text:list>', '')
-        data = data.replace('<text:list-item>', '')
-        data = data.replace('<table:table table:name=', '\n=== TABLE ===\n<table:table table:name=')
-        data = data.replace('</table:table>', '=== END TABLE ===\n')
-        data = data.replace('</table:table-cell>', '\n')
-        data = data.replace('</table:table-row>', '')
-        data = data.replace('<draw:image', '\n=== IMG ===<draw:image')
-        data = data.replace('</draw:frame>', '\n')
-
-        text = ""
-        tagged = False
-        for i in range(0, len(data)):
-            if data[i: i + 6] == "<text:" or data[i: i + 7] == "<table:" or data[i: i + 6] == "<draw:":
-                tagged = True
-            if not tagged:
-                text += data[i]
-            if data[i] == ">":
-                tagged = False
-        return text
+            self.app.get_project_model().add_file(entry)
 
     '''def convert_odt_to_html(self, import_file):
         """ Convert odt to very rough equivalent with headings, list items and tables for
@@ -909,8 +1029,8 @@ class DialogManageFiles(QtWidgets.QDialog):
     def export(self):
         """ Export fulltext to a plain text file, filename will have .txt ending. """
 
-        x = self.ui.tableWidget.currentRow()
-        if self.source[x]['mediapath'] is not None:
+        x = self.current_row()
+        if x is None or self.source[x]['mediapath'] is not None:
             return
         filename = self.source[x]['name']
         if len(filename) > 5 and (filename[-5:] == ".html" or filename[-5:] == ".docx"):
@@ -924,7 +1044,7 @@ class DialogManageFiles(QtWidgets.QDialog):
         if directory !="":
             filename = directory + "/" + filename
             #logger.info(_("Exporting to ") + filename)
-            filedata = self.source[x]['fulltext']
+            filedata = self.get_fulltext(self.source[x]['id'])
             f = open(filename, 'w')
             f.write(filedata)
             f.close()
@@ -935,7 +1055,9 @@ class DialogManageFiles(QtWidgets.QDialog):
         """ Delete file from database and update model and widget.
         Also, delete files from sub-directories. """
 
-        x = self.ui.tableWidget.currentRow()
+        x = self.current_row()
+        if x is None:
+            return
         fileId = self.source[x]['id']
         ui = DialogConfirmDelete(self.source[x]['name'])
         ok = ui.exec_()
@@ -946,6 +1068,7 @@ class DialogManageFiles(QtWidgets.QDialog):
         # delete text source
         if self.source[x]['mediapath'] is None:
             cur.execute("delete from source where id = ?", [fileId])
+            cur.execute("delete from source_page where fid = ?", [fileId])
             cur.execute("delete from code_text where fid = ?", [fileId])
             cur.execute("delete from annotation where fid = ?", [fileId])
             cur.execute("delete from case_text where fid = ?", [fileId])
@@ -968,54 +1091,19 @@ class DialogManageFiles(QtWidgets.QDialog):
             self.app.conn.commit()
 
         self.parent_textEdit.append(_("Deleted: ") + self.source[x]['name'])
+        self.app.get_project_model().delete_file(fileId)
         for item in self.source:
             if item['id'] == fileId:
                 self.source.remove(item)
         self.fill_table()
 
     def fill_table(self):
-        """ Reload the file data and Fill the table widget with file data. """
+        """ Reload the file data and attribute values into the table model. """
 
         self.load_file_data()
-        self.ui.tableWidget.setColumnCount(len(self.headerLabels))
-        self.ui.tableWidget.setHorizontalHeaderLabels(self.headerLabels)
-        self.ui.tableWidget.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
-
-        rows = self.ui.tableWidget.rowCount()
-        for r in range(0, rows):
-            self.ui.tableWidget.removeRow(0)
-
-        for row, data in enumerate(self.source):
-            self.ui.tableWidget.insertRow(row)
-            name_item = QtWidgets.QTableWidgetItem(data['name'])
-            #name_item.setFlags(name_item.flags() ^ QtCore.Qt.ItemIsEditable)
-            self.ui.tableWidget.setItem(row, self.NAME_COLUMN, name_item)
-            date_item = QtWidgets.QTableWidgetItem(data['date'])
-            date_item.setFlags(date_item.flags() ^ QtCore.Qt.ItemIsEditable)
-            self.ui.tableWidget.setItem(row, self.DATE_COLUMN, date_item)
-            memoitem = data['memo']
-            if memoitem != None and memoitem != "":
-                self.ui.tableWidget.setItem(row, self.MEMO_COLUMN, QtWidgets.QTableWidgetItem("Yes"))
-            fid = data['id']
-            if fid is None:
-                fid = ""
-            iditem = QtWidgets.QTableWidgetItem(str(fid))
-            iditem.setFlags(iditem.flags() ^ QtCore.Qt.ItemIsEditable)
-            self.ui.tableWidget.setItem(row, self.ID_COLUMN, iditem)
-            # add the attribute values
-            for a in self.attributes:
-                for col, header in enumerate(self.headerLabels):
-                    #print(fid, a[2], a[0], header)
-                    #print(type(fid), type(a[2]), type(a[0]), type(header))
-                    if fid == a[2] and a[0] == header:
-                        #print("found", a)
-                        self.ui.tableWidget.setItem(row, col, QtWidgets.QTableWidgetItem(str(a[1])))
-        self.ui.tableWidget.resizeColumnsToContents()
-        self.ui.tableWidget.resizeRowsToContents()
-        self.ui.tableWidget.hideColumn(self.ID_COLUMN)
-        if self.app.settings['showids'] == 'True':
-            self.ui.tableWidget.showColumn(self.ID_COLUMN)
-        self.ui.tableWidget.verticalHeader().setVisible(False)
+        self.table_model.set_data(self.source, self.attributes, self.headerLabels)
+        self.ui.tableView.resizeColumnsToContents()
+        self.ui.tableView.setColumnHidden(self.ID_COLUMN, self.app.settings['showids'] != 'True')
 
 
 if __name__ == "__main__":
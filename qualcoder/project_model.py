@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+from collections import namedtuple
+from copy import copy
+import logging
+
+from PyQt5 import QtCore
+
+logger = logging.getLogger(__name__)
+
+# Change kinds, the data is a dictionary of the changed values
+CODE_ADDED = 'code added'  # code dictionary
+CODE_RENAMED = 'code renamed'  # cid, name
+CODE_RECOLOURED = 'code recoloured'  # cid, color
+CODE_MOVED = 'code moved'  # cid, catid
+CODE_MEMO = 'code memo'  # cid, memo
+CODE_MERGED = 'code merged'  # cid, new_cid. The codings of cid now have new_cid
+CODE_DELETED = 'code deleted'  # cid
+CATEGORY_ADDED = 'category added'  # category dictionary
+CATEGORY_RENAMED = 'category renamed'  # catid, name
+CATEGORY_MOVED = 'category moved'  # catid, supercatid
+CATEGORY_MEMO = 'category memo'  # catid, memo
+CATEGORY_DELETED = 'category deleted'  # catid. Sub-categories and codes move to the top level
+FILE_ADDED = 'file added'  # file dictionary
+FILE_RENAMED = 'file renamed'  # id, name
+FILE_DELETED = 'file deleted'  # id
+RELOADED = 'reloaded'  # empty, everything may have changed
+
+ProjectChange = namedtuple('ProjectChange', ['kind', 'data'])
+FILE_KEYS = ('id', 'name', 'mediapath', 'memo', 'owner', 'date')
+
+
+class ProjectModel(QtCore.QObject):
+    """ Codes, categories and source file details for the open project, loaded once.
+    Dialogs get copies of the data from here instead of querying the database.
+    Code that changes codes, categories or files in the database then tells the model,
+    which updates its data and emits a ProjectChange through the changed signal.
+    Open dialogs connect to changed and apply the change to their own data and widgets.
+    Source file texts are not kept here. """
+
+    changed = QtCore.pyqtSignal(object)
+
+    def __init__(self, conn):
+
+        super(ProjectModel, self).__init__()
+        self.conn = conn
+        self.codes = {}
+        self.categories = {}
+        self.files = {}
+        self.load()
+
+    def load(self):
+        """ Load codes, categories and source file details from the database. """
+
+        cur = self.conn.cursor()
+        self.categories = {}
+        cur.execute("select name, catid, owner, date, memo, supercatid from code_cat")
+        for row in cur.fetchall():
+            self.categories[row[1]] = {'name': row[0], 'catid': row[1], 'owner': row[2],
+            'date': row[3], 'memo': row[4], 'supercatid': row[5]}
+        self.codes = {}
+        cur.execute("select name, memo, owner, date, cid, catid, color from code_name")
+        for row in cur.fetchall():
+            self.codes[row[4]] = {'name': row[0], 'memo': row[1], 'owner': row[2], 'date': row[3],
+            'cid': row[4], 'catid': row[5], 'color': row[6]}
+        self.files = {}
+        cur.execute("select id, name, mediapath, memo, owner, date from source")
+        for row in cur.fetchall():
+            self.files[row[0]] = {'id': row[0], 'name': row[1], 'mediapath': row[2],
+            'memo': row[3], 'owner': row[4], 'date': row[5]}
+
+    def reload(self):
+        """ Reload everything, after changes made outside the model, e.g. codebook import. """
+
+        self.load()
+        self._emit(RELOADED, {})
+
+    def get_data(self):
+        """ Copies of the codes and the categories sorted by name, as App.get_data.
+        return: code_names, categories - lists of dictionaries """
+
+        code_names = [copy(c) for c in self.codes.values()]
+        categories = sorted((copy(c) for c in self.categories.values()), key=lambda c: c['name'])
+        return code_names, categories
+
+    def get_files(self, text_only=False):
+        """ Copies of the source file details, in id order.
+        param: text_only - only files without a mediapath """
+
+        files = []
+        for fid in sorted(self.files):
+            if text_only and self.files[fid]['mediapath'] is not None:
+                continue
+            files.append(copy(self.files[fid]))
+        return files
+
+    def _emit(self, kind, data):
+        self.changed.emit(ProjectChange(kind, data))
+
+    def _update(self, items, key, kind, values):
+        item = items.get(values[key])
+        if item is None:
+            logger.debug("Project model has no " + key + ": " + str(values[key]))
+            return
+        item.update(values)
+        self._emit(kind, values)
+
+    def add_code(self, code):
+        self.codes[code['cid']] = copy(code)
+        self._emit(CODE_ADDED, copy(code))
+
+    def rename_code(self, cid, name):
+        self._update(self.codes, 'cid', CODE_RENAMED, {'cid': cid, 'name': name})
+
+    def recolour_code(self, cid, color):
+        self._update(self.codes, 'cid', CODE_RECOLOURED, {'cid': cid, 'color': color})
+
+    def move_code(self, cid, catid):
+        self._update(self.codes, 'cid', CODE_MOVED, {'cid': cid, 'catid': catid})
+
+    def set_code_memo(self, cid, memo):
+        self._update(self.codes, 'cid', CODE_MEMO, {'cid': cid, 'memo': memo})
+
+    def merge_codes(self, cid, new_cid):
+        self.codes.pop(cid, None)
+        self._emit(CODE_MERGED, {'cid': cid, 'new_cid': new_cid})
+
+    def delete_code(self, cid):
+        self.codes.pop(cid, None)
+        self._emit(CODE_DELETED, {'cid': cid})
+
+    def add_category(self, category):
+        self.categories[category['catid']] = copy(category)
+        self._emit(CATEGORY_ADDED, copy(category))
+
+    def rename_category(self, catid, name):
+        self._update(self.categories, 'catid', CATEGORY_RENAMED, {'catid': catid, 'name': name})
+
+    def move_category(self, catid, supercatid):
+        self._update(self.categories, 'catid', CATEGORY_MOVED, {'catid': catid, 'supercatid': supercatid})
+
+    def set_category_memo(self, catid, memo):
+        self._update(self.categories, 'catid', CATEGORY_MEMO, {'catid': catid, 'memo': memo})
+
+    def delete_category(self, catid):
+        self.categories.pop(catid, None)
+        for c in self.categories.values():
+            if c['supercatid'] == catid:
+                c['supercatid'] = None
+        for c in self.codes.values():
+            if c['catid'] == catid:
+                c['catid'] = None
+        self._emit(CATEGORY_DELETED, {'catid': catid})
+
+    def add_file(self, file_):
+        """ Add a source file. Only the file details are kept, not the fulltext. """
+
+        details = dict((key, file_.get(key)) for key in FILE_KEYS)
+        self.files[details['id']] = details
+        self._emit(FILE_ADDED, copy(details))
+
+    def rename_file(self, fid, name):
+        self._update(self.files, 'id', FILE_RENAMED, {'id': fid, 'name': name})
+
+    def delete_file(self, fid):
+        self.files.pop(fid, None)
+        self._emit(FILE_DELETED, {'id': fid})
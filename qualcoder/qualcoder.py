@@ -31,6 +31,7 @@ import configparser
 import datetime
 import gettext
 import logging
+import multiprocessing
 import os
 import re
 import shutil
@@ -46,11 +47,14 @@ from codebook import Codebook
 from code_text import DialogCodeText
 from dialog_sql import DialogSQL
 from GUI.ui_main import Ui_MainWindow
+from image_cache import ImageCache
+from import_documents import file_hash
 from import_survey import DialogImportSurvey
 from information import DialogInformation
 from journals import DialogJournals
 from manage_files import DialogManageFiles
 from memo import DialogMemo
+from project_model import ProjectModel
 from refi import Refi_export, Refi_import
 from reports import DialogReportCodes, DialogReportCoderComparisons, DialogReportCodeFrequencies
 from rqda import Rqda_import
@@ -79,6 +83,38 @@ logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s.%(funcName)s %(me
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# v2 added the avid column to code_text, v3 added the indexes below, v4 added source_fts,
+# v5 added source_page, v6 added source.hash
+DATABASE_VERSION = 'v6'
+DATABASE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS code_text_fid_owner ON code_text (fid, owner);",
+    "CREATE INDEX IF NOT EXISTS code_text_cid ON code_text (cid);",
+    "CREATE INDEX IF NOT EXISTS case_text_fid_pos0 ON case_text (fid, pos0);",
+    "CREATE INDEX IF NOT EXISTS annotation_fid ON annotation (fid);",
+    "CREATE INDEX IF NOT EXISTS attribute_id_attr_type ON attribute (id, attr_type);",
+    "CREATE INDEX IF NOT EXISTS code_image_id ON code_image (id);",
+    "CREATE INDEX IF NOT EXISTS code_av_id ON code_av (id);",
+]
+# Full text index of source.fulltext, kept in sync by triggers. The trigram tokenizer
+# matches substrings of three or more characters. Needs SQLite 3.34 with FTS5, checked on
+# opening a project by App.check_source_fts.
+SOURCE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS source_fts USING fts5(fulltext, content='source', content_rowid='id', tokenize='trigram');",
+    "CREATE TRIGGER IF NOT EXISTS source_fts_insert AFTER INSERT ON source BEGIN \
+        INSERT INTO source_fts(rowid, fulltext) VALUES (new.id, new.fulltext); END;",
+    "CREATE TRIGGER IF NOT EXISTS source_fts_delete AFTER DELETE ON source BEGIN \
+        INSERT INTO source_fts(source_fts, rowid, fulltext) VALUES ('delete', old.id, old.fulltext); END;",
+    "CREATE TRIGGER IF NOT EXISTS source_fts_update AFTER UPDATE OF fulltext ON source BEGIN \
+        INSERT INTO source_fts(source_fts, rowid, fulltext) VALUES ('delete', old.id, old.fulltext); \
+        INSERT INTO source_fts(rowid, fulltext) VALUES (new.id, new.fulltext); END;",
+    "INSERT INTO source_fts(source_fts) VALUES ('rebuild');",
+]
+# Character offsets of each page in the text of imported PDFs
+SOURCE_PAGE = "CREATE TABLE IF NOT EXISTS source_page (fid integer, page integer, pos0 integer, pos1 integer, \
+    primary key (fid, page));"
+# Hash of the bytes of each source file, to find files with the same content
+SOURCE_HASH_INDEX = "CREATE INDEX IF NOT EXISTS source_hash ON source (hash);"
+
 
 def exception_handler(exception_type, value, tb_obj):
     """ Global exception handler useful in GUIs.
@@ -96,12 +132,16 @@ class App(object):
     """
 
     conn = None
+    project_model = None
+    image_cache = None
     project_path = ""
     project_name = ""
 
     def __init__(self):
         sys.excepthook = exception_handler
         self.conn = None
+        self.project_model = None
+        self.image_cache = None
         self.project_path = ""
         self.project_name = ""
         self.confighome = os.path.expanduser('~/.qualcoder')
@@ -147,36 +187,73 @@ class App(object):
         self.project_path = project_path
         self.project_name = project_path.split('/')[-1]
         self.conn = sqlite3.connect(os.path.join(project_path, 'data.qda'))
+        self.apply_connection_profile()
+        self.project_model = None
+
+    def apply_connection_profile(self):
+        """ Set the SQLite pragmas from the db_ settings in config.ini.
+        WAL journal mode with synchronous NORMAL only syncs to disk on checkpoints, rather
+        than on every commit. WAL needs shared memory, so for projects on network drives
+        set db_journal_mode to DELETE. Invalid values are logged and skipped. """
+
+        pragmas = [
+            ('journal_mode', 'db_journal_mode', ['DELETE', 'TRUNCATE', 'PERSIST', 'WAL']),
+            ('synchronous', 'db_synchronous', ['OFF', 'NORMAL', 'FULL']),
+            ('cache_size', 'db_cache_size', int),
+            ('mmap_size', 'db_mmap_size', int),
+            ('temp_store', 'db_temp_store', ['DEFAULT', 'FILE', 'MEMORY']),
+        ]
+        cur = self.conn.cursor()
+        for pragma, key, allowed in pragmas:
+            value = self.settings.get(key, self.default_settings[key])
+            try:
+                if allowed is int:
+                    value = int(value)
+                else:
+                    value = str(value).upper()
+                    if value not in allowed:
+                        raise ValueError(value)
+                cur.execute("PRAGMA " + pragma + "=" + str(value))
+            except (ValueError, sqlite3.Error) as e:
+                logger.warning("Cannot set PRAGMA " + pragma + ": " + str(e))
+
+    def checkpoint(self):
+        """ Copy WAL journal changes into the database file and truncate the journal.
+        Does nothing if the journal mode is not WAL. """
+
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.warning("WAL checkpoint: " + str(e))
+
+    def get_project_model(self):
+        """ The codes, categories and file details of the open project, loaded once on
+        first use. Dialogs connect to project_model.changed for updates. """
+
+        if self.project_model is None:
+            self.project_model = ProjectModel(self.conn)
+        return self.project_model
+
+    def get_image_cache(self):
+        """ Cache of decoded images, image areas and thumbnails, made on first use. The
+        cache files are in .qualcoder/image_cache, and shared by all projects. """
+
+        if self.image_cache is None:
+            self.image_cache = ImageCache(os.path.join(self.confighome, 'image_cache'))
+        return self.image_cache
 
     def get_code_names(self):
-        cur = self.conn.cursor()
-        cur.execute("select name, memo, owner, date, cid, catid, color from code_name")
-        result = cur.fetchall()
-        res = []
-        for row in result:
-            res.append({'name': row[0], 'memo': row[1], 'owner': row[2], 'date': row[3],
-            'cid': row[4], 'catid': row[5], 'color': row[6]})
-        return res
+        return self.get_project_model().get_data()[0]
 
     def get_filenames(self):
         """ Get all filenames. """
-        cur = self.conn.cursor()
-        cur.execute("select id, name from source")
-        result = cur.fetchall()
-        res = []
-        for row in result:
-            res.append({'id': row[0], 'name': row[1]})
-        return res
+
+        return [{'id': f['id'], 'name': f['name']} for f in self.get_project_model().get_files()]
 
     def get_text_filenames(self):
         """ Get filenames of textfiles only. """
-        cur = self.conn.cursor()
-        cur.execute("select id, name from source where mediapath is Null")
-        result = cur.fetchall()
-        res = []
-        for row in result:
-            res.append({'id': row[0], 'name': row[1]})
-        return res
+
+        return [{'id': f['id'], 'name': f['name']} for f in self.get_project_model().get_files(True)]
 
     def get_annotations(self):
         """ Get annotations for text files. """
@@ -206,23 +283,9 @@ class App(object):
 
     def get_data(self):
         """ Called from init and gets all the codes and categories.
-        Called from ? """
+        Copies from the project model, so the lists can be changed by the caller. """
 
-        categories = []
-        cur = self.conn.cursor()
-        cur.execute("select name, catid, owner, date, memo, supercatid from code_cat order by name")
-        result = cur.fetchall()
-        for row in result:
-            categories.append({'name': row[0], 'catid': row[1], 'owner': row[2],
-            'date': row[3], 'memo': row[4], 'supercatid': row[5]})
-        code_names = []
-        cur = self.conn.cursor()
-        cur.execute("select name, memo, owner, date, cid, catid, color from code_name")
-        result = cur.fetchall()
-        for row in result:
-            code_names.append({'name': row[0], 'memo': row[1], 'owner': row[2], 'date': row[3],
-            'cid': row[4], 'catid': row[5], 'color': row[6]})
-        return code_names, categories
+        return self.get_project_model().get_data()
 
     def write_config_ini(self, settings):
         config = configparser.ConfigParser()
@@ -278,22 +341,38 @@ class App(object):
             'language': 'en',
             'backup_on_open': True,
             'backup_av_files': True,
+            'db_journal_mode': 'WAL',
+            'db_synchronous': 'NORMAL',
+            'db_cache_size': -32000,  # negative is KiB, so 32MB
+            'db_mmap_size': 268435456,
+            'db_temp_store': 'MEMORY',
         }
 
     def get_file_texts(self, fileids=None):
         """ Get the texts of all text files as a list of dictionaries.
+        Ids are fetched in batches, below the SQLite limit on query parameters.
         param: fileids - a list of fileids or None """
 
         cur = self.conn.cursor()
-        if fileids is not None:
-            cur.execute(
-                "select name, id, fulltext, memo, owner, date from source where id in (?) and fulltext is not null",
-                fileids
-            )
-        else:
+        if fileids is None:
             cur.execute("select name, id, fulltext, memo, owner, date from source where fulltext is not null order by name")
+            return self.file_text_dictionaries(cur.fetchall())
+        fileids = list(fileids)
+        rows = []
+        for i in range(0, len(fileids), 500):
+            batch = fileids[i:i + 500]
+            cur.execute("select name, id, fulltext, memo, owner, date from source where id in ("
+                + ",".join("?" * len(batch)) + ") and fulltext is not null", batch)
+            rows += cur.fetchall()
+        rows.sort(key=lambda row: row[0])
+        return self.file_text_dictionaries(rows)
+
+    @staticmethod
+    def file_text_dictionaries(rows):
+        """ Convert name, id, fulltext, memo, owner, date rows to dictionaries. """
+
         res = []
-        for row in cur.fetchall():
+        for row in rows:
             res.append({
             'name': row[0],
             'id': row[1],
@@ -304,6 +383,110 @@ class App(object):
         })
         return res
 
+    def create_source_fts(self):
+        """ Create the source_fts full text index and its triggers, and index all files.
+        If this SQLite does not have FTS5 or the trigram tokenizer, searches do not use
+        the index.
+        return: True if created """
+
+        cur = self.conn.cursor()
+        try:
+            for sql in SOURCE_FTS:
+                cur.execute(sql)
+        except sqlite3.OperationalError as e:
+            logger.warning("Full text index not created: " + str(e))
+            self.conn.rollback()
+            return False
+        self.conn.commit()
+        return True
+
+    def check_source_fts(self):
+        """ Check the source_fts index can be used by this SQLite, on opening a project.
+        The triggers are stored in the project, so a project made with a SQLite that has
+        FTS5 and the trigram tokenizer could not insert, change or delete files with one
+        that does not. Then the triggers are dropped, and the table too where possible.
+        When the index can be used again and has no triggers it is rebuilt. """
+
+        cur = self.conn.cursor()
+        cur.execute("select name from sqlite_master where type='table' and name='source_fts'")
+        if cur.fetchone() is None:
+            self.create_source_fts()
+            return
+        try:
+            cur.execute("select rowid from source_fts limit 1")
+            cur.fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Full text index cannot be used: " + str(e))
+            for trigger in ('source_fts_insert', 'source_fts_delete', 'source_fts_update'):
+                cur.execute("DROP TRIGGER IF EXISTS " + trigger)
+            self.conn.commit()
+            try:
+                # needs the module and tokenizer, otherwise the table is left unused
+                cur.execute("DROP TABLE source_fts")
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logger.debug("Full text index not dropped: " + str(e))
+                self.conn.rollback()
+            return
+        cur.execute("select count(*) from sqlite_master where type='trigger' and name like 'source_fts_%'")
+        if cur.fetchone()[0] < 3:
+            self.create_source_fts()
+
+    def update_source_hashes(self):
+        """ Store the hash of each source that does not have one, e.g. after a database
+        upgrade or a project import. The hash is of the media file or the copy of the
+        imported document, as when the file is imported. Text created in QualCoder, or
+        without its document copy, has no hash, so is never found as the same content.
+        """
+
+        cur = self.conn.cursor()
+        cur.execute("select id, name, mediapath from source where hash is null")
+        hashes = []
+        for id_, name, mediapath in cur.fetchall():
+            path = self.project_path + "/documents/" + name
+            if mediapath is not None:
+                path = mediapath
+                if mediapath[0] == "/":
+                    path = self.project_path + mediapath
+            if os.path.isfile(path):
+                try:
+                    hashes.append((file_hash(path), id_))
+                except OSError as e:
+                    logger.warning("Cannot hash " + path + ": " + str(e))
+        cur.executemany("update source set hash=? where id=?", hashes)
+        self.conn.commit()
+
+    def get_source_pages(self, fid):
+        """ Get the page character offsets of an imported PDF, to find the page of a
+        text position.
+        return: list of dictionaries of page, pos0, pos1 in page order, empty for other files """
+
+        cur = self.conn.cursor()
+        cur.execute("select page, pos0, pos1 from source_page where fid=? order by page", [fid])
+        return [{'page': row[0], 'pos0': row[1], 'pos1': row[2]} for row in cur.fetchall()]
+
+    def get_file_texts_containing(self, text):
+        """ Use the source_fts index to get the text files that may contain this text.
+        Trigram matches are not case sensitive, so the files are a superset of the files
+        containing the text, and are searched again with the search pattern.
+        return: list of dictionaries as get_file_texts, or None if the index cannot be used
+        """
+
+        if len(text) < 3:
+            return None
+        cur = self.conn.cursor()
+        cur.execute("select name from sqlite_master where type='table' and name='source_fts'")
+        if cur.fetchone() is None:
+            return None
+        query = '"' + text.replace('"', '""') + '"'
+        try:
+            cur.execute("select name, id, fulltext, memo, owner, date from source where fulltext is not null \
+                and id in (select rowid from source_fts where source_fts match ?) order by name", [query])
+        except sqlite3.Error as e:
+            logger.debug("Full text index search: " + str(e))
+            return None
+        return self.file_text_dictionaries(cur.fetchall())
+
     def get_code_texts(self, text):
         cur = self.conn.cursor()
         codingsql = "select cid, fid, seltext, pos0, pos1, owner, date, memo from code_text where seltext like ?"
@@ -468,7 +651,9 @@ class MainWindow(QtWidgets.QMainWindow):
         msg += _("Show IDs") + ": " + str(self.app.settings['showids']) + "\n"
         msg += _("Language") + ": " + self.app.settings['language'] + "\n"
         msg += _("Backup on open") + ": " + str(self.app.settings['backup_on_open']) + "\n"
-        msg += _("Backup AV files") + ": " + str(self.app.settings['backup_av_files'])
+        msg += _("Backup AV files") + ": " + str(self.app.settings['backup_av_files']) + "\n"
+        msg += _("Database journal mode") + ": " + str(self.app.settings.get('db_journal_mode',
+            self.app.default_settings['db_journal_mode']))
         msg += "\n========"
         self.ui.textEdit.append(msg)
 
@@ -662,6 +847,7 @@ class MainWindow(QtWidgets.QMainWindow):
          """
 
         Refi_import(self.app, self.ui.textEdit, "qdc")
+        self.app.get_project_model().reload()
 
     def REFI_project_import(self):
         """ Import a qpdx QDA project into a new project space.
@@ -676,6 +862,8 @@ class MainWindow(QtWidgets.QMainWindow):
             return
 
         Refi_import(self.app, self.ui.textEdit, "qdpx")
+        self.app.update_source_hashes()
+        self.app.get_project_model().reload()
         msg = "EXPERIMENTAL - NOT FULLY TESTED\n"
         msg += "PDFs not imported\n"
         msg += "Audio, video, transcripts, transcript codings and synchpoints not tested.\n"
@@ -694,6 +882,8 @@ class MainWindow(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.warning(None, "Project creation", "Project not successfully created")
             return
         Rqda_import(self.app, self.ui.textEdit)
+        self.app.update_source_hashes()
+        self.app.get_project_model().reload()
 
     def closeEvent(self, event):
         """ Override the QWindow close event.
@@ -728,6 +918,8 @@ class MainWindow(QtWidgets.QMainWindow):
         usernames can be freely entered through the settings dialog and are collated from
         coded text, images and a/v.
         v2 had added column in code_text table to link to avid in code_av table.
+        v3 added indexes on the columns that dialogs select by.
+        v4 added the source_fts full text index for searching texts.
         """
 
         self.app = App()
@@ -755,7 +947,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.app.create_connection(self.app.project_path)
         cur = self.app.conn.cursor()
         cur.execute("CREATE TABLE project (databaseversion text, date text, memo text,about text);")
-        cur.execute("CREATE TABLE source (id integer primary key, name text, fulltext text, mediapath text, memo text, owner text, date text, unique(name));")
+        cur.execute("CREATE TABLE source (id integer primary key, name text, fulltext text, mediapath text, memo text, owner text, date text, hash text, unique(name));")
         cur.execute("CREATE TABLE code_image (imid integer primary key,id integer,x1 integer, y1 integer, width integer, height integer, cid integer, memo text, date text, owner text);")
         cur.execute("CREATE TABLE code_av (avid integer primary key,id integer,pos0 integer, pos1 integer, cid integer, memo text, date text, owner text);")
         cur.execute("CREATE TABLE annotation (anid integer primary key, fid integer,pos0 integer, pos1 integer, memo text, owner text, date text);")
@@ -767,8 +959,13 @@ class MainWindow(QtWidgets.QMainWindow):
         cur.execute("CREATE TABLE code_text (cid integer, fid integer,seltext text, pos0 integer, pos1 integer, owner text, date text, memo text, avid integer, unique(cid,fid,pos0,pos1, owner));")
         cur.execute("CREATE TABLE code_name (cid integer primary key, name text, memo text, catid integer, owner text,date text, color text, unique(name));")
         cur.execute("CREATE TABLE journal (jid integer primary key, name text, jentry text, date text, owner text);")
-        cur.execute("INSERT INTO project VALUES(?,?,?,?)", ('v2',datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),'','QualCoder'))
+        cur.execute(SOURCE_PAGE)
+        cur.execute(SOURCE_HASH_INDEX)
+        for sql in DATABASE_INDEXES:
+            cur.execute(sql)
+        cur.execute("INSERT INTO project VALUES(?,?,?,?)", (DATABASE_VERSION,datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),'','QualCoder'))
         self.app.conn.commit()
+        self.app.create_source_fts()
         try:
             # get and display some project details
             self.ui.textEdit.append("\n" + _("New project: ") + self.app.project_path + _(" created."))
@@ -864,14 +1061,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.project['memo'] = result[2]
         self.project['about'] = result[3]
 
-        # check avid column in code_text table
-        # database version < 2
-        try:
-            cur.execute("select avid from code_text")
-        except:
-            cur.execute("ALTER TABLE code_text ADD avid integer;")
-            self.app.conn.commit()
-
         # Save a datetime stamped backup
         if self.app.settings['backup_on_open'] == 'True':
             nowdate = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -882,6 +1071,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 shutil.copytree(self.app.project_path, backup, ignore=shutil.ignore_patterns('*.mp3','*.wav','*.mp4', '*.mov','*.ogg','*.wmv','*.MP3','*.WAV','*.MP4', '*.MOV','*.OGG','*.WMV'))
                 self.ui.textEdit.append(_("WARNING: audio and video files NOT backed up. See settings."))
             self.ui.textEdit.append(_("Project backup created: ") + backup)
+        self.app.check_source_fts()
+        self.upgrade_database()
 
         self.ui.textEdit.append(_("Project Opened: ") + self.app.project_name
             + "\n========\n"
@@ -893,16 +1084,54 @@ class MainWindow(QtWidgets.QMainWindow):
             + "\n========\n")
         self.show_menu_options()
 
+    def upgrade_database(self):
+        """ Upgrade an older project database to the current version, in version order.
+        Called on opening a project, after the backup is made. """
+
+        cur = self.app.conn.cursor()
+        try:
+            version = int(self.project['databaseversion'][1:])
+        except (TypeError, ValueError):
+            version = 1
+        # check avid column in code_text table
+        # database version < 2
+        try:
+            cur.execute("select avid from code_text")
+        except:
+            cur.execute("ALTER TABLE code_text ADD avid integer;")
+            self.app.conn.commit()
+        if version < 3:
+            for sql in DATABASE_INDEXES:
+                cur.execute(sql)
+            self.app.conn.commit()
+        # version < 4, source_fts is created by App.check_source_fts
+        if version < 5:
+            cur.execute(SOURCE_PAGE)
+            self.app.conn.commit()
+        if version < 6:
+            cur.execute("ALTER TABLE source ADD hash text;")
+            cur.execute(SOURCE_HASH_INDEX)
+            self.app.conn.commit()
+            self.app.update_source_hashes()
+        if version < int(DATABASE_VERSION[1:]):
+            cur.execute("update project set databaseversion=?", (DATABASE_VERSION,))
+            self.app.conn.commit()
+            self.project['databaseversion'] = DATABASE_VERSION
+            self.ui.textEdit.append(_("Project database upgraded to ") + DATABASE_VERSION)
+            logger.info("Database upgraded to " + DATABASE_VERSION)
+
     def close_project(self):
         """ Close an open project. """
 
         self.ui.textEdit.append("Closing project: " + self.app.project_name + "\n========\n")
         try:
             self.app.conn.commit()
+            self.app.checkpoint()
             self.app.conn.close()
         except:
             pass
         self.app.conn = None
+        self.app.project_model = None
         self.app.project_path = ""
         self.app.project_name = ""
         self.app.settings['directory'] = ""
@@ -977,4 +1206,5 @@ def gui():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # document import uses a process pool
     gui()
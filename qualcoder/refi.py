@@ -1017,7 +1017,7 @@ class Refi_export(QtWidgets.QDialog):
         for s in self.sources:
             #print(s['id'], s['name'], s['mediapath'], s['filename'], s['plaintext_filename'], s['external'])  # tmp
             destination = '/Sources/' + s['filename']
-            if s['mediapath'] is not None:
+            if s['mediapath'] is not None and s['copy']:
                     try:
                         if s['external'] is None:
                             shutil.copyfile(self.app.project_path + s['mediapath'],
@@ -1812,11 +1812,15 @@ class Refi_export(QtWidgets.QDialog):
 
         Files over the 2GiB-1 size must be stored externally, these will be located in the
         qualcoder settings directory.
+
+        Media sources with the same content hash share one exported file, which is copied
+        once. copy is False for the later sources.
         """
 
         self.sources = []
+        media_filenames = {}  # hash: exported filename
         cur = self.app.conn.cursor()
-        cur.execute("SELECT id, name, fulltext, mediapath, memo, owner, date FROM source")
+        cur.execute("SELECT id, name, fulltext, mediapath, memo, owner, date, hash FROM source")
         results = cur.fetchall()
         for r in results:
             guid = self.create_guid()
@@ -1836,7 +1840,13 @@ class Refi_export(QtWidgets.QDialog):
             source = {'id': r[0], 'name': r[1], 'fulltext': r[2], 'mediapath': r[3],
             'memo': r[4], 'owner': r[5], 'date': r[6], 'guid': guid,
             'filename': filename, 'plaintext_filename': plaintext_filename,
-            'external': None}
+            'external': None, 'copy': True}
+            if source['mediapath'] is not None and r[7] is not None:
+                if r[7] in media_filenames:
+                    source['filename'] = media_filenames[r[7]]
+                    source['copy'] = False
+                else:
+                    media_filenames[r[7]] = filename
             if source['mediapath'] is not None:
                 fileinfo = os.stat(self.app.project_path + source['mediapath'])
                 if fileinfo.st_size >= 2147483647:
@@ -118,10 +118,7 @@ class DialogSelectAttributeParameters(QtWidgets.QDialog):
                         not_numeric = True
             if not_numeric:
                 values = []
-            # add single quotes to character values
-            if type_ == "character":
-                for i in range (0, len(values)):
-                    values[i] = "'" + values[i] + "'"
+            # values are passed to the coding query as parameters, so are not quoted
             if values != []:
                 self.parameters.append([self.ui.tableWidget.item(x, self.NAME_COLUMN).text(),
                 self.ui.tableWidget.item(x, self.CASE_OR_FILE_COLUMN).text(),
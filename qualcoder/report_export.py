@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+'''
+Copyright (c) 2019 Colin Curtain
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+Author: Colin Curtain (ccbogel)
+https://github.com/ccbogel/QualCoder
+https://qualcoder.wordpress.com/
+'''
+
+import csv
+from html import escape
+from itertools import chain, zip_longest
+import logging
+import os
+import re
+from shutil import copyfile
+import tempfile
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Coding report exporters. They write the report from the result dictionaries of
+# coding_query.CodingQuery, one result at a time, with the av results having the 'text'
+# made by DialogReportCodes.av_text. Image results have the coded area in 'image'.
+# Each image is saved once, as it is written.
+
+MAX_IMAGE_SIZE = 300  # pixels, largest shown width or height of an image
+CM_PER_PIXEL = 2.54 / 96
+
+
+def image_name(result, counter):
+    """ Unique file name of a coded image in an export, e.g. 3-photo.png. """
+
+    return str(counter) + "-" + result['mediapath'].split('/')[-1]
+
+
+def image_scale(image):
+    """ Scale to show an image at most MAX_IMAGE_SIZE wide or high. """
+
+    scaler = 1.0
+    if image.width() > MAX_IMAGE_SIZE:
+        scaler = MAX_IMAGE_SIZE / image.width()
+    if image.height() > MAX_IMAGE_SIZE:
+        scaler = min(scaler, MAX_IMAGE_SIZE / image.height())
+    return scaler
+
+
+def csv_cell(kind, result):
+    """ Text of a result in a csv cell: the coded text or memo and the file or case name. """
+
+    if kind == 'text':
+        d = result['text'] + "\n" + result['file_or_casename']
+        # Add file id if results are based on attribute selection
+        if result['file_or_case'] == "":
+            d += " fid:" + str(result['fid'])
+        return d
+    d = result['memo']
+    if d == "":
+        d = "NO MEMO"
+    if kind == 'image':
+        d += "\n" + result['file_or_casename']
+        # Add filename if results are based on attribute selection
+        if result['file_or_case'] == "":
+            d += " " + result['mediapath'][8:]
+        return d
+    # av 'text' contains video/filename, time slot and memo, so trim some out
+    trimmed = result['text'][6:]
+    pos = trimmed.find(']')
+    trimmed = trimmed[:pos + 1]
+    # Add case name as well as file name and time slot
+    if result['file_or_case'] != "File":
+        trimmed = result['file_or_casename'] + " " + trimmed
+    return d + "\n" + trimmed
+
+
+def write_csv(filename, text_results, image_results, av_results):
+    """ Write coded data as csv with codes as column headings, in code name order.
+    Each column has the results of its code, the cells are made as each row is written.
+    """
+
+    columns = {}  # codename: list of (kind, result)
+    for kind, results in (('text', text_results), ('image', image_results), ('av', av_results)):
+        for result in results:
+            columns.setdefault(result['codename'], []).append((kind, result))
+    codes = sorted(columns)
+    with open(filename, 'w', encoding='utf-8', newline='') as csvfile:
+        filewriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        filewriter.writerow(codes)  # header row
+        for row in zip_longest(*[columns[code] for code in codes]):
+            filewriter.writerow(["" if cell is None else csv_cell(*cell) for cell in row])
+
+
+def html_heading(result):
+    """ Heading of a result, escaped, as DialogReportCodes.html_heading. """
+
+    return '<p><em><span style="background-color:' + escape(result['color'] or "") + '">' \
+        + escape(result['codename']) + '</span>, ' + escape(result['file_or_case']) + ': ' \
+        + escape(result['file_or_casename']) + ', ' + escape(result['coder']) + '</em><br />'
+
+
+def html_text(text):
+    """ Escape text. Line breaks, runs of spaces and tabs are kept by the pre-wrap style
+    of the paragraphs, as in the report text edit. """
+
+    return escape(text)
+
+
+def write_html(filename, header, text_results, image_results, av_results, project_path):
+    """ Write the report as html. Images and audio/video are put in a folder named as the
+    html file without .html, and linked from the html.
+    param: header - the search parameters text
+    return: the folder name """
+
+    folder = filename[:-5]
+    folder_link = folder.split('/')[-1]
+    os.mkdir(folder)
+    os.mkdir(folder + "/audio")
+    os.mkdir(folder + "/video")
+    copied = set()
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>'
+            + escape(os.path.basename(filename)) + '</title>\n<style>p { white-space: pre-wrap; }</style>\n</head>\n<body>\n')
+        f.write('<p>' + html_text(header) + '</p>\n')
+        for result in text_results:
+            f.write(html_heading(result) + html_text(result['text']) + '</p>\n')
+        for counter, result in enumerate(image_results):
+            name = image_name(result, counter)
+            image = result['image']
+            image.save(folder + "/" + name)
+            scaler = image_scale(image)
+            f.write(html_heading(result))
+            f.write('<img src="' + escape(folder_link + "/" + name) + '" width="'
+                + str(int(image.width() * scaler)) + '" height="' + str(int(image.height() * scaler)) + '" />')
+            if result['memo'] != "":
+                f.write('<br />' + html_text(_("Memo: ") + result['memo']))
+            f.write('</p>\n')
+        for result in av_results:
+            f.write(html_heading(result) + html_text(result['text']) + '</p>\n')
+            mediapath = result['mediapath']
+            if mediapath is None:
+                continue
+            if mediapath not in copied and not os.path.isfile(folder + mediapath):
+                try:
+                    copyfile(project_path + mediapath, folder + mediapath)
+                except OSError as e:
+                    logger.warning("html export media: " + str(e))
+            copied.add(mediapath)
+            mediatype = mediapath[1:6]
+            extension = mediapath[mediapath.rfind('.') + 1:]
+            f.write('<' + mediatype + ' controls><source src="' + escape(folder_link + mediapath)
+                + '#t=' + str(int(result['pos0'] / 1000)) + ',' + str(int(result['pos1'] / 1000))
+                + '" type="' + mediatype + '/' + escape(extension) + '"></' + mediatype + '>\n')
+        f.write('</body>\n</html>\n')
+    return folder
+
+
+ODT_MANIFEST_START = '<?xml version="1.0" encoding="UTF-8"?>\n\
+<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">\n\
+ <manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.text"/>\n\
+ <manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>\n'
+ODT_CONTENT_START = '<?xml version="1.0" encoding="UTF-8"?>\n\
+<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" \
+xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" \
+xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" \
+xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" \
+xmlns:xlink="http://www.w3.org/1999/xlink" \
+xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" \
+xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" office:version="1.2">\n'
+
+
+def odt_spaces(match):
+    """ A run of spaces as ODF space elements, as consecutive spaces and spaces at the
+    start of a line are otherwise collapsed. """
+
+    start = match.start()
+    count = len(match.group(0))
+    if start == 0 or match.string[start - 1] in "\n\t":
+        return '<text:s text:c="' + str(count) + '"/>'
+    if count == 1:
+        return " "
+    return ' <text:s text:c="' + str(count - 1) + '"/>'
+
+
+def odt_text(text):
+    """ Escape text for a text:p element, keeping line breaks, tabs and runs of spaces,
+    e.g. the alignment of transcript time stamps and speakers. """
+
+    text = re.sub(" +", odt_spaces, escape(text, False))
+    return text.replace("\n", "<text:line-break/>").replace("\t", "<text:tab/>")
+
+
+def write_odt(filename, header, text_results, image_results, av_results):
+    """ Write the report as an Open Document Text file.
+    The document body is written to a temporary file as the results are read, and each
+    image is added to the zip as it is reached. The code colours are automatic styles,
+    which have to come before the body, so they are written from the set of colours. """
+
+    colors = sorted(set(r['color'] or "" for r in chain(text_results, image_results, av_results)))
+    styles = dict((color, "C" + str(i)) for i, color in enumerate(colors))
+    pictures = []
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as odt, \
+            tempfile.TemporaryDirectory() as tmp:
+        # mimetype must be first and not compressed
+        odt.writestr(zipfile.ZipInfo('mimetype'), 'application/vnd.oasis.opendocument.text')
+        content_path = os.path.join(tmp, 'content.xml')
+        with open(content_path, 'w', encoding='utf-8') as f:
+            f.write(ODT_CONTENT_START + '<office:automatic-styles>\n')
+            f.write('<style:style style:name="Heading" style:family="text"><style:text-properties '
+                'fo:font-style="italic"/></style:style>\n')
+            for color, style in styles.items():
+                f.write('<style:style style:name="' + style + '" style:family="text"><style:text-properties '
+                    'fo:font-style="italic" fo:background-color="' + escape(color) + '"/></style:style>\n')
+            f.write('</office:automatic-styles>\n<office:body>\n<office:text>\n')
+            f.write('<text:p>' + odt_text(header) + '</text:p>\n')
+
+            def heading(result):
+                return '<text:p><text:span text:style-name="' + styles[result['color'] or ""] + '">' \
+                    + odt_text(result['codename']) + '</text:span><text:span text:style-name="Heading">, ' \
+                    + odt_text(result['file_or_case'] + ": " + result['file_or_casename'] + ", "
+                    + result['coder']) + '</text:span></text:p>\n'
+
+            for result in text_results:
+                f.write(heading(result) + '<text:p>' + odt_text(result['text']) + '</text:p>\n')
+            image_path = os.path.join(tmp, 'image.png')
+            for counter, result in enumerate(image_results):
+                image = result['image']
+                name = 'Pictures/' + str(counter) + '.png'
+                image.save(image_path, 'PNG')
+                odt.write(image_path, name)
+                pictures.append(name)
+                scaler = image_scale(image)
+                f.write(heading(result) + '<text:p><draw:frame draw:name="image' + str(counter)
+                    + '" text:anchor-type="as-char" svg:width="'
+                    + str(round(image.width() * scaler * CM_PER_PIXEL, 3)) + 'cm" svg:height="'
+                    + str(round(image.height() * scaler * CM_PER_PIXEL, 3)) + 'cm"><draw:image xlink:href="'
+                    + name + '" xlink:type="simple" xlink:show="embed" xlink:actuate="onLoad"/>'
+                    + '</draw:frame></text:p>\n')
+                if result['memo'] != "":
+                    f.write('<text:p>' + odt_text(_("Memo: ") + result['memo']) + '</text:p>\n')
+            for result in av_results:
+                f.write(heading(result) + '<text:p>' + odt_text(result['text']) + '</text:p>\n')
+            f.write('</office:text>\n</office:body>\n</office:document-content>\n')
+        odt.write(content_path, 'content.xml')
+        manifest = ODT_MANIFEST_START
+        for name in pictures:
+            manifest += ' <manifest:file-entry manifest:full-path="' + name + '" manifest:media-type="image/png"/>\n'
+        manifest += '</manifest:manifest>\n'
+        odt.writestr('META-INF/manifest.xml', manifest)
@@ -31,14 +31,15 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QBrush
 import os
 import sys
-from copy import copy
 import logging
 import traceback
 
 try:
+    from code_tree import fill_code_tree
     from select_file import DialogSelectFile
     from GUI.ui_dialog_text_mining import Ui_Dialog_text_mining
 except:
+    from .code_tree import fill_code_tree
     from .select_file import DialogSelectFile
     from .GUI.ui_dialog_text_mining import Ui_Dialog_text_mining
 
@@ -187,81 +188,33 @@ class DialogTextMining(QtWidgets.QDialog):
     def fill_tree(self):
         ''' Fill tree widget, top level items are main categories and unlinked codes '''
 
-        cats = copy(self.categories)
-        codes = copy(self.code_names)
         self.ui.treeWidget.clear()
         self.ui.treeWidget.setColumnCount(2)
         self.ui.treeWidget.setHeaderLabels(["Name", "Id"])
         self.ui.treeWidget.header().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
         self.ui.treeWidget.header().setStretchLastSection(False)
-        # add top level categories
-        remove_list = []
-        for c in cats:
-            if c['supercatid'] is None:
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid'])])
-                top_item.setIcon(0, QtGui.QIcon("GUI/icon_cat.png"))
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_list.append(c)
-        for item in remove_list:
-            #try:
-            cats.remove(item)
-            #except Exception as e:
-            #    print(e, item)
-
-        ''' Add child categories. Look at each unmatched category, iterate through tree
-        to add as child then remove matched categories from the list. '''
-        count = 0
-        while len(cats) > 0 or count < 10000:
-            remove_list = []
-            #logger.debug("cats:" + str(cats))
-            for c in cats:
-                it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-                item = it.value()
-                while item:  # while there is an item in the list
-                    #logger.debug("While: " +  item.text(0) + "|"+ item.text(1) + ", c[catid]:" + str(c['catid']) + ", c[supercatid]:" + str(c['supercatid']))
-                    if item.text(1) == 'catid:' + str(c['supercatid']):
-                        child = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid'])])
-                        child.setIcon(0, QtGui.QIcon("GUI/icon_cat.png"))
-                        item.addChild(child)
-                        #logger.debug("Adding: " + c['name'])
-                        remove_list.append(c)
-                    it += 1
-                    item = it.value()
-            for item in remove_list:
-                cats.remove(item)
-            count += 1
-
-        # add unlinked codes as top level items
-        remove_items = []
-        for c in codes:
-            if c['catid'] is None:
-                #logger.debug("add unlinked code as top level item:" + c['name'])
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid'])])
-                top_item.setIcon(0, QtGui.QIcon("GUI/icon_code.png"))
-                top_item.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                top_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_items.append(c)
-        for item in remove_items:
-            codes.remove(item)
-
-        # add codes as children
-        for c in codes:
-            it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-            item = it.value()
-            while item:
-                #logger.debug("" + item.text(0) + "|" + item.text(1) + ", c[cid]:" + str(c['cid']) + "c[catid]:" + str(c['catid']))
-                if item.text(1) == 'catid:' + str(c['catid']):
-                    child = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid'])])
-                    child.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                    child.setIcon(0, QtGui.QIcon("GUI/icon_code.png"))
-                    child.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-                    item.addChild(child)
-                    c['catid'] = -1  # make unmatchable
-                it += 1
-                item = it.value()
+        fill_code_tree(self.ui.treeWidget, self.categories, self.code_names,
+            self.category_item, self.code_item)
         self.ui.treeWidget.expandAll()
 
+    @staticmethod
+    def category_item(c):
+        ''' Tree item for a category: name and catid '''
+
+        item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid'])])
+        item.setIcon(0, QtGui.QIcon("GUI/icon_cat.png"))
+        return item
+
+    @staticmethod
+    def code_item(c):
+        ''' Tree item for a code: name and cid, with code color '''
+
+        item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid'])])
+        item.setIcon(0, QtGui.QIcon("GUI/icon_code.png"))
+        item.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
+        item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
+        return item
+
     def export_selected_file(self):
         ''' Export selected text to a plain text file, filename will have .txt ending '''
 
@@ -26,7 +26,6 @@ https://github.com/ccbogel/QualCoder
 https://qualcoder.wordpress.com/
 '''
 
-from copy import deepcopy
 import datetime
 import logging
 import os
@@ -57,10 +56,12 @@ except Exception as e:
 from add_item_name import DialogAddItemName
 from color_selector import DialogColorSelect
 from color_selector import colors
+from code_tree import fill_code_tree, update_code_tree
 from confirm_delete import DialogConfirmDelete
 from GUI.ui_dialog_code_av import Ui_Dialog_code_av
 from GUI.ui_dialog_view_av import Ui_Dialog_view_av
 from memo import DialogMemo
+from project_model import CODE_DELETED, CODE_MERGED, CODE_RECOLOURED, CODE_RENAMED, RELOADED
 from select_file import DialogSelectFile
 
 path = os.path.abspath(os.path.dirname(__file__))
@@ -153,6 +154,7 @@ class DialogCodeAV(QtWidgets.QDialog):
         QtWidgets.QDialog.__init__(self)
         self.ui = Ui_Dialog_code_av()
         self.ui.setupUi(self)
+        self.app.get_project_model().changed.connect(self.project_changed)
         self.ui.splitter.setSizes([100, 200])
         # until any media is selected disable some widgets
         self.ui.pushButton_play.setEnabled(False)
@@ -238,10 +240,8 @@ class DialogCodeAV(QtWidgets.QDialog):
         self.codes, self.categories = self.app.get_data()
 
     def fill_tree(self):
-        """ Fill tree widget, tope level items are main categories and unlinked codes. """
+        """ Fill tree widget, top level items are main categories and unlinked codes. """
 
-        cats = deepcopy(self.categories)
-        codes = deepcopy(self.codes)
         self.ui.treeWidget.clear()
         self.ui.treeWidget.setColumnCount(3)
         self.ui.treeWidget.setHeaderLabels([_("Name"), _("Id"), _("Memo")])
@@ -249,80 +249,7 @@ class DialogCodeAV(QtWidgets.QDialog):
             self.ui.treeWidget.setColumnHidden(1, True)
         self.ui.treeWidget.header().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
         self.ui.treeWidget.header().setStretchLastSection(False)
-        # add top level categories
-        remove_list = []
-        for c in cats:
-            if c['supercatid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = "Memo"
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                top_item.setToolTip(0, c['owner'] + "\n" + c['date'])
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_list.append(c)
-        for item in remove_list:
-            #try:
-            cats.remove(item)
-            #except Exception as e:
-            #    print(e, item)
-
-        ''' Add child categories. Look at each unmatched category, iterate through tree
-        to add as child, then remove matched categories from the list. '''
-        count = 0
-        while len(cats) > 0 or count < 10000:
-            remove_list = []
-            #logger.debug("cats:" + str(cats))
-            for c in cats:
-                it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-                item = it.value()
-                while item:  # while there is an item in the list
-                    if item.text(1) == 'catid:' + str(c['supercatid']):
-                        memo = ""
-                        if c['memo'] != "":
-                            memo = "Memo"
-                        child = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                        child.setToolTip(0, c['owner'] + "\n" + c['date'])
-                        item.addChild(child)
-                        remove_list.append(c)
-                    it += 1
-                    item = it.value()
-            for item in remove_list:
-                cats.remove(item)
-            count += 1
-
-        # add unlinked codes as top level items
-        remove_items = []
-        for c in codes:
-            if c['catid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = "Memo"
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
-                top_item.setToolTip(0, c['owner'] + "\n" + c['date'])
-                top_item.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                top_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_items.append(c)
-        for item in remove_items:
-            codes.remove(item)
-
-        # add codes as children
-        for c in codes:
-            it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-            item = it.value()
-            while item:
-                if item.text(1) == 'catid:' + str(c['catid']):
-                    memo = ""
-                    if c['memo'] != "":
-                        memo = _("Memo")
-                    child = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
-                    child.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                    child.setToolTip(0, c['owner'] + "\n" + c['date'])
-                    child.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-                    item.addChild(child)
-                    c['catid'] = -1  # make unmatchable
-                it += 1
-                item = it.value()
+        fill_code_tree(self.ui.treeWidget, self.categories, self.codes)
         self.ui.treeWidget.expandAll()
 
     def select_media(self):
@@ -448,7 +375,7 @@ class DialogCodeAV(QtWidgets.QDialog):
         self.get_coded_text_update_eventfilter_tooltips()
 
     def get_coded_text_update_eventfilter_tooltips(self):
-        """ Called by load_media, update_dialog_codes_and_categories,
+        """ Called by load_media, project_changed,
         Segment_Graphics_Item.link_text_to_segment. """
 
         if self.transcription is None:
@@ -750,46 +677,23 @@ class DialogCodeAV(QtWidgets.QDialog):
         if action == ActionItemAssignSegment:
             self.assign_segment_to_code(selected)
 
-    def update_dialog_codes_and_categories(self):
-        """ Update code and category tree in DialogCodeImage, DialogCodeAV,
-        DialogCodeText, DialogReportCodes.
-        Not using isinstance for other classes, as could not import. There was an import error.
-        Using try except blocks for each instance, as instance may have been deleted. """
-
-        for d in self.dialog_list:
-            if str(type(d)) == "<class 'code_text.DialogCodeText'>":
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.unlight()
-                    d.highlight()
-                    d.get_coded_text_update_eventfilter_tooltips()
-                except RuntimeError as e:
-                    pass
-            if isinstance(d, DialogCodeAV):
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.load_segments()
-                    d.unlight()
-                    d.highlight()
-                    d.get_coded_text_update_eventfilter_tooltips()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'view_image.DialogCodeImage'>":
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.get_coded_areas()
-                    d.draw_coded_areas()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'reports.DialogReportCodes'>":
-                try:
-                    d.get_data()
-                    d.fill_tree()
-                except RuntimeError as e:
-                    pass
+    def project_changed(self, change):
+        """ Apply a code or category change from the project model.
+        Codes and categories are copied from the model, the tree is updated in place
+        where possible. Segments are reloaded when the code names or colours they show
+        change, or when codes were merged or deleted. """
+
+        try:
+            self.codes, self.categories = self.app.get_project_model().get_data()
+            if not update_code_tree(self.ui.treeWidget, change):
+                self.fill_tree()
+            if change.kind in (CODE_MERGED, CODE_DELETED, CODE_RECOLOURED, CODE_RENAMED, RELOADED):
+                self.load_segments()
+                self.unlight()
+                self.highlight()
+                self.get_coded_text_update_eventfilter_tooltips()
+        except RuntimeError as e:
+            pass
 
     def eventFilter(self, object, event):
         """ Using this event filter to identify treeWidgetItem drop events.
@@ -865,7 +769,8 @@ class DialogCodeAV(QtWidgets.QDialog):
             cur.execute("update code_cat set supercatid=? where catid=?",
             [self.categories[found]['supercatid'], self.categories[found]['catid']])
             self.app.conn.commit()
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().move_category(self.categories[found]['catid'],
+                self.categories[found]['supercatid'])
 
         # find the code in the list
         if item.text(1)[0:3] == 'cid':
@@ -888,7 +793,7 @@ class DialogCodeAV(QtWidgets.QDialog):
             cur.execute("update code_name set catid=? where cid=?",
             [self.codes[found]['catid'], self.codes[found]['cid']])
             self.app.conn.commit()
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().move_code(self.codes[found]['cid'], self.codes[found]['catid'])
 
     def merge_codes(self, item, parent):
         """ Merge code or category with another code or category.
@@ -914,9 +819,8 @@ class DialogCodeAV(QtWidgets.QDialog):
             return
         cur.execute("delete from code_name where cid=?", [old_cid, ])
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().merge_codes(old_cid, new_cid)
         self.parent_textEdit.append(msg)
-        self.load_segments()
 
     def add_code(self):
         """ Use add_item dialog to get new code text.
@@ -935,8 +839,10 @@ class DialogCodeAV(QtWidgets.QDialog):
         cur.execute("insert into code_name (name,memo,owner,date,catid,color) values(?,?,?,?,?,?)"
             , (item['name'], item['memo'], item['owner'], item['date'], item['catid'], item['color']))
         self.app.conn.commit()
+        cur.execute("select last_insert_rowid()")
+        item['cid'] = cur.fetchone()[0]
+        self.app.get_project_model().add_code(item)
         self.parent_textEdit.append(_("Code added: ") + item['name'])
-        self.update_dialog_codes_and_categories()
 
     def add_category(self):
         """ Add a new category.
@@ -956,7 +862,10 @@ class DialogCodeAV(QtWidgets.QDialog):
         cur.execute("insert into code_cat (name, memo, owner, date, supercatid) values(?,?,?,?,?)"
             , (item['name'], item['memo'], item['owner'], item['date'], None))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+        cur.execute("select last_insert_rowid()")
+        item['catid'] = cur.fetchone()[0]
+        item['supercatid'] = None
+        self.app.get_project_model().add_category(item)
 
     def delete_category_or_code(self, selected):
         """ Determine if category or code is to be deleted. """
@@ -991,7 +900,7 @@ class DialogCodeAV(QtWidgets.QDialog):
         self.app.conn.commit()
         self.parent_textEdit.append(_("Code deleted: ") + code_['name'])
         selected = None
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().delete_code(code_['cid'])
 
     def delete_category(self, selected):
         """ Find category, remove from database, refresh categories and code data
@@ -1010,12 +919,12 @@ class DialogCodeAV(QtWidgets.QDialog):
             return
         cur = self.app.conn.cursor()
         cur.execute("update code_name set catid=null where catid=?", [category['catid'], ])
-        cur.execute("update code_cat set supercatid=null where catid = ?", [category['catid'], ])
+        cur.execute("update code_cat set supercatid=null where supercatid = ?", [category['catid'], ])
         cur.execute("delete from code_cat where catid = ?", [category['catid'], ])
         self.app.conn.commit()
         self.parent_textEdit.append(_("Category deleted: ") + category['name'])
         selected = None
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().delete_category(category['catid'])
 
     def add_edit_code_memo(self, selected):
         """ View and edit a memo. """
@@ -1042,6 +951,7 @@ class DialogCodeAV(QtWidgets.QDialog):
                 cur = self.app.conn.cursor()
                 cur.execute("update code_name set memo=? where cid=?", (memo, self.codes[found]['cid']))
                 self.app.conn.commit()
+                self.app.get_project_model().set_code_memo(self.codes[found]['cid'], memo)
 
         if selected.text(1)[0:3] == 'cat':
             # find the category in the list
@@ -1065,7 +975,7 @@ class DialogCodeAV(QtWidgets.QDialog):
                 cur = self.app.conn.cursor()
                 cur.execute("update code_cat set memo=? where catid=?", (memo, self.categories[found]['catid']))
                 self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+                self.app.get_project_model().set_category_memo(self.categories[found]['catid'], memo)
 
     def rename_category_or_code(self, selected):
         """ Rename a code or category. Checks that the proposed code or category name is
@@ -1094,7 +1004,7 @@ class DialogCodeAV(QtWidgets.QDialog):
             cur.execute("update code_name set name=? where cid=?", (new_name, self.codes[found]['cid']))
             self.app.conn.commit()
             self.parent_textEdit.append(_("Code renamed: ") + self.codes[found]['name'] + " ==> " + new_name)
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().rename_code(self.codes[found]['cid'], new_name)
             return
 
         if selected.text(1)[0:3] == 'cat':
@@ -1121,7 +1031,7 @@ class DialogCodeAV(QtWidgets.QDialog):
             (new_name, self.categories[found]['catid']))
             self.app.conn.commit()
             self.parent_textEdit.append(_("Category renamed: ") + self.categories[found]['name'] + " ==> " + new_name)
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().rename_category(self.categories[found]['catid'], new_name)
 
     def change_code_color(self, selected):
         """ Change the color of the currently selected code. """
@@ -1147,8 +1057,7 @@ class DialogCodeAV(QtWidgets.QDialog):
         cur.execute("update code_name set color=? where cid=?",
         (self.codes[found]['color'], self.codes[found]['cid']))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
-        #self.load_segments()
+        self.app.get_project_model().recolour_code(self.codes[found]['cid'], new_color)
 
     # Methods used with the textEdit transcribed text
     def unlight(self):
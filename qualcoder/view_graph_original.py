@@ -495,6 +495,7 @@ class TextGraphicsItem(QtWidgets.QGraphicsTextItem):
             cur = self.conn.cursor()
             cur.execute("update code_name set memo=? where cid=?", (self.data['memo'], self.data['cid']))
             self.conn.commit()
+            self.app.get_project_model().set_code_memo(self.data['cid'], self.data['memo'])
         if data['catid'] is not None and data['cid'] is None:
             ui = DialogMemo(self.app, "Memo for Category " + data['name'], data['memo'])
             ui.exec_()
@@ -502,6 +503,7 @@ class TextGraphicsItem(QtWidgets.QGraphicsTextItem):
             cur = self.conn.cursor()
             cur.execute("update code_cat set memo=? where catid=?", (self.data['memo'], self.data['catid']))
             self.conn.commit()
+            self.app.get_project_model().set_category_memo(self.data['catid'], self.data['memo'])
 
     def case_media(self, data):
         """ Display all coded text and media for this code.
@@ -26,7 +26,6 @@ https://github.com/ccbogel/QualCoder
 https://qualcoder.wordpress.com/
 '''
 
-from copy import deepcopy
 import datetime
 import logging
 import os
@@ -42,9 +41,12 @@ from add_item_name import DialogAddItemName
 from confirm_delete import DialogConfirmDelete
 from color_selector import DialogColorSelect
 from color_selector import colors
+from code_tree import fill_code_tree, update_code_tree
 from GUI.ui_dialog_code_image import Ui_Dialog_code_image
 from GUI.ui_dialog_view_image import Ui_Dialog_view_image
 from memo import DialogMemo
+from project_model import CODE_DELETED, CODE_MERGED, CODE_RECOLOURED, CODE_RENAMED, FILE_ADDED, \
+    FILE_DELETED, FILE_RENAMED, RELOADED
 from select_file import DialogSelectFile
 
 path = os.path.abspath(os.path.dirname(__file__))
@@ -103,6 +105,7 @@ class DialogCodeImage(QtWidgets.QDialog):
         QtWidgets.QDialog.__init__(self)
         self.ui = Ui_Dialog_code_image()
         self.ui.setupUi(self)
+        self.app.get_project_model().changed.connect(self.project_changed)
         self.ui.splitter.setSizes([100, 300])
         self.scene = QtWidgets.QGraphicsScene()
         self.ui.graphicsView.setScene(self.scene)
@@ -167,8 +170,6 @@ class DialogCodeImage(QtWidgets.QDialog):
     def fill_tree(self):
         """ Fill tree widget, top level items are main categories and unlinked codes. """
 
-        cats = deepcopy(self.categories)
-        codes = deepcopy(self.codes)
         self.ui.treeWidget.clear()
         self.ui.treeWidget.setColumnCount(3)
         self.ui.treeWidget.setHeaderLabels([_("Name"), _("Id"), _("Memo")])
@@ -176,80 +177,7 @@ class DialogCodeImage(QtWidgets.QDialog):
             self.ui.treeWidget.setColumnHidden(1, True)
         self.ui.treeWidget.header().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
         self.ui.treeWidget.header().setStretchLastSection(False)
-        # add top level categories
-        remove_list = []
-        for c in cats:
-            if c['supercatid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = "Memo"
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                top_item.setToolTip(0, c['owner'] + "\n" + c['date'])
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_list.append(c)
-        for item in remove_list:
-            #try:
-            cats.remove(item)
-            #except Exception as e:
-            #    print(e, item)
-
-        ''' Add child categories. Look at each unmatched category, iterate through tree
-        to add as child, then remove matched categories from the list. '''
-        count = 0
-        while len(cats) > 0 or count < 10000:
-            remove_list = []
-            #logger.debug("cats:" + str(cats))
-            for c in cats:
-                it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-                item = it.value()
-                while item:  # while there is an item in the list
-                    if item.text(1) == 'catid:' + str(c['supercatid']):
-                        memo = ""
-                        if c['memo'] != "":
-                            memo = "Memo"
-                        child = QtWidgets.QTreeWidgetItem([c['name'], 'catid:' + str(c['catid']), memo])
-                        child.setToolTip(0, c['owner'] + "\n" + c['date'])
-                        item.addChild(child)
-                        remove_list.append(c)
-                    it += 1
-                    item = it.value()
-            for item in remove_list:
-                cats.remove(item)
-            count += 1
-
-        # Add unlinked codes as top level items
-        remove_items = []
-        for c in codes:
-            if c['catid'] is None:
-                memo = ""
-                if c['memo'] != "":
-                    memo = "Memo"
-                top_item = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
-                top_item.setToolTip(0, c['owner'] + "\n" + c['date'])
-                top_item.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                top_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-                self.ui.treeWidget.addTopLevelItem(top_item)
-                remove_items.append(c)
-        for item in remove_items:
-            codes.remove(item)
-
-        # Add codes as children to categories
-        for c in codes:
-            it = QtWidgets.QTreeWidgetItemIterator(self.ui.treeWidget)
-            item = it.value()
-            while item:
-                if item.text(1) == 'catid:' + str(c['catid']):
-                    memo = ""
-                    if c['memo'] != "":
-                        memo = "Memo"
-                    child = QtWidgets.QTreeWidgetItem([c['name'], 'cid:' + str(c['cid']), memo])
-                    child.setBackground(0, QBrush(QtGui.QColor(c['color']), Qt.SolidPattern))
-                    child.setToolTip(0, c['owner'] + "\n" + c['date'])
-                    child.setFlags(Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled)
-                    item.addChild(child)
-                    c['catid'] = -1  # Make unmatchable
-                it += 1
-                item = it.value()
+        fill_code_tree(self.ui.treeWidget, self.categories, self.codes)
         self.ui.treeWidget.expandAll()
 
     def select_image(self):
@@ -263,10 +191,11 @@ class DialogCodeImage(QtWidgets.QDialog):
             self.load_image()
 
     def load_image(self):
-        """ Add image to scene if it exists. """
+        """ Add image to scene if it exists. The decoded image is kept in the image cache,
+        so going back to an image does not decode it again. """
 
         source = self.app.project_path + self.file_['mediapath']
-        image = QtGui.QImage(source)
+        image = self.app.get_image_cache().get(source)
         if image.isNull():
             QtWidgets.QMessageBox.warning(None, _("Image Error"), _("Cannot open: ") + source)
             self.close()
@@ -285,48 +214,23 @@ class DialogCodeImage(QtWidgets.QDialog):
         self.ui.horizontalSlider.setValue(99)
         self.draw_coded_areas()
 
-    def update_dialog_codes_and_categories(self):
-        """ Update code and category tree in DialogCodeImage, DialogCodeAV,
-        DialogCodeText, DialogReportCodes.
-        Not using isinstance for other classes as could not import the classes to test
-        against. There was an import error.
-        Using try except blocks for each instance, as instance may have been deleted.
-        """
+    def project_changed(self, change):
+        """ Apply a code, category or file change from the project model.
+        Codes and categories are copied from the model, the tree is updated in place
+        where possible. Coded areas are only reloaded if codes were merged or deleted. """
 
-        for d in self.dialog_list:
-            if str(type(d)) == "<class 'code_text.DialogCodeText'>":
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.unlight()
-                    d.highlight()
-                    d.get_coded_text_update_eventfilter_tooltips()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'view_av.DialogCodeAV'>":
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.load_segments()
-                    d.unlight()
-                    d.highlight()
-                    d.get_coded_text_update_eventfilter_tooltips()
-                except RuntimeError as e:
-                    pass
-            if isinstance(d, DialogCodeImage):
-                try:
-                    d.get_codes_and_categories()
-                    d.fill_tree()
-                    d.get_coded_areas()
-                    d.draw_coded_areas()
-                except RuntimeError as e:
-                    pass
-            if str(type(d)) == "<class 'reports.DialogReportCodes'>":
-                try:
-                    d.get_data()
-                    d.fill_tree()
-                except RuntimeError as e:
-                    pass
+        try:
+            self.codes, self.categories = self.app.get_project_model().get_data()
+            if change.kind in (FILE_ADDED, FILE_RENAMED, FILE_DELETED, RELOADED):
+                self.get_image_files()
+            if not update_code_tree(self.ui.treeWidget, change):
+                self.fill_tree()
+            if change.kind in (CODE_MERGED, CODE_DELETED, RELOADED):
+                self.get_coded_areas()
+            if change.kind in (CODE_MERGED, CODE_DELETED, CODE_RECOLOURED, CODE_RENAMED, RELOADED):
+                self.change_scale()
+        except RuntimeError as e:
+            pass
 
     def change_scale(self):
         """ Resize image. Triggered by user change in slider.
@@ -445,7 +349,6 @@ class DialogCodeImage(QtWidgets.QDialog):
                 item = self.ui.treeWidget.currentItem()
                 parent = self.ui.treeWidget.itemAt(event.pos())
                 self.item_moved_update_data(item, parent)
-                self.update_dialog_codes_and_categories()
 
         if object is self.scene:
             #logger.debug(event.type(), type(event))
@@ -623,7 +526,8 @@ class DialogCodeImage(QtWidgets.QDialog):
             cur.execute("update code_cat set supercatid=? where catid=?",
             [self.categories[found]['supercatid'], self.categories[found]['catid']])
             self.app.conn.commit()
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().move_category(self.categories[found]['catid'],
+                self.categories[found]['supercatid'])
 
         # Find the code in the list
         if item.text(1)[0:3] == 'cid':
@@ -646,7 +550,7 @@ class DialogCodeImage(QtWidgets.QDialog):
             cur.execute("update code_name set catid=? where cid=?",
             [self.codes[found]['catid'], self.codes[found]['cid']])
             self.app.conn.commit()
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().move_code(self.codes[found]['cid'], self.codes[found]['catid'])
 
     def merge_codes(self, item, parent):
         """ Merge code or category with another code or category.
@@ -673,7 +577,7 @@ class DialogCodeImage(QtWidgets.QDialog):
         cur.execute("delete from code_name where cid=?", [old_cid, ])
         self.app.conn.commit()
         self.parent_textEdit.append(msg)
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().merge_codes(old_cid, new_cid)
 
     def add_code(self):
         """ Use add_item dialog to get new code text.
@@ -692,7 +596,9 @@ class DialogCodeImage(QtWidgets.QDialog):
         cur.execute("insert into code_name (name,memo,owner,date,catid,color) values(?,?,?,?,?,?)"
             , (item['name'], item['memo'], item['owner'], item['date'], item['catid'], item['color']))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+        cur.execute("select last_insert_rowid()")
+        item['cid'] = cur.fetchone()[0]
+        self.app.get_project_model().add_code(item)
         self.parent_textEdit.append(_("New code: ") + item['name'])
 
     def add_category(self):
@@ -713,7 +619,10 @@ class DialogCodeImage(QtWidgets.QDialog):
         cur.execute("insert into code_cat (name, memo, owner, date, supercatid) values(?,?,?,?,?)"
             , (item['name'], item['memo'], item['owner'], item['date'], None))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+        cur.execute("select last_insert_rowid()")
+        item['catid'] = cur.fetchone()[0]
+        item['supercatid'] = None
+        self.app.get_project_model().add_category(item)
         self.parent_textEdit.append(_("New category: ") + item['name'])
 
     def delete_category_or_code(self, selected):
@@ -750,7 +659,7 @@ class DialogCodeImage(QtWidgets.QDialog):
         cur.execute("delete from code_text where cid=?", [code_['cid'], ])
         self.app.conn.commit()
         selected = None
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().delete_code(code_['cid'])
 
     def delete_category(self, selected):
         """ Find category, remove from database, refresh categories and code data
@@ -770,11 +679,11 @@ class DialogCodeImage(QtWidgets.QDialog):
         self.parent_textEdit.append(_("Category deleted: ") + category['name'])
         cur = self.app.conn.cursor()
         cur.execute("update code_name set catid=null where catid=?", [category['catid'], ])
-        cur.execute("update code_cat set supercatid=null where catid = ?", [category['catid'], ])
+        cur.execute("update code_cat set supercatid=null where supercatid = ?", [category['catid'], ])
         cur.execute("delete from code_cat where catid = ?", [category['catid'], ])
         self.app.conn.commit()
         selected = None
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().delete_category(category['catid'])
 
     def add_edit_code_memo(self, selected):
         """ View and edit a memo. """
@@ -800,6 +709,7 @@ class DialogCodeImage(QtWidgets.QDialog):
                 cur = self.app.conn.cursor()
                 cur.execute("update code_name set memo=? where cid=?", (memo, self.codes[found]['cid']))
                 self.app.conn.commit()
+                self.app.get_project_model().set_code_memo(self.codes[found]['cid'], memo)
 
         if selected.text(1)[0:3] == 'cat':
             # find the category in the list
@@ -823,7 +733,7 @@ class DialogCodeImage(QtWidgets.QDialog):
                 cur = self.app.conn.cursor()
                 cur.execute("update code_cat set memo=? where catid=?", (memo, self.categories[found]['catid']))
                 self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+                self.app.get_project_model().set_category_memo(self.categories[found]['catid'], memo)
 
     def rename_category_or_code(self, selected):
         """ Rename a code or category. Checks that the proposed code or category name is
@@ -852,7 +762,7 @@ class DialogCodeImage(QtWidgets.QDialog):
             cur.execute("update code_name set name=? where cid=?", (new_name, self.codes[found]['cid']))
             self.app.conn.commit()
             old_name = self.codes[found]['name']
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().rename_code(self.codes[found]['cid'], new_name)
             #self.codes[found]['name'] = new_name
             #selected.setData(0, QtCore.Qt.DisplayRole, new_name)
             self.parent_textEdit.append(_("Code renamed: ") + \
@@ -887,7 +797,7 @@ class DialogCodeImage(QtWidgets.QDialog):
             #selected.setData(0, QtCore.Qt.DisplayRole, new_name)
             self.parent_textEdit.append(_("Category renamed from: ") + \
                 old_name + " ==> " + new_name)
-            self.update_dialog_codes_and_categories()
+            self.app.get_project_model().rename_category(self.categories[found]['catid'], new_name)
 
     def change_code_color(self, selected):
         """ Change the color of the currently selected code. """
@@ -913,7 +823,7 @@ class DialogCodeImage(QtWidgets.QDialog):
         cur.execute("update code_name set color=? where cid=?",
         (self.codes[found]['color'], self.codes[found]['cid']))
         self.app.conn.commit()
-        self.update_dialog_codes_and_categories()
+        self.app.get_project_model().recolour_code(self.codes[found]['cid'], new_color)
 
 
 class DialogViewImage(QtWidgets.QDialog):